@@ -139,7 +139,21 @@ class AIEnhancements:
         """
         Advanced face analysis using multiple AI models
         Returns: age, gender, emotion, quality, landmarks
+        
+        Runs on the face engine process pool when available (models stay
+        loaded per worker); falls back to in-process analysis.
         """
+        try:
+            from face_engine import FAILED, get_face_engine
+            results = get_face_engine().analyze(type(self).__module__, image_bytes)
+            if results is not FAILED:
+                return results
+        except ImportError:
+            pass
+        return self._analyze_face_local(image_bytes)
+    
+    def _analyze_face_local(self, image_bytes: bytes) -> Dict[str, Any]:
+        """Advanced face analysis in the current process"""
         try:
             # Convert bytes to image
             image = Image.open(io.BytesIO(image_bytes))
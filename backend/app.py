@@ -7,9 +7,12 @@ import os
 import sys
 import json
 import time
+import hashlib
 import base64
 import tempfile
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait, TimeoutError as FutureTimeout
 from datetime import datetime
 from pathlib import Path
 from flask import Flask, request, jsonify, send_from_directory, render_template, session, redirect, url_for, send_file
@@ -41,6 +44,13 @@ except Exception as e:
 
 import numpy as np
 import requests
+import circuit_breaker
+import upstream_http
+import upstream_sessions
+from photo_jobs import PhotoJobQueue, PHOTO_JOB_TIMEOUT
+from result_cache import ResultCache
+from singleflight import get_flight, flight_stats
+from face_engine import get_face_engine
 
 # Load environment variables from .env file
 load_dotenv()
@@ -148,18 +158,22 @@ import base64
 # Import functions from clearance_face_search.py
 from clearance_face_search import (
     ensure_token, call_search, parse_people_from_response,
-    load_image_file_to_encoding, get_encoding_from_base64_face,
-    save_face_image, USE_FACE_LIB
+    load_image_file_to_encoding, get_encoding_from_base64_face, get_encodings_from_base64_faces,
+    save_face_image, get_search_backfill, _login_server_116, server_116_get, USE_FACE_LIB,
+    purge_identity_cache, get_identity_cache_stats, get_face_encoding_store, match_faces,
+    get_face_index, index_face_async, build_face_index, get_face_index_build_status, search_face_index,
+    attach_identity_cache_invalidations, publish_identity_cache_purge
 )
 
+# Identity cache purges made by other workers / the Telegram bot apply here too
+attach_identity_cache_invalidations(db)
+
 # Konfigurasi Gemini AI
 # Try to get from database first, then fallback to environment variable
 def get_gemini_api_key():
     """Get Gemini API key from database or environment variable"""
     try:
-        # Try to get from database first
-        from database import UserDatabase
-        db = UserDatabase()
+        # Try to get from database first (shared instance, no extra pool)
         api_key = db.get_api_key('GEMINI')
         if api_key:
             return api_key
@@ -858,6 +872,8 @@ logger = logging.getLogger(__name__)
 FAMILY_API_BASE = "http://10.1.54.224:4646/json/clearance/dukcapil/family"
 FAMILY_API_ALT = "http://10.1.54.116:27682/api/v1/ktp/internal"
 PHONE_API_BASE = "http://10.1.54.224:4646/json/clearance/phones"
+# Phone API dipantau oleh prober (lihat circuit_breaker.py); probe ke root host saja
+_phone_breaker = circuit_breaker.register('phone_api', PHONE_API_BASE.split('/json/', 1)[0] + '/')
 
 # Profiling Reports API Endpoints
 @app.route('/api/profiling/reports', methods=['OPTIONS'])
@@ -870,6 +886,31 @@ def handle_profiling_reports_options():
     }
     return '', 200, response_headers
 
+def build_profiling_report_summary(item):
+    """Build a list-view report from the summary columns of a profiling_data row"""
+    if item.get('thumbnail_url'):
+        foto_url = item['thumbnail_url']
+    elif item.get('has_photo'):
+        foto_url = f"/api/profiling-data/{item['id']}/photo"
+    else:
+        foto_url = ''
+    
+    return {
+        'id': item['id'],
+        'nama': item.get('full_name') or 'N/A',
+        'nik': item.get('nik') or 'N/A',
+        'ttl': item.get('ttl') or 'N/A, N/A',
+        'alamat': item.get('alamat') or 'N/A',
+        'kab_kota': (item.get('kab_kota') or 'Jambi').title(),
+        'prov': (item.get('prov') or 'Jambi').title(),
+        'kategori': 'Identity Search' if item['search_type'] == 'identity' else item['search_type'].title(),
+        'subkategori': 'KTP Search',
+        'status_verifikasi': 'verified',
+        'foto_url': foto_url,
+        'tanggal_input': item['search_timestamp'],
+        'search_type': item['search_type']
+    }
+
 @app.route('/api/profiling/reports', methods=['GET'])
 def get_profiling_reports():
     """Get profiling reports with filters"""
@@ -902,6 +943,7 @@ def get_profiling_reports():
         limit = int(request.args.get('limit', 50))
         sort_by = request.args.get('sort_by', 'tanggal_input')
         sort_order = request.args.get('sort_order', 'DESC')
+        cursor = request.args.get('cursor')  # keyset cursor, replaces page when given
         
         offset = (page - 1) * limit
         
@@ -919,55 +961,32 @@ def get_profiling_reports():
             elif 'face' in kategori.lower():
                 search_type = 'face'
         
+        # Search and region/date filters are applied in SQL so pages and totals agree
+        filters = {
+            'query': search_query,
+            'prov': prov,
+            'kab_kota': kab_kota,
+            'kec': kec,
+            'start_date': start_date,
+            'end_date': end_date
+        }
+        
         raw_data = db.get_profiling_data(
             user_id=user_id, 
             search_type=search_type, 
             limit=limit, 
-            offset=offset
+            offset=offset,
+            cursor=cursor,
+            summary=True,
+            **filters
         )
         
-        # Transform data to match frontend expectations
-        reports = []
-        for item in raw_data:
-            # Extract person data from JSON - handle None values
-            person_data = item.get('person_data') or {}
-            family_data = item.get('family_data') or {}
-            phone_data = item.get('phone_data') or []
-            face_data = item.get('face_data') or {}
-            
-            # Create report object
-            report = {
-                'id': item['id'],
-                'nama': person_data.get('full_name', 'N/A'),
-                'nik': person_data.get('ktp_number', 'N/A'),
-                'ttl': f"{person_data.get('tempat_lahir', 'N/A')}, {person_data.get('tanggal_lahir', 'N/A')}",
-                'alamat': person_data.get('alamat', 'N/A'),
-                'kab_kota': 'Jambi',  # Default since not in person_data
-                'prov': 'Jambi',
-                'kategori': 'Identity Search' if item['search_type'] == 'identity' else item['search_type'].title(),
-                'subkategori': 'KTP Search',
-                'status_verifikasi': 'verified',
-                'foto_url': person_data.get('face', ''),
-                'tanggal_input': item['search_timestamp'],
-                'search_type': item['search_type'],
-                'person_data': person_data,
-                'family_data': family_data,
-                'phone_data': phone_data,
-                'face_data': face_data
-            }
-            
-            # Apply search filter if provided
-            if search_query:
-                search_lower = search_query.lower()
-                if (search_lower in report['nama'].lower() or 
-                    search_lower in report['nik'].lower() or 
-                    search_lower in report['alamat'].lower()):
-                    reports.append(report)
-            else:
-                reports.append(report)
+        # Transform data to match frontend expectations (list view: summary columns only,
+        # full blobs are loaded by /api/profiling/reports/<id> when a detail is opened)
+        reports = [build_profiling_report_summary(item) for item in raw_data]
         
         # Get total count
-        total_count = db.get_profiling_data_count(user_id=user_id, search_type=search_type)
+        total_count = db.get_profiling_data_count(user_id=user_id, search_type=search_type, **filters)
         
         result = {
             'success': True,
@@ -976,7 +995,8 @@ def get_profiling_reports():
                 'page': page,
                 'limit': limit,
                 'total': total_count,
-                'pages': (total_count + limit - 1) // limit
+                'pages': (total_count + limit - 1) // limit,
+                'next_cursor': db.encode_profiling_cursor(raw_data[-1]) if len(raw_data) == limit else None
             }
         }
         print(f"DEBUG: Returning {len(reports)} reports, total count: {total_count}")
@@ -996,15 +1016,26 @@ def get_profiling_report(report_id):
         if not user:
             return jsonify({'success': False, 'error': 'Unauthorized'}), 401
         
-        # Get report
-        report = db.get_profiling_report_by_id(report_id)
-        if not report:
+        # Get report (full row, including JSON blobs)
+        item = db.get_profiling_data_by_id(report_id)
+        if not item:
             return jsonify({'success': False, 'error': 'Report not found'}), 404
         
         # Check permissions (non-admin users can only see their own reports)
-        if user['role'] != 'admin' and report['user_id'] != user['id']:
+        if user['role'] != 'admin' and item['user_id'] != user['id']:
             return jsonify({'success': False, 'error': 'Access denied'}), 403
         
+        report = build_profiling_report_summary(item)
+        report.update({
+            'user_id': item['user_id'],
+            'person_data': item.get('person_data') or {},
+            'family_data': item.get('family_data') or {},
+            'phone_data': item.get('phone_data') or [],
+            'face_data': item.get('face_data') or {}
+        })
+        if report['person_data'].get('face'):
+            report['foto_url'] = report['person_data']['face']
+        
         return jsonify({'success': True, 'data': report})
         
     except Exception as e:
@@ -1190,12 +1221,7 @@ def preview_profiling_document():
         reports = []
         for record_id in record_ids:
             # Get data from profiling_data table
-            raw_data = db.get_profiling_data(limit=1000)  # Get all data first
-            report_data = None
-            for item in raw_data:
-                if item['id'] == record_id:
-                    report_data = item
-                    break
+            report_data = db.get_profiling_data_by_id(record_id)
             
             if report_data:
                 # Allow all users to access all data (no permission check)
@@ -1274,12 +1300,7 @@ def export_profiling_document():
         reports = []
         for record_id in record_ids:
             # Get data from profiling_data table
-            raw_data = db.get_profiling_data(limit=1000)  # Get all data first
-            report_data = None
-            for item in raw_data:
-                if item['id'] == record_id:
-                    report_data = item
-                    break
+            report_data = db.get_profiling_data_by_id(record_id)
             
             if report_data:
                 # Allow all users to access all data (no permission check)
@@ -2050,7 +2071,7 @@ def download_foto(url_foto, timeout=30):
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
-        response = requests.get(url_foto, headers=headers, timeout=timeout)
+        response = upstream_http.get(url_foto, headers=headers, timeout=timeout)
         response.raise_for_status()
         
         if response.headers.get('content-type', '').startswith('image/'):
@@ -2063,233 +2084,63 @@ def download_foto(url_foto, timeout=30):
         logger.error(f"Error downloading foto from {url_foto}: {e}")
         return None
 
-def detect_text_watermark(image_cv):
-    """Detect watermark with minimal impact on image quality"""
-    gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-    h, w = gray.shape
-    
-    # Initialize mask
-    watermark_mask = np.zeros_like(gray)
-    
-    # Method 1: Detect very bright pixels only (watermark text overlays)
-    # Use higher threshold to avoid affecting normal image content
-    _, bright_mask = cv2.threshold(gray, 220, 255, cv2.THRESH_BINARY)
-    
-    # Method 2: Detect semi-transparent white overlays in HSV
-    hsv = cv2.cvtColor(image_cv, cv2.COLOR_BGR2HSV)
-    
-    # More conservative ranges for semi-transparent white overlays
-    white_ranges = [
-        ([0, 0, 200], [180, 20, 255]),   # High threshold for semi-transparent
-        ([0, 0, 220], [180, 15, 255]),   # Very high threshold
-        ([0, 0, 240], [180, 10, 255]),   # Extremely high threshold
-    ]
-    
-    for lower, upper in white_ranges:
-        white_mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
-        watermark_mask = cv2.bitwise_or(watermark_mask, white_mask)
-    
-    # Method 3: Detect small rectangular regions that might be text
-    # Find contours in bright areas with high threshold
-    contours, _ = cv2.findContours(bright_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    for contour in contours:
-        x, y, w_rect, h_rect = cv2.boundingRect(contour)
-        # Check if it's a reasonable size for text characters
-        if 3 < w_rect < 40 and 2 < h_rect < 20:
-            # Check if it's bright enough to be watermark text
-            roi = gray[y:y+h_rect, x:x+w_rect]
-            if np.mean(roi) > 220:  # High threshold for watermark
-                # Small padding to cover the character
-                padding = 1
-                x1 = max(0, x - padding)
-                y1 = max(0, y - padding)
-                x2 = min(w, x + w_rect + padding)
-                y2 = min(h, y + h_rect + padding)
-                cv2.rectangle(watermark_mask, (x1, y1), (x2, y2), 255, -1)
-    
-    # Method 4: Detect text patterns using morphological operations
-    # Use smaller kernels to avoid affecting large areas
-    kernel_horizontal = cv2.getStructuringElement(cv2.MORPH_RECT, (8, 1))
-    horizontal = cv2.morphologyEx(gray, cv2.MORPH_OPEN, kernel_horizontal)
-    _, text_h_mask = cv2.threshold(horizontal, 220, 255, cv2.THRESH_BINARY)
-    
-    kernel_vertical = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 8))
-    vertical = cv2.morphologyEx(gray, cv2.MORPH_OPEN, kernel_vertical)
-    _, text_v_mask = cv2.threshold(vertical, 220, 255, cv2.THRESH_BINARY)
-    
-    watermark_mask = cv2.bitwise_or(watermark_mask, text_h_mask)
-    watermark_mask = cv2.bitwise_or(watermark_mask, text_v_mask)
-    
-    # Clean up the mask
-    # Remove small noise
-    kernel_clean = np.ones((2,2), np.uint8)
-    watermark_mask = cv2.morphologyEx(watermark_mask, cv2.MORPH_OPEN, kernel_clean)
-    
-    # Close small gaps
-    kernel_close = np.ones((2,2), np.uint8)
-    watermark_mask = cv2.morphologyEx(watermark_mask, cv2.MORPH_CLOSE, kernel_close)
-    
-    # Minimal dilation to preserve image quality
-    kernel_dilate = np.ones((2,2), np.uint8)
-    watermark_mask = cv2.dilate(watermark_mask, kernel_dilate, iterations=1)
-    
-    return watermark_mask
+# Watermark removal runs on a background queue (photo_jobs.py): requests get
+# the clean photo URL at once; /static/clean_photos/<nik>.jpg answers 202 with
+# a placeholder while a job is pending and GET /api/photo-jobs/<nik> reports its status
+photo_jobs = PhotoJobQueue(CLEAN_PHOTOS_FOLDER, download_foto)
+PHOTO_JOB_RETRY_AFTER = 2  # seconds, Retry-After of the pending-photo placeholder
 
-def clean_watermark(image_bytes):
-    """Clean watermark with minimal impact on image quality"""
-    try:
-        logger.info("Starting conservative watermark removal process")
-        
-        # Convert bytes to PIL Image
-        from PIL import Image
-        image = Image.open(io.BytesIO(image_bytes))
-        image_array = np.array(image)
-        
-        # Convert to OpenCV format (BGR)
-        if len(image_array.shape) == 3:
-            image_cv = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-        else:
-            image_cv = image_array
-        
-        # Create a copy for processing
-        result = image_cv.copy()
-        
-        # Detect watermark
-        watermark_mask = detect_text_watermark(image_cv)
-        
-        # Apply inpainting if watermark detected
-        if np.any(watermark_mask):
-            mask_area = np.sum(watermark_mask > 0)
-            total_area = watermark_mask.shape[0] * watermark_mask.shape[1]
-            mask_ratio = mask_area / total_area
-            
-            logger.info(f"Watermark detected, covers {mask_ratio:.2%} of image")
-            
-            # Use conservative inpainting to preserve image quality
-            if mask_ratio > 0.1:  # Large watermark area
-                result = cv2.inpaint(result, watermark_mask, 3, cv2.INPAINT_TELEA)
-                logger.info("Using Telea inpainting (radius=3) for large area")
-            else:  # Small watermark area
-                result = cv2.inpaint(result, watermark_mask, 2, cv2.INPAINT_TELEA)
-                logger.info("Using Telea inpainting (radius=2) for small area")
-            
-            # Single cleanup pass for remaining artifacts
-            logger.info("Applying single cleanup pass")
-            
-            # Convert to HSV for color-based cleaning
-            hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV)
-            
-            # Remove only very bright white overlays
-            cleanup_thresholds = [220, 240]
-            
-            for threshold in cleanup_thresholds:
-                lower_white = np.array([0, 0, threshold])
-                upper_white = np.array([180, 20, 255])  # Narrow saturation range
-                white_mask = cv2.inRange(hsv, lower_white, upper_white)
-                
-                if np.any(white_mask):
-                    # Minimal dilation for white areas
-                    white_mask_dilated = cv2.dilate(white_mask, np.ones((2,2), np.uint8), iterations=1)
-                    result = cv2.inpaint(result, white_mask_dilated, 1, cv2.INPAINT_TELEA)
-                    logger.info(f"Cleanup: Removed white artifacts (threshold={threshold})")
-        else:
-            logger.info("No watermark detected")
-        
-        # Convert back to RGB
-        result_rgb = cv2.cvtColor(result, cv2.COLOR_BGR2RGB)
-        
-        # Convert back to PIL Image
-        result_image = Image.fromarray(result_rgb)
-        
-        # Convert to bytes with high quality
-        output_buffer = io.BytesIO()
-        result_image.save(output_buffer, format='JPEG', quality=98)
-        cleaned_bytes = output_buffer.getvalue()
-        
-        logger.info(f"Successfully cleaned watermark with minimal impact, output size: {len(cleaned_bytes)} bytes")
-        return cleaned_bytes
-        
-    except Exception as e:
-        logger.error(f"Error in conservative watermark removal: {e}")
-        return None
-
-def process_and_save_clean_photo_from_base64(nik, base64_data, force_reprocess=False):
-    """Process photo from base64 data to remove watermark and save to clean_photos folder"""
+def process_and_save_clean_photo_from_base64(nik, base64_data, force_reprocess=False, wait=0):
+    """Queue watermark removal of a base64 photo; returns the clean photo URL (None on failure).
+    
+    With wait > 0 the call blocks up to wait seconds for the job to finish.
+    """
     try:
-        # Check if clean photo already exists
-        clean_photo_path = CLEAN_PHOTOS_FOLDER / f"{nik}.jpg"
-        
-        if clean_photo_path.exists() and not force_reprocess:
-            logger.info(f"Clean photo already exists for NIK {nik}, using cached version")
-            return f"/static/clean_photos/{nik}.jpg"
-        
-        # Decode base64 data
-        logger.info(f"Processing base64 photo for NIK {nik}")
-        
         # Remove data URL prefix if present
         if base64_data.startswith('data:image/'):
             base64_data = base64_data.split(',')[1]
         
-        # Decode base64 to bytes
-        import base64
-        image_bytes = base64.b64decode(base64_data)
-        
-        # Clean watermark using AI inpainting
-        cleaned_bytes = clean_watermark(image_bytes)
-        
-        if cleaned_bytes:
-            # Save cleaned photo
-            with open(clean_photo_path, 'wb') as f:
-                f.write(cleaned_bytes)
-            
-            logger.info(f"Successfully saved clean photo for NIK {nik}")
-            return f"/static/clean_photos/{nik}.jpg"
-        else:
-            logger.error(f"Failed to clean watermark for NIK {nik}")
+        job = photo_jobs.submit(nik, image_bytes=base64.b64decode(base64_data), force=force_reprocess)
+        if wait:
+            job = photo_jobs.wait(nik, wait) or job
+        if job['status'] == 'failed':
+            logger.error(f"Failed to clean watermark for NIK {nik}: {job.get('error')}")
             return None
-            
+        return job['url']
     except Exception as e:
         logger.error(f"Error processing base64 photo for NIK {nik}: {e}")
         return None
 
-def process_and_save_clean_photo(nik, url_foto, force_reprocess=False):
-    """Process photo to remove watermark and save to clean_photos folder"""
+def process_and_save_clean_photo(nik, url_foto, force_reprocess=False, wait=0):
+    """Queue download + watermark removal of a photo URL; returns the clean photo URL (None on failure).
+    
+    With wait > 0 the call blocks up to wait seconds for the job to finish.
+    """
     try:
-        # Check if clean photo already exists
-        clean_photo_path = CLEAN_PHOTOS_FOLDER / f"{nik}.jpg"
-        if clean_photo_path.exists() and not force_reprocess:
-            logger.info(f"Clean photo already exists for NIK {nik}, using cache")
-            return f"/static/clean_photos/{nik}.jpg"
-        elif clean_photo_path.exists() and force_reprocess:
+        if force_reprocess:
             logger.info(f"Force reprocessing photo for NIK {nik}")
-        
-        # Download original photo
-        logger.info(f"Processing photo for NIK {nik}")
-        original_bytes = download_foto(url_foto)
-        if not original_bytes:
-            logger.warning(f"Failed to download photo for NIK {nik}")
-            return None
-        
-        # Clean watermark
-        cleaned_bytes = clean_watermark(original_bytes)
-        if not cleaned_bytes:
-            logger.warning(f"Failed to clean watermark for NIK {nik}")
+        job = photo_jobs.submit(nik, url=url_foto, force=force_reprocess)
+        if wait:
+            job = photo_jobs.wait(nik, wait) or job
+        if job['status'] == 'failed':
+            logger.warning(f"Failed to process clean photo for NIK {nik}: {job.get('error')}")
             return None
-        
-        # Save cleaned photo
-        with open(clean_photo_path, 'wb') as f:
-            f.write(cleaned_bytes)
-        
-        logger.info(f"Successfully saved clean photo for NIK {nik} at {clean_photo_path}")
-        return f"/static/clean_photos/{nik}.jpg"
-        
+        return job['url']
     except Exception as e:
         logger.error(f"Error processing clean photo for NIK {nik}: {e}")
         return None
 
 def convert_family_data_format(api_response, nik, nkk, token=None):
     """Convert API family data to expected frontend format"""
+    household = _convert_family_members(api_response, nkk, token)
+    return _family_view(household, nik) if household else None
+
+def _convert_family_members(api_response, nkk, token=None):
+    """Convert the members of an API family response, independent of who is looking them up.
+    
+    The raw API members are kept in '_family_members' so _family_view can
+    derive the head of family and relationships for a given NIK.
+    """
     try:
         # Extract family members from API response
         family_members = []
@@ -2310,20 +2161,6 @@ def convert_family_data_format(api_response, nik, nkk, token=None):
             
         print(f"[INFO] Converting {len(family_members)} family members to frontend format")
         
-        # Find the head of family (usually the first one or the one matching the searched NIK)
-        kepala_keluarga = None
-        kepala_keluarga_data = None
-        
-        for member in family_members:
-            if member.get('ktp_number') == nik or member.get('nik') == nik:
-                kepala_keluarga = member.get('full_name', 'Unknown')
-                kepala_keluarga_data = member
-                break
-        
-        if not kepala_keluarga:
-            kepala_keluarga = family_members[0].get('full_name', 'Unknown')
-            kepala_keluarga_data = family_members[0]
-        
         # Convert each family member to expected format
         anggota_keluarga = []
         for member in family_members:
@@ -2372,17 +2209,9 @@ def convert_family_data_format(api_response, nik, nkk, token=None):
                     # Try to extract name from other fields or use NIK as identifier
                     member_name = f"Anggota Keluarga {member_nik[-4:]}" if member_nik != 'N/A' else 'N/A'
             
-            # Determine relationship
-            relationship = 'Anggota Keluarga'
-            if member_nik == nik:
-                relationship = 'Kepala Keluarga'
-            elif member.get('sex') == 'P' and member_nik != nik:
-                # Check if this is the spouse (simplified logic)
-                relationship = 'Istri' if member.get('sex') == 'P' else 'Suami'
-            
             converted_member = {
                 'nama': member_name,
-                'hubungan': relationship,
+                'hubungan': 'Anggota Keluarga',
                 'nik': member_nik,
                 'tanggal_lahir': member_birth,
                 'tempat_lahir': member_birth_place,
@@ -2394,22 +2223,121 @@ def convert_family_data_format(api_response, nik, nkk, token=None):
             }
             anggota_keluarga.append(converted_member)
         
-        # Create the final format
-        converted_data = {
-            'kepala_keluarga': kepala_keluarga,
-            'nkk': nkk or kepala_keluarga_data.get('family_cert_number', 'N/A'),
-            'alamat_keluarga': kepala_keluarga_data.get('address', 'N/A'),
-            'anggota_keluarga': anggota_keluarga
+        # Caller-independent household: the requester's view is built by _family_view
+        return {
+            'nkk': nkk or family_members[0].get('family_cert_number'),
+            'anggota_keluarga': anggota_keluarga,
+            '_family_members': family_members
         }
         
-        print(f"[SUCCESS] Converted family data: {len(anggota_keluarga)} members, head: {kepala_keluarga}")
-        return converted_data
-        
     except Exception as e:
         print(f"[ERROR] Failed to convert family data format: {e}")
         return None
 
+def _family_view(household, nik):
+    """Family data as seen from nik: head of family and relationships are relative to the searched NIK"""
+    family_members = household.get('_family_members')
+    if not family_members:
+        # Already caller-independent (server 116 results)
+        return household
+    
+    # Find the head of family (usually the first one or the one matching the searched NIK)
+    kepala_keluarga_data = family_members[0]
+    for member in family_members:
+        if member.get('ktp_number') == nik or member.get('nik') == nik:
+            kepala_keluarga_data = member
+            break
+    kepala_keluarga = kepala_keluarga_data.get('full_name', 'Unknown')
+    
+    anggota_keluarga = []
+    for member, converted_member in zip(family_members, household.get('anggota_keluarga', [])):
+        member_nik = converted_member.get('nik')
+        # Determine relationship
+        relationship = 'Anggota Keluarga'
+        if member_nik == nik:
+            relationship = 'Kepala Keluarga'
+        elif member.get('sex') == 'P':
+            # Check if this is the spouse (simplified logic)
+            relationship = 'Istri'
+        anggota_keluarga.append(dict(converted_member, hubungan=relationship))
+    
+    print(f"[SUCCESS] Converted family data: {len(anggota_keluarga)} members, head: {kepala_keluarga}")
+    return {
+        'kepala_keluarga': kepala_keluarga,
+        'nkk': household.get('nkk') or kepala_keluarga_data.get('family_cert_number', 'N/A'),
+        'alamat_keluarga': kepala_keluarga_data.get('address', 'N/A'),
+        'anggota_keluarga': anggota_keluarga
+    }
+
+# Concurrent identical family/phone lookups share one upstream call
+_family_flight = get_flight('family_data')
+_phone_flight = get_flight('phone_data')
+
+def _uses_fallback_token(token):
+    return bool(token and token.startswith("fallback_token_"))
+
+# Family data per NKK, shared by every member of the household, plus a
+# NIK -> NKK index so a NIK-only lookup of a known member is served locally.
+# Keys: 'household:<nkk>' -> caller-independent household (see
+# _convert_family_members), 'nik:<nik>' -> nkk. Each caller gets its own
+# _family_view of the cached household.
+_family_cache = ResultCache(
+    'family_data',
+    max_size=int(os.environ.get('FAMILY_CACHE_SIZE', '5000')),
+    ttl=float(os.environ.get('FAMILY_CACHE_TTL', '3600')),
+    disk_dir=os.environ.get('FAMILY_CACHE_DIR') or None,
+    disk_max_files=int(os.environ.get('FAMILY_CACHE_DISK_MAX_FILES', '50000')),
+)
+
+# Returned by _fetch_family_data when every family API failed (a string, so it
+# survives the deep copy single-flight waiters get)
+_FAMILY_APIS_FAILED = 'family_apis_failed'
+
+def _valid_id(value):
+    value = str(value or '').strip()
+    return value if value.isdigit() else None
+
+def _cache_family_data(family_data, nik, nkk):
+    """Store real family data under its NKK and index every member's NIK"""
+    if not isinstance(family_data, dict) or not family_data.get('anggota_keluarga'):
+        return
+    nkk = _valid_id(family_data.get('nkk')) or _valid_id(nkk)
+    if not nkk:
+        return
+    _family_cache.set(f'household:{nkk}', family_data)
+    member_niks = {_valid_id(member.get('nik')) for member in family_data['anggota_keluarga']
+                   if isinstance(member, dict)}
+    member_niks.add(_valid_id(nik))
+    for member_nik in member_niks - {None}:
+        _family_cache.set(f'nik:{member_nik}', nkk)
+
 def get_family_data(nik, nkk=None, token=None, person_data=None):
+    """Get family data for a person.
+    
+    Served from the NKK cache when the household is known (the NKK may come
+    from the NIK index); otherwise fetched upstream with identical in-flight
+    lookups coalesced, and cached for every member.
+    """
+    nkk_lookup = _valid_id(nkk)
+    if not nkk_lookup and _valid_id(nik):
+        nkk_lookup, _ = _family_cache.get(f'nik:{_valid_id(nik)}')
+    if nkk_lookup:
+        cached, tier = _family_cache.get(f'household:{nkk_lookup}')
+        if cached:
+            print(f"[FAMILY_CACHE] Hit ({tier}) NKK {nkk_lookup} untuk NIK {nik}", file=sys.stderr)
+            return _family_view(cached, nik)
+    
+    key = (nik, nkk_lookup or nkk, _uses_fallback_token(token))
+    result = _family_flight.do(key, _fetch_family_data, nik, nkk_lookup or nkk, token, person_data)
+    if result == _FAMILY_APIS_FAILED:
+        return _fallback_family_data(nik, nkk_lookup or nkk, person_data)
+    _cache_family_data(result, nik, nkk_lookup or nkk)
+    return _family_view(result, nik) if isinstance(result, dict) else result
+
+def get_family_cache_stats():
+    return _family_cache.stats()
+
+def _fetch_family_data(nik, nkk=None, token=None, person_data=None):
     """
     Get family data for a person - FLEKSIBEL dan CERDAS
     - Jika server 224 hidup → gunakan server 224
@@ -2422,14 +2350,13 @@ def get_family_data(nik, nkk=None, token=None, person_data=None):
         print(f"[INFO] ✅ CERDAS: Server 224 mati, langsung gunakan server 116 untuk family data", file=sys.stderr)
         # Langsung ke server 116 identity API tanpa coba server 224
         if nkk:
-            from clearance_face_search import _login_server_116
             session = _login_server_116()
             if session:
                 search_params = {'family_cert_number': nkk}
                 search_url = f'{SERVER_116_TOOLKIT_BASE}/identity/search'
                 print(f"[INFO] Server 116 family search URL: {search_url}?family_cert_number={nkk}", file=sys.stderr)
                 try:
-                    search_response = session.get(search_url, params=search_params, timeout=20)  # Increased untuk server yang lebih lambat
+                    search_response = server_116_get(session, search_url, params=search_params, timeout=20)  # Increased untuk server yang lebih lambat
                     print(f"[INFO] Server 116 family response status: {search_response.status_code}", file=sys.stderr)
                     
                     if search_response.status_code == 200:
@@ -2496,7 +2423,7 @@ def get_family_data(nik, nkk=None, token=None, person_data=None):
         print(f"[FAMILY_DATA] 🔍 Fetching family data for NIK: {nik}, NKK: {nkk}", file=sys.stderr)
         print(f"[FAMILY_DATA] 🌐 API URL: {FAMILY_API_BASE}", file=sys.stderr)
         print(f"[FAMILY_DATA] 📋 Params: {params}", file=sys.stderr)
-        response = requests.get(FAMILY_API_BASE, params=params, headers=headers, timeout=20)  # Increased untuk server yang lebih lambat
+        response = upstream_http.get(FAMILY_API_BASE, params=params, headers=headers, timeout=20)  # Increased untuk server yang lebih lambat
         print(f"[FAMILY_DATA] 📡 Response status: {response.status_code}", file=sys.stderr)
         response.raise_for_status()
         data = response.json()
@@ -2506,7 +2433,7 @@ def get_family_data(nik, nkk=None, token=None, person_data=None):
             print(f"[FAMILY_DATA] 📊 Data structure: {list(data['data'].keys()) if isinstance(data['data'], dict) else 'List'}", file=sys.stderr)
         
         # Convert API response to expected format
-        converted_data = convert_family_data_format(data, nik, nkk, token)
+        converted_data = _convert_family_members(data, nkk, token)
         if converted_data:
             anggota_count = len(converted_data.get('anggota_keluarga', []))
             print(f"[FAMILY_DATA] ✅ Successfully converted: {anggota_count} anggota keluarga", file=sys.stderr)
@@ -2532,13 +2459,13 @@ def get_family_data(nik, nkk=None, token=None, person_data=None):
                 }
                 print(f"[FAMILY_DATA] 🔄 Trying alternative API: {FAMILY_API_ALT}", file=sys.stderr)
                 print(f"[FAMILY_DATA] 📋 Alt params: {alt_params}", file=sys.stderr)
-                response = requests.get(FAMILY_API_ALT, params=alt_params, headers=headers, timeout=20)  # Increased timeout
+                response = upstream_http.get(FAMILY_API_ALT, params=alt_params, headers=headers, timeout=20)  # Increased timeout
                 print(f"[FAMILY_DATA] 📡 Alt response status: {response.status_code}", file=sys.stderr)
                 response.raise_for_status()
                 data = response.json()
                 print(f"[FAMILY_DATA] ✅ Alt response received: {len(data.get('data', []))} family members found", file=sys.stderr)
                 # Convert API response to expected format
-                converted_data = convert_family_data_format(data, nik, nkk, token)
+                converted_data = _convert_family_members(data, nkk, token)
                 if converted_data:
                     anggota_count = len(converted_data.get('anggota_keluarga', []))
                     print(f"[FAMILY_DATA] ✅ Alt API success: {anggota_count} anggota keluarga", file=sys.stderr)
@@ -2558,15 +2485,13 @@ def get_family_data(nik, nkk=None, token=None, person_data=None):
             if nkk:
                 print(f"[FAMILY_DATA] 🔄 Trying server 116 identity API as fallback for family search", file=sys.stderr)
                 print(f"[FAMILY_DATA] 📡 SERVER_116_TOOLKIT_BASE: {SERVER_116_TOOLKIT_BASE}", file=sys.stderr)
-                # Import session helper from clearance_face_search
-                from clearance_face_search import _login_server_116
                 session = _login_server_116()
                 if session:
                     search_params = {'family_cert_number': nkk}
                     search_url = f'{SERVER_116_TOOLKIT_BASE}/identity/search'
                     print(f"[FAMILY_DATA] 🌐 Server 116 URL: {search_url}", file=sys.stderr)
                     print(f"[FAMILY_DATA] 📋 Params: {search_params}", file=sys.stderr)
-                    search_response = session.get(search_url, params=search_params, timeout=20)  # Increased timeout
+                    search_response = server_116_get(session, search_url, params=search_params, timeout=20)  # Increased timeout
                     print(f"[FAMILY_DATA] 📡 Server 116 response status: {search_response.status_code}", file=sys.stderr)
                     if search_response.status_code == 200:
                         data = search_response.json()
@@ -2628,7 +2553,10 @@ def get_family_data(nik, nkk=None, token=None, person_data=None):
     print(f"[FAMILY_DATA]   1. Apakah server dapat mengakses IP private (10.1.54.224, 10.1.54.116)?", file=sys.stderr)
     print(f"[FAMILY_DATA]   2. Apakah SERVER_116_BASE environment variable sudah di-set dengan benar?", file=sys.stderr)
     print(f"[FAMILY_DATA]   3. Apakah network firewall memblokir akses ke server internal?", file=sys.stderr)
-    
+    return _FAMILY_APIS_FAILED
+
+def _fallback_family_data(nik, nkk=None, person_data=None):
+    """Placeholder family data when every family API failed (never cached)"""
     # Return fallback family data to prevent loading timeout
     print(f"[FAMILY_DATA] 🔄 FALLBACK: Returning comprehensive family data for NIK {nik}", file=sys.stderr)
     
@@ -2719,6 +2647,10 @@ def get_family_data(nik, nkk=None, token=None, person_data=None):
         }
 
 def get_phone_data(nik, token=None):
+    """Get phone number data for a person (identical in-flight lookups are coalesced)"""
+    return _phone_flight.do((nik, _uses_fallback_token(token)), _fetch_phone_data, nik, token)
+
+def _fetch_phone_data(nik, token=None):
     """Get phone number data for a person"""
     # PENTING: Skip phone data jika server 224 mati (untuk kecepatan)
     # Phone data tidak tersedia di server 116, jadi langsung return None
@@ -2726,6 +2658,11 @@ def get_phone_data(nik, token=None):
         print(f"[INFO] Server 224 mati, skip phone data untuk NIK: {nik}", file=sys.stderr)
         return None
     
+    # Phone API ditandai mati oleh circuit breaker: skip tanpa menunggu timeout
+    if not _phone_breaker.allow_request():
+        print(f"[INFO] Phone API tidak tersedia (circuit open), skip phone data untuk NIK: {nik}", file=sys.stderr)
+        return None
+    
     try:
         url = f"{PHONE_API_BASE}/{nik}"
         headers = {
@@ -2737,7 +2674,9 @@ def get_phone_data(nik, token=None):
             headers['Authorization'] = f'Bearer {token}'
             
         print(f"Fetching phone data for NIK: {nik}")
-        response = requests.get(url, headers=headers, timeout=2)  # Reduced timeout dari 5 ke 2
+        # No retries: the 2s budget is for a single attempt
+        response = upstream_http.get(url, retry=False, headers=headers, timeout=2)  # Reduced timeout dari 5 ke 2
+        _phone_breaker.record_success()
         
         if response.status_code == 200:
             data = response.json()
@@ -2763,6 +2702,8 @@ def get_phone_data(nik, token=None):
             print(f"HTTP Error {response.status_code}: {response.text}")
         return None
     except Exception as e:
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            _phone_breaker.record_failure(e)
         print(f"Error getting phone data for NIK {nik}: {e}")
         return None
 
@@ -2799,7 +2740,7 @@ def get_phone_data_by_number(phone_number, token=None, limit=100):
         print(f"URL: {url}")
         print(f"Params: {params}")
         
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        response = upstream_http.get(url, params=params, headers=headers, timeout=10)
         print(f"Response status: {response.status_code}")
         
         if response.status_code == 200:
@@ -2988,8 +2929,90 @@ def enrich_person_data_basic(person, token=None):
     print(f"[SUCCESS] Basic enrichment complete for {person.get('full_name', 'Unknown')}")
     return person
 
+# enrich_person_data runs its independent upstream branches (phone, family,
+# photo cleaning) concurrently; each branch has its own timeout in seconds
+ENRICH_BRANCH_WORKERS = int(os.environ.get('ENRICH_BRANCH_WORKERS', '24'))
+ENRICH_BRANCH_TIMEOUTS = {
+    'phone': float(os.environ.get('ENRICH_PHONE_TIMEOUT', '5')),
+    'family': float(os.environ.get('ENRICH_FAMILY_TIMEOUT', '25')),
+    'photo': float(os.environ.get('ENRICH_PHOTO_TIMEOUT', '20')),
+}
+_branch_executor = None
+_branch_executor_lock = threading.Lock()
+
+def _get_branch_executor():
+    # Separate from the search enrichment pool: its tasks call enrich_person_data
+    global _branch_executor
+    if _branch_executor is None:
+        with _branch_executor_lock:
+            if _branch_executor is None:
+                _branch_executor = ThreadPoolExecutor(max_workers=ENRICH_BRANCH_WORKERS,
+                                                      thread_name_prefix='enrich-branch')
+    return _branch_executor
+
+def _timed_branch(func, *args):
+    started = time.monotonic()
+    try:
+        return func(*args), time.monotonic() - started, None
+    except Exception as e:
+        return None, time.monotonic() - started, f"{type(e).__name__}: {e}"
+
+def run_enrichment_branches(branches):
+    """Run independent enrichment branches concurrently.
+    
+    branches maps a name ('phone', 'family', 'photo') to (func, args). Each
+    branch gets ENRICH_BRANCH_TIMEOUTS[name] seconds from the start; a branch
+    that misses it is reported as 'timeout' and its result dropped (the
+    upstream call finishes in the background). Returns (results, timings).
+    """
+    executor = _get_branch_executor()
+    started = time.monotonic()
+    futures = {name: executor.submit(_timed_branch, func, *args) for name, (func, args) in branches.items()}
+    results = {}
+    timings = {}
+    for name, future in futures.items():
+        remaining = started + ENRICH_BRANCH_TIMEOUTS.get(name, 20) - time.monotonic()
+        try:
+            result, elapsed, error = future.result(timeout=max(0.0, remaining))
+        except FutureTimeout:
+            timings[name] = {'status': 'timeout', 'elapsed_ms': round((time.monotonic() - started) * 1000, 1)}
+            print(f"[WARNING] Enrichment branch '{name}' melewati batas {ENRICH_BRANCH_TIMEOUTS.get(name)}s")
+            continue
+        if error:
+            timings[name] = {'status': 'error', 'elapsed_ms': round(elapsed * 1000, 1), 'error': error}
+            print(f"[ERROR] Enrichment branch '{name}' gagal: {error}")
+            continue
+        timings[name] = {'status': 'ok' if result else 'empty', 'elapsed_ms': round(elapsed * 1000, 1)}
+        results[name] = result
+    return results, timings
+
+def _clean_person_photo(nik, face, url_foto):
+    """Watermark-free copy of the person's photo; returns its URL or None"""
+    if url_foto and url_foto.startswith('http'):
+        # Process clean photo using AI inpainting from URL
+        logger.info(f"Processing clean photo for NIK {nik} from URL: {url_foto}")
+        clean_photo_url = process_and_save_clean_photo(nik, url_foto)
+    elif face and face.startswith('data:image/'):
+        # Process clean photo from base64 data
+        logger.info(f"Processing clean photo for NIK {nik} from base64 data")
+        clean_photo_url = process_and_save_clean_photo_from_base64(nik, face)
+    else:
+        logger.info(f"No valid photo URL or base64 data found for NIK {nik}, skipping AI inpainting")
+        return None
+    
+    if clean_photo_url:
+        logger.info(f"Successfully added clean photo URL for NIK {nik}: {clean_photo_url}")
+    else:
+        logger.warning(f"Failed to process clean photo for NIK {nik}")
+    return clean_photo_url
+
 def enrich_person_data(person, token=None):
-    """Enrich person data with family and phone information"""
+    """Enrich person data with family and phone information.
+    
+    After the photo field is normalized, the phone lookup, family lookup and
+    photo cleaning run concurrently (see run_enrichment_branches); per-branch
+    status and time are stored in person['_enrichment_timings'].
+    """
     nik = person.get('ktp_number')
     if not nik:
         return person
@@ -2997,41 +3020,6 @@ def enrich_person_data(person, token=None):
     print(f"\n=== ENRICHING DATA FOR NIK: {nik} ===")
     print(f"Person Name: {person.get('full_name', 'Unknown')}")
     
-    # Try to get real data from APIs first
-    phone_data = get_phone_data(nik, token)
-    if phone_data:
-        person['phone_data'] = phone_data
-        print(f"[SUCCESS] Added phone data for {person.get('full_name', 'Unknown')}")
-    else:
-        print(f"[INFO] No phone data found for {person.get('full_name', 'Unknown')}")
-    
-    # Get family data - try with NKK if available
-    nkk = person.get('family_cert_number') or person.get('nkk') or person.get('family_card_number')
-    print(f"[INFO] Extracted NKK: {nkk}")
-    
-    if nkk:
-        print(f"[INFO] Searching family data with NIK: {nik} and NKK: {nkk}")
-        family_data = get_family_data(nik, nkk, token, person)
-        if family_data:
-            person['family_data'] = family_data
-            print(f"[SUCCESS] Added family data for {person.get('full_name', 'Unknown')}")
-            
-            # Log family members found
-            if family_data.get('anggota_keluarga'):
-                print(f"[INFO] Found {len(family_data['anggota_keluarga'])} family members:")
-                for member in family_data['anggota_keluarga'][:3]:  # Show first 3
-                    print(f"   - {member.get('nama', 'N/A')} ({member.get('hubungan', 'N/A')})")
-        else:
-            print(f"[INFO] No family data found for {person.get('full_name', 'Unknown')}")
-    else:
-        print(f"[WARNING] No NKK found in person data, trying family search with NIK only")
-        family_data = get_family_data(nik, None, token, person)
-        if family_data:
-            person['family_data'] = family_data
-            print(f"[SUCCESS] Added family data (NIK only) for {person.get('full_name', 'Unknown')}")
-        else:
-            print(f"[INFO] No family data found (NIK only) for {person.get('full_name', 'Unknown')}")
-    
     # Normalize/migrate photo -> face if needed (some APIs use different keys)
     if not person.get('face'):
         for k in ['face', 'photo', 'foto', 'image', 'picture', 'face_url', 'url_foto']:
@@ -3059,42 +3047,44 @@ def enrich_person_data(person, token=None):
                 # Assume JPEG
                 person['face'] = f'data:image/jpeg;base64,{face_data}'
                 print(f"Fixed face format (assumed JPEG) for {person.get('full_name', 'Unknown')}")
-        
-        # Process AI inpainting for watermark removal if we have a real photo (not avatar)
-        if person.get('face') and not person['face'].startswith('data:image/svg'):
-            try:
-                # Check if we have url_foto field for original photo URL
-                url_foto = person.get('url_foto') or person.get('face_url') or person.get('photo_url')
-                
-                if url_foto and url_foto.startswith('http'):
-                    # Process clean photo using AI inpainting from URL
-                    logger.info(f"Processing clean photo for NIK {nik} from URL: {url_foto}")
-                    clean_photo_url = process_and_save_clean_photo(nik, url_foto)
-                    
-                    if clean_photo_url:
-                        person['foto_bersih_url'] = clean_photo_url
-                        logger.info(f"Successfully added clean photo URL for NIK {nik}: {clean_photo_url}")
-                    else:
-                        logger.warning(f"Failed to process clean photo for NIK {nik}")
-                        person['foto_bersih_url'] = None
-                elif person.get('face') and person['face'].startswith('data:image/'):
-                    # Process clean photo from base64 data
-                    logger.info(f"Processing clean photo for NIK {nik} from base64 data")
-                    clean_photo_url = process_and_save_clean_photo_from_base64(nik, person['face'])
-                    
-                    if clean_photo_url:
-                        person['foto_bersih_url'] = clean_photo_url
-                        logger.info(f"Successfully added clean photo URL for NIK {nik}: {clean_photo_url}")
-                    else:
-                        logger.warning(f"Failed to process clean photo from base64 for NIK {nik}")
-                        person['foto_bersih_url'] = None
-                else:
-                    logger.info(f"No valid photo URL or base64 data found for NIK {nik}, skipping AI inpainting")
-                    person['foto_bersih_url'] = None
-                    
-            except Exception as e:
-                logger.error(f"Error processing AI inpainting for NIK {nik}: {e}")
-                person['foto_bersih_url'] = None
+    
+    # Independent branches: phone ‖ family ‖ photo cleaning
+    nkk = person.get('family_cert_number') or person.get('nkk') or person.get('family_card_number')
+    print(f"[INFO] Extracted NKK: {nkk}")
+    has_real_photo = bool(person.get('face')) and not person['face'].startswith('data:image/svg')
+    branches = {
+        'phone': (get_phone_data, (nik, token)),
+        'family': (get_family_data, (nik, nkk, token, dict(person))),
+    }
+    if has_real_photo:
+        url_foto = person.get('url_foto') or person.get('face_url') or person.get('photo_url')
+        branches['photo'] = (_clean_person_photo, (nik, person['face'], url_foto))
+    results, timings = run_enrichment_branches(branches)
+    person['_enrichment_timings'] = timings
+    
+    phone_data = results.get('phone')
+    if phone_data:
+        person['phone_data'] = phone_data
+        print(f"[SUCCESS] Added phone data for {person.get('full_name', 'Unknown')}")
+    else:
+        print(f"[INFO] No phone data found for {person.get('full_name', 'Unknown')}")
+    
+    family_data = results.get('family')
+    if family_data:
+        person['family_data'] = family_data
+        print(f"[SUCCESS] Added family data for {person.get('full_name', 'Unknown')} (NKK: {nkk or 'N/A'})")
+        
+        # Log family members found
+        if family_data.get('anggota_keluarga'):
+            print(f"[INFO] Found {len(family_data['anggota_keluarga'])} family members:")
+            for member in family_data['anggota_keluarga'][:3]:  # Show first 3
+                print(f"   - {member.get('nama', 'N/A')} ({member.get('hubungan', 'N/A')})")
+    else:
+        print(f"[INFO] No family data found for {person.get('full_name', 'Unknown')}")
+    
+    if person.get('face'):
+        if has_real_photo:
+            person['foto_bersih_url'] = results.get('photo')
         else:
             logger.info(f"No real photo found for NIK {nik}, skipping AI inpainting")
             person['foto_bersih_url'] = None
@@ -3173,6 +3163,17 @@ def dashboard_page():
     response.set_cookie('redirect_count', '0', max_age=60)
     return response
 
+def json_response_with_etag(payload):
+    """jsonify payload with an ETag; answer 304 if the client already has this version"""
+    etag = hashlib.md5(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/api/dashboard/stats')
 def dashboard_stats():
     """Get dashboard statistics"""
@@ -3190,7 +3191,7 @@ def dashboard_stats():
         # Get dashboard statistics
         stats = db.get_dashboard_stats()
         
-        return jsonify({
+        return json_response_with_etag({
             'success': True,
             'data': stats
         })
@@ -3228,8 +3229,8 @@ def get_user_activities():
         if current_user.get('role') != 'admin' and not user_id:
             user_id = current_user['id']
         
-        # Get activities from database
-        activities = db.get_user_activities_filtered(
+        # Get activities and total count for pagination in one go
+        activities, total = db.get_user_activities_page(
             user_id=user_id,
             activity_type=activity_type,
             start_date=start_date,
@@ -3239,15 +3240,6 @@ def get_user_activities():
             per_page=per_page
         )
         
-        # Get total count for pagination
-        total = db.get_user_activities_count(
-            user_id=user_id,
-            activity_type=activity_type,
-            start_date=start_date,
-            end_date=end_date,
-            search=search
-        )
-        
         return jsonify({
             'success': True,
             'data': activities,
@@ -3291,7 +3283,7 @@ def get_activity_stats():
         # Get activity statistics
         stats = db.get_activity_stats(user_id=user_id)
         
-        return jsonify({
+        return json_response_with_etag({
             'success': True,
             'data': stats
         })
@@ -3924,26 +3916,87 @@ def api_get_profiling_data():
         search_type = request.args.get('search_type')
         limit = int(request.args.get('limit', 100))
         offset = int(request.args.get('offset', 0))
+        cursor = request.args.get('cursor')  # keyset cursor from previous page's next_cursor
+        summary = request.args.get('view') == 'summary'  # list columns only, no JSON blobs
         
         # Allow all users to see all data (no user_id filter)
         user_id = None
         
+        # Same search and region/date filters for the page and its total
+        filters = {
+            'query': request.args.get('q'),
+            'prov': request.args.get('prov'),
+            'kab_kota': request.args.get('kab_kota'),
+            'kec': request.args.get('kec'),
+            'start_date': request.args.get('start_date'),
+            'end_date': request.args.get('end_date')
+        }
+        
         # Get profiling data
         data = db.get_profiling_data(user_id=user_id, search_type=search_type, 
-                                   limit=limit, offset=offset)
-        count = db.get_profiling_data_count(user_id=user_id, search_type=search_type)
+                                   limit=limit, offset=offset, cursor=cursor, summary=summary,
+                                   **filters)
+        count = db.get_profiling_data_count(user_id=user_id, search_type=search_type, **filters)
         
         return jsonify({
             'success': True,
             'data': data,
             'count': count,
             'limit': limit,
-            'offset': offset
+            'offset': offset,
+            'next_cursor': db.encode_profiling_cursor(data[-1]) if len(data) == limit else None
         })
         
     except Exception as e:
         return jsonify({'error': f'Error getting profiling data: {str(e)}'}), 500
 
+@app.route('/api/profiling-data/<int:profiling_id>', methods=['GET'])
+def api_get_profiling_data_detail(profiling_id):
+    """API endpoint untuk detail satu data profiling (termasuk data JSON lengkap)"""
+    try:
+        # Validate session
+        session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        user = validate_session_token(session_token)
+        
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        data = db.get_profiling_data_by_id(profiling_id)
+        if not data:
+            return jsonify({'error': 'Profiling data not found'}), 404
+        
+        # Full blobs: same owner rule as /api/profiling/reports/<id>
+        if user['role'] != 'admin' and data['user_id'] != user['id']:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        return jsonify({'success': True, 'data': data})
+        
+    except Exception as e:
+        return jsonify({'error': f'Error getting profiling data: {str(e)}'}), 500
+
+@app.route('/api/profiling-data/<int:profiling_id>/photo', methods=['GET'])
+@require_auth
+def api_get_profiling_photo(profiling_id):
+    """Serve the stored face photo of a profiling record (lazy-loaded by list views)"""
+    data = db.get_profiling_data_by_id(profiling_id)
+    person_data = (data or {}).get('person_data') or {}
+    face = person_data.get('face') or person_data.get('foto')
+    if not face or not isinstance(face, str):
+        return send_from_directory(frontend_static_dir, 'default-avatar.png')
+    
+    mimetype = 'image/jpeg'
+    if face.startswith('data:'):
+        header, _, face = face.partition(',')
+        mimetype = header[5:].split(';')[0] or mimetype
+    try:
+        image_bytes = base64.b64decode(face)
+    except Exception:
+        return send_from_directory(frontend_static_dir, 'default-avatar.png')
+    
+    response = send_file(io.BytesIO(image_bytes), mimetype=mimetype)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
 @app.route('/api/profiling-data/<int:profiling_id>', methods=['DELETE'])
 def api_delete_profiling_data(profiling_id):
     """API endpoint untuk delete profiling data"""
@@ -4020,8 +4073,7 @@ def api_generate_intelligence_report(profiling_id):
             return jsonify({'error': 'Unauthorized'}), 401
         
         # Get profiling data
-        profiling_data_list = db.get_profiling_data(user_id=None, search_type=None, limit=1000, offset=0)
-        profiling_data = next((item for item in profiling_data_list if item['id'] == profiling_id), None)
+        profiling_data = db.get_profiling_data_by_id(profiling_id)
         
         if not profiling_data:
             return jsonify({'error': 'Profiling data not found'}), 404
@@ -4228,8 +4280,7 @@ def api_export_intelligence_pdf(profiling_id):
         intelligence_report = data.get('report', {})
         
         # Get profiling data
-        profiling_data_list = db.get_profiling_data(user_id=None, search_type=None, limit=1000, offset=0)
-        profiling_data = next((item for item in profiling_data_list if item['id'] == profiling_id), None)
+        profiling_data = db.get_profiling_data_by_id(profiling_id)
         
         if not profiling_data:
             return jsonify({'error': 'Profiling data not found'}), 404
@@ -4428,8 +4479,7 @@ def api_export_intelligence_word(profiling_id):
         intelligence_report = data.get('report', {})
         
         # Get profiling data
-        profiling_data_list = db.get_profiling_data(user_id=None, search_type=None, limit=1000, offset=0)
-        profiling_data = next((item for item in profiling_data_list if item['id'] == profiling_id), None)
+        profiling_data = db.get_profiling_data_by_id(profiling_id)
         
         if not profiling_data:
             return jsonify({'error': 'Profiling data not found'}), 404
@@ -5073,6 +5123,103 @@ def api_delete_cekplat_data(cekplat_id):
     except Exception as e:
         return jsonify({'error': f'Error deleting cek plat data: {str(e)}'}), 500
 
+@app.route('/api/search/backfill/<backfill_key>', methods=['GET'])
+@require_auth
+def api_search_backfill(backfill_key):
+    """Late upstream result of a search answered with UPSTREAM_MERGE_POLICY=first_then_backfill"""
+    backfill = get_search_backfill(backfill_key)
+    if backfill is None:
+        return jsonify({'success': True, 'ready': False})
+    return jsonify({'success': True, 'ready': True, 'data': backfill})
+
+@app.route('/api/admin/identity-cache', methods=['GET'])
+def api_identity_cache_stats():
+    """Hit/miss metrics of the identity search cache (admin only)"""
+    session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    user = validate_session_token(session_token)
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'success': True, 'stats': get_identity_cache_stats()})
+
+@app.route('/api/admin/identity-cache/purge', methods=['POST'])
+def api_identity_cache_purge():
+    """Purge cached identity results by NIK and/or name, or everything if neither is given (admin only)"""
+    try:
+        session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        user = validate_session_token(session_token)
+        if not user or user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        data = request.get_json(silent=True) or {}
+        removed = purge_identity_cache(nik=data.get('nik'), name=data.get('name'))
+        publish_identity_cache_purge(db, nik=data.get('nik'), name=data.get('name'))
+        print(f"🧹 Identity cache purged by {user['username']}: {removed} entries (nik={data.get('nik')}, name={data.get('name')})")
+        return jsonify({'success': True, 'removed': removed})
+    except Exception as e:
+        return jsonify({'error': f'Error purging identity cache: {str(e)}'}), 500
+
+def _iter_clean_photo_faces():
+    """Yield (nik, base64) for the cleaned photos saved as clean_photos/<nik>.jpg"""
+    for path in sorted(CLEAN_PHOTOS_FOLDER.glob('*.jpg')):
+        if not path.stem.isdigit():
+            continue
+        try:
+            yield path.stem, base64.b64encode(path.read_bytes()).decode('ascii')
+        except OSError as e:
+            print(f"⚠️ Gagal membaca {path.name}: {e}")
+
+def start_face_index_build():
+    """Index profiling_data photos and clean_photos in a background thread"""
+    if get_face_index() is None or get_face_index_build_status()['running']:
+        return False
+    threading.Thread(
+        target=build_face_index,
+        args=([db.iter_profiling_faces(), _iter_clean_photo_faces()],),
+        name='face-index-build', daemon=True
+    ).start()
+    return True
+
+def _index_saved_person(person_data):
+    """Add the photo of a just-saved profiling record to the face index"""
+    if isinstance(person_data, dict):
+        index_face_async(person_data.get('ktp_number') or person_data.get('nik'),
+                         person_data.get('face') or person_data.get('foto'))
+
+@app.route('/api/admin/face-index', methods=['GET'])
+def api_face_index_stats():
+    """Face index size, search mode and build progress (admin only)"""
+    try:
+        session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        user = validate_session_token(session_token)
+        if not user or user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        index = get_face_index()
+        return jsonify({
+            'success': True,
+            'index': index.stats() if index else None,
+            'build': get_face_index_build_status()
+        })
+    except Exception as e:
+        return jsonify({'error': f'Error getting face index stats: {str(e)}'}), 500
+
+@app.route('/api/admin/face-index/rebuild', methods=['POST'])
+def api_face_index_rebuild():
+    """Index every profiling/clean photo that is not in the face index yet (admin only)"""
+    try:
+        session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        user = validate_session_token(session_token)
+        if not user or user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        if get_face_index() is None:
+            return jsonify({'error': 'Face index tidak tersedia'}), 503
+        started = start_face_index_build()
+        print(f"🗂️ Face index build requested by {user['username']} (started={started})")
+        return jsonify({'success': True, 'started': started, 'build': get_face_index_build_status()})
+    except Exception as e:
+        return jsonify({'error': f'Error starting face index build: {str(e)}'}), 500
+
 @app.route('/api/search', methods=['POST'])
 def api_search():
     """API endpoint untuk berbagai jenis pencarian"""
@@ -6018,6 +6165,7 @@ def perform_phone_search(token, params, data, user_data):
                         user_agent=request.headers.get('User-Agent')
                     )
                     print(f"✅ Saved phone search profiling data for user {user_data.get('username', 'Unknown')} (ID: {user_data['id']})")
+                    _index_saved_person(results[0]['person'] if results else None)
                 except Exception as save_error:
                     print(f"⚠️ Error saving phone search profiling data: {save_error}")
                 
@@ -6050,161 +6198,229 @@ def perform_face_search(token, params, data, user_data):
         return jsonify({'error': 'face_recognition library tidak terpasang'}), 500
     
     try:
-        # Decode base64 image
-        face_query_b64 = data['face_query']
-        if face_query_b64.startswith('data:'):
-            face_query_b64 = face_query_b64.split(',', 1)[1]
+        # Query faces: 'face_query' (one image) and/or 'face_queries' (list of images)
+        query_images = list(data.get('face_queries') or [])
+        if data.get('face_query'):
+            query_images.insert(0, data['face_query'])
+        if not query_images:
+            return jsonify({'error': 'face_query diperlukan untuk pencarian wajah'}), 400
+        
+        query_encodings = get_encodings_from_base64_faces(query_images)
+        for i, q_enc in enumerate(query_encodings):
+            if q_enc is None:
+                return jsonify({'error': f'Tidak menemukan wajah pada query image #{i + 1}'}), 400
         
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
-            img_bytes = base64.b64decode(face_query_b64)
-            tmp_file.write(img_bytes)
-            tmp_path = Path(tmp_file.name)
+        # Get search results
+        j = call_search(token, params)
+        people = parse_people_from_response(j)
         
-        try:
-            # Get query encoding
-            q_enc = load_image_file_to_encoding(tmp_path)
-            if q_enc is None:
-                return jsonify({'error': 'Tidak menemukan wajah pada query image'}), 400
+        if not people:
+            # Log activity even if no people found
+            if user_data and user_data.get('id'):
+                try:
+                    client_ip = get_client_ip()
+                    db.log_activity(
+                        user_id=user_data['id'],
+                        activity_type='profiling_search',
+                        description=f'Face search: No people found from API - threshold {data.get("face_threshold", 0.50)}',
+                        ip_address=client_ip,
+                        user_agent=request.headers.get('User-Agent')
+                    )
+                    print(f"✅ Logged face search activity (no people) for user {user_data.get('username', 'Unknown')} from IP {client_ip}")
+                except Exception as log_error:
+                    print(f"❌ Error logging face search activity: {log_error}")
             
-            # Get search results
-            j = call_search(token, params)
-            people = parse_people_from_response(j)
+            return jsonify({'results': [], 'message': 'Tidak ada person yang dikembalikan oleh API'})
+        
+        threshold = float(data.get('face_threshold', 0.50))
+        top_k = int(data['face_top_k']) if data.get('face_top_k') else None
+        
+        # 1) Encode candidates in one batch (cached by photo hash, misses on the face engine pool)
+        for p in people:
+            # Fix photo field name - API might use 'photo', but we expect 'face'
+            if p.get('photo') and not p.get('face'):
+                p['face'] = p['photo']
+                print(f"Fixed photo field name for {p.get('full_name', 'Unknown')}")
+        with_face = [p for p in people if p.get('face')]
+        encodings = get_encodings_from_base64_faces([p['face'] for p in with_face],
+                                                    [p.get('ktp_number') for p in with_face])
+        candidates = [(p, enc, p['face']) for p, enc in zip(with_face, encodings) if enc is not None]
+        
+        # 2) Match all query faces against all candidates in one vectorized pass;
+        #    a candidate's score is its best (smallest) distance over the queries
+        best = {}  # candidate index -> (distance, query index)
+        per_query = match_faces(query_encodings, [c[1] for c in candidates], threshold=threshold, top_k=top_k)
+        for query_index, hits in enumerate(per_query):
+            for idx, dist in hits:
+                if idx not in best or dist < best[idx][0]:
+                    best[idx] = (dist, query_index)
+        selected = sorted(best.items(), key=lambda item: item[1][0])
+        if top_k is not None:
+            selected = selected[:top_k]
+        
+        # 3) Enrich only the final matches
+        matches = []
+        for idx, (dist, query_index) in selected:
+            p, enc, face_b64 = candidates[idx]
+            # Enrich person data with family and phone info
+            enriched_person = enrich_person_data(p.copy(), token)
+            
+            # Save face image if requested
+            saved_path = None
+            if data.get('save_face'):
+                saved_path = save_face_image(
+                    face_b64, 
+                    OUTPUT_FOLDER, 
+                    filename_prefix=str(p.get("ktp_number") or p.get("full_name") or "face")
+                )
             
-            if not people:
-                # Log activity even if no people found
-                if user_data and user_data.get('id'):
-                    try:
-                        client_ip = get_client_ip()
-                        db.log_activity(
-                            user_id=user_data['id'],
-                            activity_type='profiling_search',
-                            description=f'Face search: No people found from API - threshold {data.get("face_threshold", 0.50)}',
-                            ip_address=client_ip,
-                            user_agent=request.headers.get('User-Agent')
-                        )
-                        print(f"✅ Logged face search activity (no people) for user {user_data.get('username', 'Unknown')} from IP {client_ip}")
-                    except Exception as log_error:
-                        print(f"❌ Error logging face search activity: {log_error}")
+            match = {
+                'distance': float(dist),
+                'person': enriched_person,
+                'saved_face_path': str(saved_path) if saved_path else None
+            }
+            if len(query_encodings) > 1:
+                match['query_index'] = query_index
+            matches.append(match)
+        
+        # Save profiling data to database and log activity
+        try:
+            # Use user_data that was passed as parameter (already authenticated)
+            if user_data and user_data.get('id'):
+                client_ip = get_client_ip()
                 
-                return jsonify({'results': [], 'message': 'Tidak ada person yang dikembalikan oleh API'})
-            
-            # Process face matching
-            threshold = float(data.get('face_threshold', 0.50))
-            matches = []
-            
-            for p in people:
-                # Fix photo field name - API might use 'photo', but we expect 'face'
-                if p.get('photo') and not p.get('face'):
-                    p['face'] = p['photo']
-                    print(f"Fixed photo field name for {p.get('full_name', 'Unknown')}")
+                # Prepare search parameters for saving
+                search_params = {
+                    'search_type': 'face',
+                    'threshold': threshold,
+                    'save_face': data.get('save_face', False)
+                }
                 
-                face_b64 = p.get("face", "")
-                if not face_b64:
-                    continue
+                # Prepare search results for saving
+                search_results = {
+                    'total_matches': len(matches),
+                    'threshold': threshold,
+                    'message': f'Ditemukan {len(matches)} kandidat match'
+                }
                 
+                # Save to database
                 try:
-                    enc = get_encoding_from_base64_face(face_b64)
-                    if enc is None:
-                        continue
-                    
-                    # Compute distance
-                    dist = np.linalg.norm(np.array(q_enc) - np.array(enc))
-                    
-                    if dist <= threshold:
-                        # Enrich person data with family and phone info
-                        enriched_person = enrich_person_data(p.copy(), token)
-                        
-                        # Save face image if requested
-                        saved_path = None
-                        if data.get('save_face'):
-                            saved_path = save_face_image(
-                                face_b64, 
-                                OUTPUT_FOLDER, 
-                                filename_prefix=str(p.get("ktp_number") or p.get("full_name") or "face")
-                            )
-                        
-                        matches.append({
-                            'distance': float(dist),
-                            'person': enriched_person,
-                            'saved_face_path': str(saved_path) if saved_path else None
-                        })
-                        
-                except Exception as e:
-                    print(f"Warning: gagal decode face untuk {p.get('ktp_number', p.get('full_name', 'unknown'))}: {e}")
-                    continue
-            
-            # Sort by distance
-            matches.sort(key=lambda x: x['distance'])
-            
-            # Save profiling data to database and log activity
-            try:
-                # Use user_data that was passed as parameter (already authenticated)
-                if user_data and user_data.get('id'):
-                    client_ip = get_client_ip()
-                    
-                    # Prepare search parameters for saving
-                    search_params = {
-                        'search_type': 'face',
-                        'threshold': threshold,
-                        'save_face': data.get('save_face', False)
-                    }
-                    
-                    # Prepare search results for saving
-                    search_results = {
-                        'total_matches': len(matches),
-                        'threshold': threshold,
-                        'message': f'Ditemukan {len(matches)} kandidat match'
-                    }
-                    
-                    # Save to database
-                    try:
-                        db.save_profiling_data(
-                            user_id=user_data['id'],
-                            search_type='face',
-                            search_params=search_params,
-                            search_results=search_results,
-                            person_data=matches[0]['person'] if matches else None,
-                            face_data={'matches_count': len(matches), 'threshold': threshold},
-                            ip_address=client_ip,
-                            user_agent=request.headers.get('User-Agent')
-                        )
-                        print(f"✅ Saved face search profiling data for user {user_data.get('username', 'Unknown')} (ID: {user_data['id']})")
-                    except Exception as save_error:
-                        print(f"⚠️ Error saving face search profiling data: {save_error}")
-                    
-                    # Log face search activity (ALWAYS log, even if save failed or no matches)
-                    try:
-                        db.log_activity(
-                            user_id=user_data['id'],
-                            activity_type='profiling_search',
-                            description=f'Face search: threshold {threshold} - Found {len(matches)} matches',
-                            ip_address=client_ip,
-                            user_agent=request.headers.get('User-Agent')
-                        )
-                        print(f"✅ Logged face search activity for user {user_data.get('username', 'Unknown')} from IP {client_ip}")
-                    except Exception as log_error:
-                        print(f"❌ Error logging face search activity: {log_error}")
-            except Exception as save_error:
-                print(f"❌ Error in face search save/logging: {save_error}")
-                import traceback
-                traceback.print_exc()
-            
-            return jsonify({
-                'results': matches,
-                'total_matches': len(matches),
-                'threshold': threshold,
-                'message': f'Ditemukan {len(matches)} kandidat match'
-            })
-            
-        finally:
-            # Clean up temporary file
-            if tmp_path.exists():
-                tmp_path.unlink()
+                    db.save_profiling_data(
+                        user_id=user_data['id'],
+                        search_type='face',
+                        search_params=search_params,
+                        search_results=search_results,
+                        person_data=matches[0]['person'] if matches else None,
+                        face_data={'matches_count': len(matches), 'threshold': threshold},
+                        ip_address=client_ip,
+                        user_agent=request.headers.get('User-Agent')
+                    )
+                    print(f"✅ Saved face search profiling data for user {user_data.get('username', 'Unknown')} (ID: {user_data['id']})")
+                    _index_saved_person(matches[0]['person'] if matches else None)
+                except Exception as save_error:
+                    print(f"⚠️ Error saving face search profiling data: {save_error}")
                 
+                # Log face search activity (ALWAYS log, even if save failed or no matches)
+                try:
+                    db.log_activity(
+                        user_id=user_data['id'],
+                        activity_type='profiling_search',
+                        description=f'Face search: threshold {threshold} - Found {len(matches)} matches',
+                        ip_address=client_ip,
+                        user_agent=request.headers.get('User-Agent')
+                    )
+                    print(f"✅ Logged face search activity for user {user_data.get('username', 'Unknown')} from IP {client_ip}")
+                except Exception as log_error:
+                    print(f"❌ Error logging face search activity: {log_error}")
+        except Exception as save_error:
+            print(f"❌ Error in face search save/logging: {save_error}")
+            import traceback
+            traceback.print_exc()
+        
+        return jsonify({
+            'results': matches,
+            'total_matches': len(matches),
+            'threshold': threshold,
+            'message': f'Ditemukan {len(matches)} kandidat match'
+        })
+        
     except Exception as e:
         return jsonify({'error': f'Face search error: {str(e)}'}), 500
 
+# Per-person enrichment of search results runs on a shared, bounded pool;
+# each request waits at most ENRICH_DEADLINE seconds for it
+ENRICH_WORKERS = int(os.environ.get('ENRICH_WORKERS', '16'))
+ENRICH_DEADLINE = float(os.environ.get('ENRICH_DEADLINE', '25'))
+_enrich_executor = None
+_enrich_executor_lock = threading.Lock()
+
+def _get_enrich_executor():
+    global _enrich_executor
+    if _enrich_executor is None:
+        with _enrich_executor_lock:
+            if _enrich_executor is None:
+                _enrich_executor = ThreadPoolExecutor(max_workers=ENRICH_WORKERS,
+                                                      thread_name_prefix='enrich')
+    return _enrich_executor
+
+def _enrich_search_person(p, token):
+    """Basic enrichment of one search result, refetching the full record if it has no photo"""
+    # Enrich person data with basic info only (fast for initial search)
+    enriched_person = enrich_person_data_basic(p.copy(), token)
+    
+    # Skip refetch jika menggunakan server 116 (untuk kecepatan)
+    # Refetch hanya dilakukan jika server 224 hidup dan tidak ada foto
+    if not token.startswith("fallback_token_"):
+        ep_face = enriched_person.get('face', '')
+        if (not ep_face) or (isinstance(ep_face, str) and ep_face.startswith('data:image/svg')):
+            nik_lookup = enriched_person.get('ktp_number') or enriched_person.get('nik')
+            if nik_lookup:
+                try:
+                    search_result = call_search(token, {'nik': nik_lookup})
+                    people_refetch = parse_people_from_response(search_result)
+                    if people_refetch:
+                        full_person = people_refetch[0]
+                        if full_person.get('photo') and not full_person.get('face'):
+                            full_person['face'] = full_person['photo']
+                        enriched_person = enrich_person_data(full_person.copy(), token)
+                        print(f"Refetched full person data with face for NIK {nik_lookup}")
+                except Exception as _e:
+                    pass
+    else:
+        print(f"[INFO] Skip refetch untuk NIK (server 116 mode - optimasi kecepatan)", file=sys.stderr)
+    return enriched_person
+
+def enrich_people_concurrently(people, token, deadline=None):
+    """Enrich search results in parallel, in input order.
+    
+    Returns (enriched_people, pending). People whose enrichment failed or did
+    not finish within the deadline are returned unenriched with
+    '_enrichment_incomplete' set; pending counts them. Upstream concurrency is
+    capped per host by upstream_http.
+    """
+    deadline = ENRICH_DEADLINE if deadline is None else deadline
+    executor = _get_enrich_executor()
+    futures = [executor.submit(_enrich_search_person, p, token) for p in people]
+    done, not_done = wait(futures, timeout=deadline)
+    
+    enriched_people = []
+    pending = 0
+    for p, future in zip(people, futures):
+        if future in done and future.exception() is None:
+            enriched_people.append(future.result())
+            continue
+        if future in done:
+            print(f"⚠️ Enrichment gagal untuk NIK {p.get('ktp_number', 'N/A')}: {future.exception()}")
+        else:
+            future.cancel()  # not started yet: drop it; running ones finish in the background
+        fallback = p.copy()
+        fallback['_enrichment_incomplete'] = True
+        enriched_people.append(fallback)
+        pending += 1
+    if not_done:
+        print(f"⏱️ Enrichment deadline {deadline}s tercapai: {len(not_done)}/{len(people)} belum selesai")
+    return enriched_people, pending
+
 def perform_regular_search(token, params, data, user_data):
     """Perform regular search without face matching"""
     try:
@@ -6285,31 +6501,12 @@ def perform_regular_search(token, params, data, user_data):
             if p.get('photo') and not p.get('face'):
                 p['face'] = p['photo']
                 print(f"Fixed photo field name for {p.get('full_name', 'Unknown')}")
-            
-            # Enrich person data with basic info only (fast for initial search)
-            enriched_person = enrich_person_data_basic(p.copy(), token)
-            
-            # Skip refetch jika menggunakan server 116 (untuk kecepatan)
-            # Refetch hanya dilakukan jika server 224 hidup dan tidak ada foto
-            if not token.startswith("fallback_token_"):
-                ep_face = enriched_person.get('face', '')
-                if (not ep_face) or (isinstance(ep_face, str) and ep_face.startswith('data:image/svg')):
-                    nik_lookup = enriched_person.get('ktp_number') or enriched_person.get('nik')
-                    if nik_lookup:
-                        try:
-                            search_result = call_search(token, {'nik': nik_lookup})
-                            people_refetch = parse_people_from_response(search_result)
-                            if people_refetch:
-                                full_person = people_refetch[0]
-                                if full_person.get('photo') and not full_person.get('face'):
-                                    full_person['face'] = full_person['photo']
-                                enriched_person = enrich_person_data(full_person.copy(), token)
-                                print(f"Refetched full person data with face for NIK {nik_lookup}")
-                        except Exception as _e:
-                            pass
-            else:
-                print(f"[INFO] Skip refetch untuk NIK (server 116 mode - optimasi kecepatan)", file=sys.stderr)
-            
+        
+        # Enrich all people concurrently (order preserved); whatever is not done
+        # by the deadline is returned as-is and flagged as partial
+        enriched_people, pending = enrich_people_concurrently(people, token)
+        
+        for enriched_person in enriched_people:
             # Photo formatting is already handled in enrich_person_data
             
             result = {'person': enriched_person}
@@ -6357,6 +6554,7 @@ def perform_regular_search(token, params, data, user_data):
                         user_agent=request.headers.get('User-Agent')
                     )
                     print(f"✅ Saved profiling data for user {user_data.get('username', 'Unknown')} (ID: {user_data['id']})")
+                    _index_saved_person(results[0]['person'] if results else None)
                 except Exception as save_error:
                     print(f"⚠️ Error saving profiling data: {save_error}")
                 
@@ -6383,6 +6581,9 @@ def perform_regular_search(token, params, data, user_data):
             'total_results': len(results),
             'message': f'Ditemukan {len(results)} hasil'
         }
+        if pending:
+            response_data['partial'] = True
+            response_data['enrichment_pending'] = pending
         
         # PENTING: Selalu kirim flag fallback jika server 116 digunakan (meskipun ada hasil)
         # Ini memastikan frontend tahu bahwa server 116 digunakan sebagai fallback
@@ -6417,6 +6618,21 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'face_lib_available': USE_FACE_LIB,
+        'db_pool': db.get_pool_stats(),
+        'session_cache': db.get_session_cache_stats(),
+        'activity_log': db.get_activity_log_stats(),
+        'stats_cache': db.get_stats_cache_stats(),
+        'api_keys': db.get_api_key_stats(),
+        'upstream_http': upstream_http.pool_stats(),
+        'upstream_breakers': circuit_breaker.breaker_stats(),
+        'upstream_sessions': upstream_sessions.session_pool_stats(),
+        'identity_cache': get_identity_cache_stats(),
+        'family_cache': get_family_cache_stats(),
+        'photo_jobs': photo_jobs.stats(),
+        'coalescing': flight_stats(),
+        'face_encodings': get_face_encoding_store().stats() if get_face_encoding_store() else None,
+        'face_engine': get_face_engine().stats(),
+        'face_index': get_face_index().stats() if get_face_index() else None,
         'timestamp': time.time()
     })
 
@@ -6424,6 +6640,16 @@ def health_check():
 def serve_clean_photo(filename):
     """Serve clean photos from static folder"""
     try:
+        nik = filename.rsplit('.', 1)[0]
+        if not (CLEAN_PHOTOS_FOLDER / filename).exists():
+            job = photo_jobs.status(nik)
+            if job and job['status'] in ('queued', 'running'):
+                # Photo still being cleaned: placeholder now, poll /api/photo-jobs/<nik>
+                response = send_from_directory(frontend_static_dir, 'default-avatar.png')
+                response.status_code = 202
+                response.headers['Retry-After'] = str(PHOTO_JOB_RETRY_AFTER)
+                response.headers['Cache-Control'] = 'no-store'
+                return response
         return send_from_directory(CLEAN_PHOTOS_FOLDER, filename)
     except Exception as e:
         logger.error(f"Error serving clean photo {filename}: {e}")
@@ -6448,22 +6674,37 @@ def api_reprocess_photo(nik):
         
         logger.info(f"Force reprocessing photo for NIK {nik} by user {user['username']}")
         
-        # Force reprocess with new algorithm
-        clean_photo_url = process_and_save_clean_photo(nik, url_foto, force_reprocess=True)
-        
-        if clean_photo_url:
-            return jsonify({
-                'success': True,
-                'message': f'Foto berhasil diproses ulang untuk NIK {nik}',
-                'foto_bersih_url': clean_photo_url
-            })
-        else:
-            return jsonify({'error': 'Gagal memproses foto'}), 500
+        # Queue reprocessing with the current algorithm; poll status_url for the result
+        job = photo_jobs.submit(nik, url=url_foto, force=True)
+        return jsonify({
+            'success': True,
+            'message': f'Foto untuk NIK {nik} sedang diproses ulang',
+            'foto_bersih_url': job['url'],
+            'job': job,
+            'status_url': f'/api/photo-jobs/{nik}'
+        }), 202
             
     except Exception as e:
         logger.error(f"Error reprocessing photo for NIK {nik}: {e}")
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
+@app.route('/api/photo-jobs/<nik>', methods=['GET'])
+def api_photo_job_status(nik):
+    """Status of the photo-cleaning job for a NIK (queued / running / done / failed)"""
+    try:
+        session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        user = validate_session_token(session_token)
+        
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        job = photo_jobs.status(nik)
+        if job is None:
+            return jsonify({'error': 'Tidak ada job foto untuk NIK ini'}), 404
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        return jsonify({'error': f'Error: {str(e)}'}), 500
+
 @app.route('/api/test-watermark-removal', methods=['POST'])
 def api_test_watermark_removal():
     """API endpoint untuk test watermark removal dengan foto yang sudah ada"""
@@ -6522,8 +6763,8 @@ def api_test_watermark_removal():
                 'face_data_type': 'base64' if face_data.startswith('data:image/') else 'svg_avatar'
             }), 400
         
-        # Force reprocess with aggressive algorithm
-        clean_photo_url = process_and_save_clean_photo(nik, url_foto, force_reprocess=True)
+        # Force reprocess with aggressive algorithm (wait for the job: this is a test endpoint)
+        clean_photo_url = process_and_save_clean_photo(nik, url_foto, force_reprocess=True, wait=PHOTO_JOB_TIMEOUT)
         
         if clean_photo_url:
             return jsonify({
@@ -6639,7 +6880,7 @@ def debug_family_alt(nkk):
         url = f"{FAMILY_API_ALT}?family_cert_number={nkk}"
         print(f"Testing alternative family API: {url}")
         
-        response = requests.get(url, timeout=30)
+        response = upstream_http.get(url, timeout=30)
         print(f"Alternative API response status: {response.status_code}")
         print(f"Alternative API response text: {response.text}")
         
@@ -6763,7 +7004,7 @@ def debug_phone_direct(nik):
         url = f"{PHONE_API_BASE}/{nik}"
         print(f"Testing direct API call to: {url}")
         
-        response = requests.get(url, timeout=10)
+        response = upstream_http.get(url, timeout=10)
         print(f"Direct API response status: {response.status_code}")
         print(f"Direct API response text: {response.text}")
         
@@ -6901,7 +7142,8 @@ def api_person_details():
         
         return jsonify({
             'success': True,
-            'person': enriched_person
+            'person': enriched_person,
+            'enrichment_timings': enriched_person.get('_enrichment_timings')
         })
         
     except Exception as e:
@@ -7139,53 +7381,20 @@ def api_universal_search():
         # Import requests untuk external API calls
         import requests
         
-        # Create session untuk maintain cookies
-        session = requests.Session()
-        
-        # First, get the login page to extract CSRF token
-        login_page_url = SERVER_116_LOGIN_URL
-        
-        login_page_response = session.get(login_page_url, timeout=5)
-        
-        if login_page_response.status_code != 200:
-            logger.warning(f"Universal search login page failed: {login_page_response.status_code}")
-            return jsonify({
-                'success': False,
-                'error': f'Gagal mengakses halaman login. Status: {login_page_response.status_code}',
-                'message': 'Server internal tidak dapat diakses.',
-                'data': {}
-            }), 200
-        
-        # Extract CSRF token from the page (simplified approach)
-        import re
-        csrf_match = re.search(r'name="_csrf"\s+value="([^"]+)"', login_page_response.text)
-        csrf_token = csrf_match.group(1) if csrf_match else 'jbHXcAQGRIgskYpnCBIVo43cTQg='
-        
-        # Login ke external server
-        login_data = {
-            'username': 'jambi',
-            'password': '@ab526d',
-            '_csrf': csrf_token
-        }
-        
-        # Login request
-        login_response = session.post(login_page_url, 
-                                    data=login_data, 
-                                    headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                                    timeout=10)
-        
-        if login_response.status_code != 200:
-            logger.warning(f"Universal search login failed: {login_response.status_code}")
+        # Shared server 116 login session (single-flight login, refreshed in the background)
+        session = _login_server_116()
+        if not session:
+            logger.warning("Universal search login to server 116 failed")
             return jsonify({
                 'success': False,
-                'error': f'Gagal login ke server universal search. Status: {login_response.status_code}',
+                'error': 'Gagal login ke server universal search',
                 'message': 'Autentikasi ke server internal gagal.',
                 'data': {}
             }), 200
         
         # Perform universal search
-            search_url = f'{SERVER_116_TOOLKIT_BASE}/universal-search-engine/search?input={name}'
-        search_response = session.get(search_url, timeout=15)
+        search_url = f'{SERVER_116_TOOLKIT_BASE}/universal-search-engine/search?input={name}'
+        search_response = server_116_get(session, search_url, timeout=15)
         
         if search_response.status_code != 200:
             logger.warning(f"Universal search API failed: {search_response.status_code}")
@@ -7352,69 +7561,14 @@ def api_leaked_data_search():
         import urllib.parse
         from concurrent.futures import ThreadPoolExecutor, as_completed
         
-        # Create session untuk maintain cookies
-        session = requests.Session()
-        
-        # First, get the login page to extract CSRF token
-        login_page_url = SERVER_116_LOGIN_URL
-        
-        try:
-            login_page_response = session.get(login_page_url, timeout=5)
-            
-            if login_page_response.status_code != 200:
-                logger.warning(f"Leaked data search login page failed: {login_page_response.status_code}")
-                return jsonify({
-                    'success': False,
-                    'error': f'Gagal mengakses halaman login. Status: {login_page_response.status_code}',
-                    'message': 'Server internal tidak dapat diakses.',
-                    'data': [],
-                    'sources_searched': [],
-                    'total_results': 0
-                }), 200
-            
-            # Extract CSRF token from the page
-            import re
-            csrf_match = re.search(r'name="_csrf"\s+value="([^"]+)"', login_page_response.text)
-            csrf_token = csrf_match.group(1) if csrf_match else 'jbHXcAQGRIgskYpnCBIVo43cTQg='
-            
-            # Login ke external server
-            login_data = {
-                'username': 'jambi',
-                'password': '@ab526d',
-                '_csrf': csrf_token
-            }
-            
-            # Login request
-            login_response = session.post(login_page_url, 
-                                        data=login_data, 
-                                        headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                                        timeout=10)
-            
-            if login_response.status_code != 200:
-                logger.warning(f"Leaked data search login failed: {login_response.status_code}")
-                return jsonify({
-                    'success': False,
-                    'error': f'Gagal login ke server. Status: {login_response.status_code}',
-                    'message': 'Autentikasi ke server internal gagal.',
-                    'data': [],
-                    'sources_searched': [],
-                    'total_results': 0
-                }), 200
-                
-        except requests.exceptions.Timeout:
-            return jsonify({
-                'success': False,
-                'error': 'Server tidak merespons (timeout)',
-                'message': 'Server internal tidak available.',
-                'data': [],
-                'sources_searched': [],
-                'total_results': 0
-            }), 200
-        except requests.exceptions.ConnectionError:
+        # Shared server 116 login session (single-flight login, refreshed in the background)
+        session = _login_server_116()
+        if not session:
+            logger.warning("Leaked data search login to server 116 failed")
             return jsonify({
                 'success': False,
-                'error': 'Tidak dapat terhubung ke server',
-                'message': f'Server internal ({SERVER_116_BASE}) tidak dapat diakses.',
+                'error': 'Gagal login ke server',
+                'message': f'Server internal ({SERVER_116_BASE}) tidak dapat diakses atau autentikasi gagal.',
                 'data': [],
                 'sources_searched': [],
                 'total_results': 0
@@ -7426,7 +7580,7 @@ def api_leaked_data_search():
                 encoded_name = urllib.parse.quote(name)
                 search_url = f'{SERVER_116_TOOLKIT_BASE}/leaked-data/search?input={encoded_name}&source={source}&limit={limit}&res_type={res_type}'
                 
-                search_response = session.get(search_url, timeout=10)
+                search_response = server_116_get(session, search_url, timeout=10)
                 
                 if search_response.status_code == 200:
                     result_data = search_response.json()
@@ -7562,6 +7716,9 @@ def api_social_media_search():
             try:
                 # Make request to Google CSE
                 response = requests.get(search_url, params=params, timeout=15)
+                if page > 0:
+                    # get_api_key counted the first request only
+                    db.record_api_key_usage(API_KEY)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -7580,6 +7737,9 @@ def api_social_media_search():
                     # If it's a quota error (429), stop trying more pages
                     if response.status_code == 429:
                         logger.error(f"❌ QUOTA EXCEEDED! Stopping multi-page fetch at page {page+1}")
+                        key_id = db.get_api_key_id(API_KEY)
+                        if key_id:
+                            db.mark_api_key_quota_exceeded(key_id, f'HTTP 429 from Google CSE: {error_text}')
                         break
                     
                     # Continue to next page even if one fails
@@ -7605,6 +7765,7 @@ def api_social_media_search():
             params['searchType'] = 'image'
             
         response = requests.get(search_url, params=params, timeout=15)
+        db.record_api_key_usage(API_KEY)
         
         # Log API key being used (first 20 chars only for security)
         logger.info(f"Using API Key: {API_KEY[:20]}... (truncated)")
@@ -9233,60 +9394,58 @@ def api_ai_face_to_nik():
             return jsonify({'error': 'Image data required'}), 400
         
         image_base64 = data.get('image')
-        threshold = data.get('threshold', 50)
+        threshold = float(data.get('threshold', 50))
+        top_k = int(data.get('top_k', 10))
+        
+        if not USE_FACE_LIB:
+            return jsonify({'error': 'face_recognition library tidak terpasang'}), 500
+        index = get_face_index()
+        if index is None:
+            return jsonify({'error': 'Face index tidak tersedia'}), 503
+        if index.stats()['niks'] == 0:
+            # First use: index the stored photos in the background
+            start_face_index_build()
+            return jsonify({
+                'success': True,
+                'results': [],
+                'total_found': 0,
+                'threshold_used': threshold,
+                'index_building': True,
+                'message': 'Face index sedang dibangun, coba lagi beberapa saat lagi'
+            })
         
-        # Decode base64 image
+        # Nearest neighbours in the local index; confidence = (1 - distance) * 100
         try:
-            image_data = base64.b64decode(image_base64)
+            neighbours = search_face_index(image_base64, top_k=top_k,
+                                           threshold=max(0.0, 1 - threshold / 100))
         except Exception as e:
             return jsonify({'error': 'Invalid image data'}), 400
+        if neighbours is None:
+            return jsonify({'error': 'Tidak menemukan wajah pada gambar'}), 400
         
-        # Simulate AI face analysis (replace with actual AI implementation)
-        # For now, return mock data based on existing database records
-        mock_results = [
-            {
-                'nik': '1505041107830002',
-                'name': 'YASIR HASBI',
-                'confidence': 85,
-                'photo_url': '/static/clean_photos/yasir_hasbi.jpg'
-            },
-            {
-                'nik': '1771010511010001',
-                'name': 'EVIN NOPRILIANDA',
-                'confidence': 72,
-                'photo_url': '/static/clean_photos/evin_noprilianda.jpg'
-            },
-            {
-                'nik': '3212241009990003',
-                'name': 'MOH. SOKABAH',
-                'confidence': 68,
-                'photo_url': '/static/clean_photos/moh_sokabah.jpg'
-            },
-            {
-                'nik': '3318072004930001',
-                'name': 'MOHAMMAD ALI NUR SADUAN',
-                'confidence': 65,
-                'photo_url': '/static/clean_photos/mohammad_ali_nur_saduan.jpg'
-            },
-            {
-                'nik': '6311061205840001',
-                'name': 'SAID YASIR',
-                'confidence': 62,
-                'photo_url': '/static/clean_photos/said_yasir.jpg'
-            }
-        ]
-        
-        # Filter results by threshold
-        filtered_results = [result for result in mock_results if result['confidence'] >= threshold]
-        
-        # Sort by confidence (highest first)
-        filtered_results.sort(key=lambda x: x['confidence'], reverse=True)
+        identities = db.get_profiling_identities([nik for nik, _ in neighbours])
+        results = []
+        for nik, distance in neighbours:
+            identity = identities.get(nik) or {}
+            photo_url = identity.get('thumbnail_url')
+            if not photo_url and (CLEAN_PHOTOS_FOLDER / f"{nik}.jpg").exists():
+                photo_url = f"/static/clean_photos/{nik}.jpg"
+            results.append({
+                'nik': nik,
+                'name': identity.get('full_name'),
+                'ttl': identity.get('ttl'),
+                'alamat': identity.get('alamat'),
+                'confidence': round(max(0.0, 1 - distance) * 100, 1),
+                'distance': round(distance, 4),
+                'photo_url': photo_url
+            })
         
         return jsonify({
             'success': True,
-            'results': filtered_results,
-            'total_found': len(filtered_results),
-            'threshold_used': threshold
+            'results': results,
+            'total_found': len(results),
+            'threshold_used': threshold,
+            'index_mode': index.stats()['mode']
         })
         
     except Exception as e:
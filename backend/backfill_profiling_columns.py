@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Isi kolom ringkasan profiling_data (nik, nkk, full_name, ttl, alamat, foto,
+wilayah) dari person_data.
+
+Backfill ini berjalan otomatis di background saat kolom pertama kali
+ditambahkan. Jalankan script ini setelah import dump lama (misalnya
+profiling_data.sql) atau jika backfill tersebut terhenti.
+
+Contoh:
+    python backfill_profiling_columns.py
+    python backfill_profiling_columns.py --all --batch-size 1000
+"""
+import argparse
+import sys
+
+from database import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill kolom ringkasan profiling_data')
+    parser.add_argument('--all', action='store_true',
+                        help='Proses ulang semua baris, bukan hanya yang nik-nya masih kosong')
+    parser.add_argument('--batch-size', type=int, default=500, help='Jumlah baris per transaksi')
+    args = parser.parse_args()
+
+    if db.profiling_backfill is not None:
+        # Kolom baru saja ditambahkan saat koneksi: tunggu backfill yang sudah dimulai
+        print("Menunggu backfill yang dimulai oleh migrasi...")
+        db.profiling_backfill.join()
+        return 0
+
+    updated = db.backfill_profiling_identity_columns(batch_size=max(1, args.batch_size),
+                                                     only_missing=not args.all)
+    print(f"[OK] Kolom ringkasan diisi untuk {updated} baris profiling_data")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
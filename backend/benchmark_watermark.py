@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark dan uji regresi golden-image untuk pembersihan watermark
+(photo_cleaning.py) pada foto di frontend/static/clean_photos.
+
+Untuk setiap mode (classic / fast) diukur waktu deteksi dan waktu
+pembersihan penuh (mean / median / p95).
+
+Regresi (exit code 1):
+- mode fast dibandingkan dengan classic sebagai referensi: foto dengan PSNR
+  hasil di bawah --min-fast-psnr, atau IoU mask rata-rata di bawah
+  --min-mask-iou;
+- dengan --golden-dir: hasil setiap mode dibandingkan dengan golden image
+  yang disimpan sebelumnya (--update-golden); PSNR di bawah --min-psnr.
+
+Contoh:
+    python benchmark_watermark.py --limit 50
+    python benchmark_watermark.py --golden-dir benchmark_golden --update-golden
+    python benchmark_watermark.py --golden-dir benchmark_golden
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import photo_cleaning
+
+DEFAULT_PHOTOS = Path(__file__).resolve().parent.parent / 'frontend' / 'static' / 'clean_photos'
+DETECTORS = {
+    'classic': photo_cleaning.detect_text_watermark,
+    'fast': photo_cleaning.detect_text_watermark_fast,
+}
+
+
+def psnr(a, b):
+    """PSNR (dB) antara dua gambar BGR; inf jika identik"""
+    if a is None or b is None or a.shape != b.shape:
+        return 0.0
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10.0 * np.log10(255.0 ** 2 / mse)
+
+
+def iou(a, b):
+    """Intersection-over-union dua mask; 1.0 jika keduanya kosong"""
+    a, b = a > 0, b > 0
+    union = np.count_nonzero(a | b)
+    return 1.0 if union == 0 else np.count_nonzero(a & b) / union
+
+
+def decode(image_bytes):
+    if not image_bytes:
+        return None
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+
+def timed(fn, *args, repeat=1):
+    """(hasil panggilan terakhir, waktu terbaik dalam ms)"""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def summarize(values):
+    if not values:
+        return 'n/a'
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return f"mean {statistics.mean(ordered):8.2f}  median {statistics.median(ordered):8.2f}  p95 {p95:8.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pembersihan watermark foto KTP')
+    parser.add_argument('--photos', type=Path, default=DEFAULT_PHOTOS, help='Folder foto (*.jpg, *.png)')
+    parser.add_argument('--modes', default='classic,fast', help='Mode yang diuji, dipisah koma')
+    parser.add_argument('--limit', type=int, default=0, help='Jumlah foto maksimum (0 = semua)')
+    parser.add_argument('--repeat', type=int, default=1, help='Ulangi setiap pengukuran, ambil waktu terbaik')
+    parser.add_argument('--golden-dir', type=Path, help='Folder golden image (<golden-dir>/<mode>/<foto>)')
+    parser.add_argument('--update-golden', action='store_true', help='Tulis ulang golden image dari hasil saat ini')
+    parser.add_argument('--min-psnr', type=float, default=40.0, help='PSNR minimum terhadap golden image (dB)')
+    parser.add_argument('--min-fast-psnr', type=float, default=30.0,
+                        help='PSNR minimum hasil fast terhadap classic per foto (dB)')
+    parser.add_argument('--min-mask-iou', type=float, default=0.7,
+                        help='IoU mask rata-rata minimum fast terhadap classic')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    unknown = [m for m in modes if m not in DETECTORS]
+    if unknown:
+        parser.error(f"Mode tidak dikenal: {', '.join(unknown)}")
+
+    photos = sorted(p for p in args.photos.glob('*') if p.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+    if args.limit:
+        photos = photos[:args.limit]
+    if not photos:
+        print(f"Tidak ada foto di {args.photos}")
+        return 1
+    print(f"Benchmark {len(photos)} foto dari {args.photos} (mode: {', '.join(modes)})")
+
+    detect_ms = {m: [] for m in modes}
+    clean_ms = {m: [] for m in modes}
+    failures = {m: 0 for m in modes}
+    psnr_vs_classic, mask_iou = [], []
+    regressions = []
+
+    for photo in photos:
+        image_bytes = photo.read_bytes()
+        image_cv = decode(image_bytes)
+        if image_cv is None:
+            print(f"[SKIP] {photo.name}: tidak bisa dibaca")
+            continue
+        masks, outputs = {}, {}
+        for mode in modes:
+            masks[mode], elapsed = timed(DETECTORS[mode], image_cv, repeat=args.repeat)
+            detect_ms[mode].append(elapsed)
+            cleaned, elapsed = timed(photo_cleaning.clean_watermark, image_bytes, mode, repeat=args.repeat)
+            clean_ms[mode].append(elapsed)
+            if not cleaned:
+                failures[mode] += 1
+                continue
+            outputs[mode] = decode(cleaned)
+
+            if args.golden_dir:
+                golden_path = args.golden_dir / mode / f"{photo.stem}.jpg"
+                if args.update_golden:
+                    golden_path.parent.mkdir(parents=True, exist_ok=True)
+                    golden_path.write_bytes(cleaned)
+                elif not golden_path.exists():
+                    regressions.append(f"{mode}/{photo.name}: golden image tidak ada")
+                else:
+                    score = psnr(outputs[mode], decode(golden_path.read_bytes()))
+                    if score < args.min_psnr:
+                        regressions.append(f"{mode}/{photo.name}: PSNR {score:.2f} dB < {args.min_psnr} dB")
+
+        if 'classic' in masks and 'fast' in masks:
+            mask_iou.append(iou(masks['classic'], masks['fast']))
+            if 'classic' in outputs and 'fast' not in outputs:
+                regressions.append(f"fast/{photo.name}: gagal, classic berhasil")
+            elif 'classic' in outputs and 'fast' in outputs:
+                score = min(psnr(outputs['classic'], outputs['fast']), 99.0)
+                psnr_vs_classic.append(score)
+                if score < args.min_fast_psnr:
+                    regressions.append(f"fast/{photo.name}: PSNR vs classic {score:.2f} dB < {args.min_fast_psnr} dB")
+
+    print()
+    for mode in modes:
+        print(f"[{mode}] deteksi (ms):    {summarize(detect_ms[mode])}")
+        print(f"[{mode}] bersihkan (ms):  {summarize(clean_ms[mode])}  gagal {failures[mode]}")
+    if 'classic' in modes and 'fast' in modes and clean_ms['fast']:
+        speedup = statistics.mean(clean_ms['classic']) / max(statistics.mean(clean_ms['fast']), 1e-9)
+        print(f"Percepatan fast vs classic: {speedup:.2f}x")
+        if mask_iou:
+            print(f"IoU mask fast vs classic: mean {statistics.mean(mask_iou):.3f}  min {min(mask_iou):.3f}")
+            if statistics.mean(mask_iou) < args.min_mask_iou:
+                regressions.append(f"fast: IoU mask rata-rata {statistics.mean(mask_iou):.3f} < {args.min_mask_iou}")
+        if psnr_vs_classic:
+            print(f"PSNR fast vs classic (dB, maks 99): mean {statistics.mean(psnr_vs_classic):.2f}  "
+                  f"min {min(psnr_vs_classic):.2f}")
+
+    if args.golden_dir and args.update_golden:
+        print(f"\n[OK] Golden image ditulis ke {args.golden_dir}")
+    if regressions:
+        print(f"\n[ERROR] {len(regressions)} regresi:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print("\n[OK] Tidak ada regresi")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
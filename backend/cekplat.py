@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, session, flash, redirect, url_for
 import requests
 from bs4 import BeautifulSoup
+import upstream_http
 import re
 import time
 from datetime import datetime, timedelta, timezone
@@ -29,7 +30,7 @@ def get_current_time():
 def fetch_data(no_polisi):
     url = f"http://www.jambisamsat.net/infopkb.php?no_polisi={no_polisi}"
     try:
-        response = requests.get(url, timeout=10)
+        response = upstream_http.get(url, timeout=10)
         if response.status_code == 200:
             return response.text
     except Exception as e:
@@ -107,7 +108,7 @@ def geocode_address(address):
         }
         try:
             time.sleep(1)
-            response = requests.get(url, params=params, headers=headers, timeout=5)
+            response = upstream_http.get(url, params=params, headers=headers, timeout=5)
             if response.status_code == 200:
                 results = response.json()
                 if results:
@@ -0,0 +1,277 @@
+"""
+Circuit breakers for the upstream servers (224, 116, alternative server,
+phone API).
+
+A breaker is closed (requests go through) or open (callers skip the upstream
+immediately). A background prober pings every registered upstream with a short
+timeout and opens/closes its breaker, so user requests never have to wait for
+a connect timeout to find out that a server is down.
+
+Breaker state lives in one small JSON file per upstream (written atomically),
+so all worker processes and the Telegram bot share what any of them has seen.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+
+import upstream_http
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass  # dotenv not available, use system environment variables
+
+STATE_DIR = os.environ.get("UPSTREAM_BREAKER_STATE_DIR",
+                           os.path.join(tempfile.gettempdir(), "profiling_upstream_breakers"))
+PROBE_INTERVAL = float(os.environ.get("UPSTREAM_PROBE_INTERVAL", "15"))  # 0 = prober off
+PROBE_TIMEOUT = float(os.environ.get("UPSTREAM_PROBE_TIMEOUT", "2"))
+FAILURE_THRESHOLD = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", "2"))
+# Open breaker without a recent probe: let one trial request through after this
+RESET_TIMEOUT = float(os.environ.get("UPSTREAM_BREAKER_RESET_TIMEOUT", "60"))
+SYNC_INTERVAL = 0.5  # seconds between state-file checks per breaker
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Thread-safe breaker for one upstream, shared across processes via a state file"""
+
+    def __init__(self, name: str, probe_url: str, failure_threshold: int = FAILURE_THRESHOLD):
+        self.name = name
+        self.probe_url = probe_url
+        self.failure_threshold = max(1, failure_threshold)
+        self.path = os.path.join(STATE_DIR, f"{name}.json")
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._last_probe = 0.0
+        self._last_error = None
+        self._updated_at = 0.0
+        self._file_mtime = None
+        self._last_sync = 0.0
+        self._trial_started = 0.0
+        self._rejected = 0
+
+    # ---- shared state ----
+    def _sync(self, force: bool = False):
+        """Pick up state written by other processes (cheap stat, throttled)"""
+        now = time.monotonic()
+        if not force and now - self._last_sync < SYNC_INTERVAL:
+            return
+        self._last_sync = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._file_mtime:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._file_mtime = mtime
+            if data.get('updated_at', 0) > self._updated_at:
+                self._state = data.get('state', CLOSED)
+                self._failures = data.get('failures', 0)
+                self._opened_at = data.get('opened_at', 0.0)
+                self._last_probe = data.get('last_probe', 0.0)
+                self._last_error = data.get('last_error')
+                self._updated_at = data['updated_at']
+
+    def _persist_locked(self):
+        self._updated_at = time.time()
+        data = {
+            'name': self.name,
+            'state': self._state,
+            'failures': self._failures,
+            'opened_at': self._opened_at,
+            'last_probe': self._last_probe,
+            'last_error': self._last_error,
+            'updated_at': self._updated_at,
+        }
+        try:
+            os.makedirs(STATE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{self.name}.", dir=STATE_DIR)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self._file_mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            print(f"WARNING: [BREAKER] Gagal menyimpan state {self.name}: {e}", file=sys.stderr)
+
+    # ---- request path ----
+    def allow_request(self) -> bool:
+        """True if callers should try this upstream now (never does network I/O)"""
+        _ensure_prober()
+        self._sync()
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.time()
+            if self._state == HALF_OPEN:
+                # One trial at a time; a trial that never reported back expires
+                if now - self._trial_started < RESET_TIMEOUT:
+                    self._rejected += 1
+                    return False
+            elif now - max(self._opened_at, self._last_probe) < RESET_TIMEOUT:
+                self._rejected += 1
+                return False
+            # No prober has looked at this upstream for a while: let one request try
+            self._state = HALF_OPEN
+            self._trial_started = now
+            self._persist_locked()
+            return True
+
+    def record_success(self):
+        self._sync()
+        with self._lock:
+            if self._state == CLOSED and self._failures == 0:
+                return
+            reopened = self._state != CLOSED
+            self._state = CLOSED
+            self._failures = 0
+            self._last_error = None
+            self._persist_locked()
+        if reopened:
+            print(f"INFO: [BREAKER] ✅ {self.name} tersedia kembali (closed)", file=sys.stderr)
+
+    def record_failure(self, error=None):
+        self._sync()
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error)[:200] if error else None
+            tripped = self._state != OPEN and (
+                self._state == HALF_OPEN or self._failures >= self.failure_threshold)
+            if tripped:
+                self._state = OPEN
+                self._opened_at = time.time()
+            self._persist_locked()
+        if tripped:
+            print(f"INFO: [BREAKER] ❌ {self.name} ditandai tidak tersedia (open): {error}", file=sys.stderr)
+
+    # ---- prober ----
+    def probe_due(self) -> bool:
+        self._sync()
+        return time.time() - self._last_probe >= PROBE_INTERVAL
+
+    def probe(self) -> bool:
+        """Ping the upstream once; any HTTP response counts as reachable"""
+        try:
+            upstream_http.get(self.probe_url, retry=False, timeout=PROBE_TIMEOUT, allow_redirects=False)
+            ok, error = True, None
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        except Exception as e:
+            # Not a connectivity problem (e.g. malformed response): keep current state
+            print(f"WARNING: [BREAKER] Probe {self.name} error: {e}", file=sys.stderr)
+            return self.state() != OPEN
+        with self._lock:
+            previous = self._state
+            self._last_probe = time.time()
+            if ok:
+                self._state = CLOSED
+                self._failures = 0
+                self._last_error = None
+            else:
+                # The connect itself failed: open right away, whatever the threshold
+                self._failures += 1
+                self._last_error = error[:200]
+                if previous != OPEN:
+                    self._state = OPEN
+                    self._opened_at = self._last_probe
+            # Always persisted: the shared last_probe lets other processes skip this round
+            self._persist_locked()
+        if ok and previous != CLOSED:
+            print(f"INFO: [BREAKER] ✅ {self.name} tersedia kembali (closed)", file=sys.stderr)
+        elif not ok and previous != OPEN:
+            print(f"INFO: [BREAKER] ❌ {self.name} ditandai tidak tersedia (open): {error}", file=sys.stderr)
+        return ok
+
+    def state(self) -> str:
+        self._sync()
+        with self._lock:
+            return self._state
+
+    def stats(self) -> Dict:
+        self._sync()
+        with self._lock:
+            return {
+                'state': self._state,
+                'failures': self._failures,
+                'opened_at': self._opened_at or None,
+                'last_probe': self._last_probe or None,
+                'last_error': self._last_error,
+                'rejected': self._rejected,
+                'probe_url': self.probe_url,
+            }
+
+
+_registry_lock = threading.Lock()
+_breakers = {}  # name -> CircuitBreaker
+_prober_thread = None
+_prober_stop = threading.Event()
+
+
+def register(name: str, probe_url: str, failure_threshold: Optional[int] = None) -> CircuitBreaker:
+    """Create (or return) the breaker for an upstream and have the prober watch it"""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, probe_url, failure_threshold or FAILURE_THRESHOLD)
+            _breakers[name] = breaker
+        return breaker
+
+
+def get_breaker(name: str) -> Optional[CircuitBreaker]:
+    return _breakers.get(name)
+
+
+def _probe_loop():
+    while not _prober_stop.is_set():
+        for breaker in list(_breakers.values()):
+            if _prober_stop.is_set():
+                break
+            try:
+                # Another process may have probed this round already (shared last_probe)
+                if breaker.probe_due():
+                    breaker.probe()
+            except Exception as e:
+                print(f"WARNING: [BREAKER] Prober error ({breaker.name}): {e}", file=sys.stderr)
+        _prober_stop.wait(1.0)
+
+
+def _ensure_prober():
+    global _prober_thread
+    if PROBE_INTERVAL <= 0 or (_prober_thread is not None and _prober_thread.is_alive()):
+        return
+    with _registry_lock:
+        if _prober_thread is None or not _prober_thread.is_alive():
+            _prober_stop.clear()
+            _prober_thread = threading.Thread(target=_probe_loop, name='upstream-prober', daemon=True)
+            _prober_thread.start()
+
+
+def start_prober():
+    """Start the background prober now instead of on the first breaker check"""
+    _ensure_prober()
+
+
+def stop_prober():
+    _prober_stop.set()
+
+
+def breaker_stats() -> Dict:
+    """State of every registered upstream breaker"""
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
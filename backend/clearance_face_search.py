@@ -20,11 +20,21 @@ import time
 import base64
 import argparse
 import re
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 import requests
 
+import circuit_breaker
+import upstream_http
+from result_cache import ResultCache
+from singleflight import get_flight
+from ttl_cache import TTLCache
+from upstream_sessions import SessionPool, register_pool
+
 # Load environment variables from .env file
 try:
     from dotenv import load_dotenv
@@ -79,37 +89,41 @@ ALTERNATIVE_SERVER_PASSWORD = os.environ.get("ALTERNATIVE_SERVER_PASSWORD", "paf
 _warning_cache = {}
 WARNING_COOLDOWN = 300  # 5 minutes
 
-# Session cache for server 116 (to maintain login session)
-_server_116_session = None
-_server_116_session_time = 0
-_server_116_session_timeout = 1800  # 30 minutes (reduced from 1 hour for better reliability)
-
-# Session cache for alternative server (to maintain login session)
-_alternative_server_session = None
-_alternative_server_session_time = 0
-_alternative_server_session_timeout = 1800  # 30 minutes
-
-def _clear_server_116_session():
-    """Clear server 116 session cache"""
-    global _server_116_session, _server_116_session_time
-    _server_116_session = None
-    _server_116_session_time = 0
-
-def _clear_alternative_server_session():
-    """Clear alternative server session cache"""
-    global _alternative_server_session, _alternative_server_session_time
-    _alternative_server_session = None
-    _alternative_server_session_time = 0
-
-# Server 224 availability cache (smart detection)
-# PENTING: Initial state True tapi akan langsung check saat pertama kali dipanggil
-_server_224_status = {
-    'available': True,  # Assume available by default, but will check on first call
-    'last_check': 0,  # 0 means never checked, will force check on first call
-    'check_interval': 30,  # Check every 30 seconds (reduced for faster recovery detection)
-    'consecutive_failures': 0,
-    'max_failures': 1  # After 1 failure, mark as unavailable (more aggressive)
-}
+# Login sessions for server 116 and the alternative server: single-flight login,
+# proactive refresh sebelum expired, dan pool kecil session untuk request paralel
+SESSION_REFRESH_MARGIN = float(os.environ.get("UPSTREAM_SESSION_REFRESH_MARGIN", "300"))
+SESSION_POOL_SIZE = int(os.environ.get("UPSTREAM_SESSION_POOL_SIZE", "2"))
+_server_116_session_timeout = int(os.environ.get("SERVER_116_SESSION_TTL", "1800"))  # 30 minutes
+_alternative_server_session_timeout = int(os.environ.get("ALTERNATIVE_SERVER_SESSION_TTL", "1800"))  # 30 minutes
+
+_server_116_sessions = register_pool(SessionPool(
+    'server_116', lambda: _new_server_116_session(),
+    ttl=_server_116_session_timeout, refresh_margin=SESSION_REFRESH_MARGIN, size=SESSION_POOL_SIZE))
+_alternative_server_sessions = register_pool(SessionPool(
+    'alternative_server', lambda: _new_alternative_server_session(),
+    ttl=_alternative_server_session_timeout, refresh_margin=SESSION_REFRESH_MARGIN, size=SESSION_POOL_SIZE))
+
+def _clear_server_116_session(session=None):
+    """Drop an expired server 116 session (or all of them if session is None)"""
+    _server_116_sessions.invalidate(session)
+
+def _clear_alternative_server_session(session=None):
+    """Drop an expired alternative server session (or all of them if session is None)"""
+    _alternative_server_sessions.invalidate(session)
+
+# Upstream availability: thread-safe circuit breakers driven by a background prober.
+# State dibagi antar proses (worker Flask + bot Telegram) lewat file state,
+# jadi request user tidak pernah menunggu connect timeout ke server yang mati.
+# Server 224: 1 kegagalan koneksi langsung membuka breaker (agresif, seperti sebelumnya)
+_breaker_224 = circuit_breaker.register('server_224', BASE.rstrip("/") + LOGIN_PATH, failure_threshold=1)
+_breaker_116 = circuit_breaker.register('server_116', SERVER_116_LOGIN_URL)
+_breaker_alternative = circuit_breaker.register('alternative_server', ALTERNATIVE_SERVER_LOGIN_URL)
+
+
+def _is_upstream_failure(error) -> bool:
+    """Connection errors and read timeouts count against a breaker; waiting for a local host slot does not"""
+    return (isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            and not isinstance(error, upstream_http.HostSlotTimeout))
 # ---------------------------
 
 def safe_b64decode(data: str) -> bytes:
@@ -155,62 +169,13 @@ def token_valid(token: str, leeway_seconds=10) -> bool:
     return (exp - leeway_seconds) > int(time.time())
 
 def _check_server_224_availability(quick_check=False, force_check=False):
-    """Quick check if server 224 is available - returns False immediately if server is marked unavailable"""
-    global _server_224_status
-    
-    current_time = time.time()
-    
-    # PENTING: Jika server sudah ditandai tidak tersedia, langsung return False TANPA melakukan request apapun
-    # Ini untuk menghindari delay yang tidak perlu
-    if not _server_224_status['available'] and not force_check:
-        # Only re-check after check_interval to allow recovery (server mungkin sudah hidup kembali)
-        time_since_check = current_time - _server_224_status['last_check']
-        if time_since_check < _server_224_status['check_interval']:
-            # Server masih ditandai tidak tersedia dan belum cukup waktu untuk re-check
-            # Langsung return False tanpa melakukan request - INI YANG MEMBUAT FLEKSIBEL!
-            return False
-        # Jika sudah cukup waktu (30 detik), coba check lagi untuk recovery detection
-        # Fall through to check below
-    
-    # If we recently checked and server is available, trust the cache (no need to check again)
-    if _server_224_status['available'] and not force_check:
-        time_since_check = current_time - _server_224_status['last_check']
-        if time_since_check < _server_224_status['check_interval']:
-            return True
+    """Check if server 224 is available - answered from the circuit breaker, no network I/O.
     
-    # Perform quick availability check (only if we need to check)
-    try:
-        # Use very short timeout for quick check (0.5 second for quick_check, 2 for normal)
-        # Semakin pendek timeout, semakin cepat deteksi kegagalan
-        timeout = 0.5 if quick_check else 2
-        url = BASE.rstrip("/") + LOGIN_PATH
-        # Just try to connect, don't actually login
-        response = requests.get(url, timeout=timeout)
-        # If we get any response (even 404/405), server is up
-        _server_224_status['available'] = True
-        _server_224_status['last_check'] = current_time
-        _server_224_status['consecutive_failures'] = 0
-        return True
-    except (requests.exceptions.ConnectionError, 
-            requests.exceptions.Timeout, 
-            requests.exceptions.ConnectTimeout) as e:
-        # Server is not available - mark immediately
-        _server_224_status['consecutive_failures'] += 1
-        _server_224_status['last_check'] = current_time
-        _server_224_status['available'] = False  # Mark immediately, don't wait
-        
-        warning_key = "server_224_marked_unavailable"
-        if _should_show_warning(warning_key):
-            print(f"INFO: Server 224 ditandai sebagai tidak tersedia (quick check)", file=sys.stderr)
-        
-        return False
-    except Exception:
-        # Other errors - assume server might be available but having issues
-        # But if we have consecutive failures, mark as unavailable
-        if _server_224_status['consecutive_failures'] >= _server_224_status['max_failures']:
-            _server_224_status['available'] = False
-            return False
-        return True  # Give benefit of the doubt
+    force_check probes server 224 synchronously instead (short timeout).
+    """
+    if force_check:
+        return _breaker_224.probe()
+    return _breaker_224.allow_request()
 
 def do_login(username: str, password: str, retry_count=0):
     """
@@ -246,7 +211,7 @@ def do_login(username: str, password: str, retry_count=0):
     try:
         # Use shorter timeout for faster failure detection
         timeout = 5 if FALLBACK_MODE else 15
-        r = requests.post(url, data=data, timeout=timeout)
+        r = upstream_http.post(url, data=data, timeout=timeout)
         r.raise_for_status()
         j = r.json()
         
@@ -283,17 +248,14 @@ def do_login(username: str, password: str, retry_count=0):
         
         save_cached_token(token)
         # Mark server as available on successful login
-        _server_224_status['available'] = True
-        _server_224_status['consecutive_failures'] = 0
+        _breaker_224.record_success()
         return token
         
     except (requests.exceptions.ConnectionError, 
             requests.exceptions.Timeout, 
             requests.exceptions.ConnectTimeout) as e:
         # Connection/timeout errors - mark server as unavailable IMMEDIATELY
-        _server_224_status['consecutive_failures'] += 1
-        _server_224_status['last_check'] = time.time()
-        _server_224_status['available'] = False
+        _breaker_224.record_failure(e)
         
         error_type = type(e).__name__
         
@@ -390,8 +352,7 @@ def ensure_token(username: str, password: str, force_refresh=False):
     if token and not token.startswith("fallback_token_"):
         save_cached_token(token)
         # Mark server as available on successful login
-        _server_224_status['available'] = True
-        _server_224_status['consecutive_failures'] = 0
+        _breaker_224.record_success()
     
     return token
 
@@ -418,45 +379,18 @@ def _login_server_116(username=None, password=None):
     
     Parameter username/password diabaikan - hanya untuk kompatibilitas API.
     """
-    global _server_116_session, _server_116_session_time
-    
+    # Concurrent callers share one login; sessions are refreshed in the background
+    return _server_116_sessions.get()
+
+def _new_server_116_session():
+    """Log in to server 116 with a fresh session (called by _server_116_sessions only)"""
     # PENTING: SELALU gunakan kredensial hardcoded untuk server 116!
     # JANGAN PERNAH gunakan kredensial dari frontend (rezarios) untuk server 116!
     use_username = SERVER_116_USERNAME  # SELALU jambi
     use_password = SERVER_116_PASSWORD  # SELALU @ab526d
     
-    # Check if session is still valid (by time)
-    current_time = time.time()
-    session_age = current_time - _server_116_session_time if _server_116_session_time > 0 else _server_116_session_timeout + 1
-    
-    if _server_116_session and session_age < _server_116_session_timeout:
-        # Only validate session if it's been used for more than 10 minutes
-        # This prevents unnecessary validation on every request while still catching expired sessions
-        if session_age > 600:  # 10 minutes
-            # PENTING: Validasi session dengan test request kecil untuk memastikan masih valid
-            # Ini mencegah penggunaan session yang sudah expired meskipun belum mencapai timeout
-            try:
-                # Quick validation: try to access a lightweight endpoint
-                # If session expired, this will fail and we'll get fresh session
-                test_response = _server_116_session.get(SERVER_116_BASE + '/', timeout=2)
-                # If we get redirected to login or get 401/403, session expired
-                if test_response.status_code in [401, 403] or '/auth/login' in test_response.url:
-                    print("INFO: [SERVER_116] Session expired (detected via validation), akan refresh", file=sys.stderr)
-                    _clear_server_116_session()
-                else:
-                    print("INFO: [SERVER_116] Menggunakan session yang masih valid (validated)", file=sys.stderr)
-                    return _server_116_session
-            except Exception as e:
-                # If validation fails, assume session expired and get fresh one
-                print(f"INFO: [SERVER_116] Session validation failed ({e}), akan refresh", file=sys.stderr)
-                _clear_server_116_session()
-        else:
-            # Session masih baru (< 10 menit), langsung gunakan tanpa validasi
-            print("INFO: [SERVER_116] Menggunakan session yang masih valid", file=sys.stderr)
-            return _server_116_session
-    
-    # Create new session
-    session = requests.Session()
+    # Create new session (own cookie jar, pooled keep-alive connections)
+    session = upstream_http.new_session(SERVER_116_BASE)
     
     try:
         print(f"INFO: [SERVER_116] Mencoba login dengan kredensial hardcoded: {use_username}", file=sys.stderr)
@@ -491,15 +425,14 @@ def _login_server_116(username=None, password=None):
             print(f"ERROR: [SERVER_116] Gagal login dengan {use_username}: {login_response.status_code}", file=sys.stderr)
             return None
         
-        # Save session
-        _server_116_session = session
-        _server_116_session_time = current_time
+        _breaker_116.record_success()
         
         print(f"INFO: [SERVER_116] ✅ Login berhasil dengan username: {use_username}", file=sys.stderr)
         
         return session
         
     except requests.exceptions.ConnectionError as e:
+        _breaker_116.record_failure(e)
         warning_key = "server_116_connection_error"
         if _should_show_warning(warning_key):
             print(f"ERROR: [SERVER_116] Tidak dapat terhubung ke server 116", file=sys.stderr)
@@ -510,13 +443,13 @@ def _login_server_116(username=None, password=None):
                 print(f"ERROR: [SERVER_116]   2. IP {SERVER_116_BASE} adalah IP private dan tidak bisa diakses dari ngrok", file=sys.stderr)
                 print(f"ERROR: [SERVER_116]   3. Set environment variable SERVER_116_BASE ke URL yang bisa diakses", file=sys.stderr)
                 print(f"ERROR: [SERVER_116]   Contoh: export SERVER_116_BASE=http://your-ngrok-url.ngrok.io", file=sys.stderr)
-        _clear_server_116_session()
         return None
     except requests.exceptions.Timeout as e:
+        if _is_upstream_failure(e):
+            _breaker_116.record_failure(e)
         warning_key = "server_116_timeout"
         if _should_show_warning(warning_key):
             print(f"ERROR: [SERVER_116] Timeout saat mengakses server 116: {SERVER_116_BASE}", file=sys.stderr)
-        _clear_server_116_session()
         return None
     except Exception as e:
         warning_key = "server_116_login_exception"
@@ -524,9 +457,33 @@ def _login_server_116(username=None, password=None):
             print(f"ERROR: [SERVER_116] Exception saat login: {str(e)}", file=sys.stderr)
             print(f"ERROR: [SERVER_116] Tipe error: {type(e).__name__}", file=sys.stderr)
             print(f"ERROR: [SERVER_116] URL yang dicoba: {SERVER_116_BASE}", file=sys.stderr)
-        _clear_server_116_session()
         return None
 
+def _server_116_session_expired(response) -> bool:
+    """401/403 or an HTML (login) page instead of JSON: server 116 dropped the session"""
+    if response.status_code in (401, 403):
+        return True
+    content_type = response.headers.get('Content-Type', '').lower()
+    head = response.text[:200].lower().strip()
+    return 'text/html' in content_type or head.startswith('<!doctype') or head.startswith('<html')
+
+def server_116_get(session, url, params=None, timeout=15):
+    """GET on server 116 with a pooled session from _login_server_116.
+    
+    When the server has expired the session, it is dropped from the pool and
+    the request is retried once with a fresh login. Returns the response (the
+    original one if the fresh login fails).
+    """
+    response = session.get(url, params=params, timeout=timeout)
+    if not _server_116_session_expired(response):
+        return response
+    print(f"INFO: [SERVER_116] Session expired (status {response.status_code}), login ulang dan retry", file=sys.stderr)
+    _clear_server_116_session(session)
+    fresh = _login_server_116()
+    if not fresh:
+        return response
+    return fresh.get(url, params=params, timeout=timeout)
+
 def _search_server_116(params: dict, username=None, password=None, retry_count=0):
     """
     Search using server 116 identity API
@@ -587,11 +544,13 @@ def _search_server_116(params: dict, username=None, password=None, retry_count=0
         if search_response.status_code != 200:
             print(f"ERROR: [SERVER_116] Gagal melakukan pencarian: {search_response.status_code}", file=sys.stderr)
             print(f"ERROR: [SERVER_116] Response text: {search_response.text[:500]}", file=sys.stderr)
+            if search_response.status_code >= 500:
+                _breaker_116.record_failure(f"HTTP {search_response.status_code}")
             
             # If 401/403, likely session expired - clear and retry once
             if search_response.status_code in [401, 403]:
                 print(f"INFO: [SERVER_116] Status {search_response.status_code} - kemungkinan session expired, akan retry", file=sys.stderr)
-                _clear_server_116_session()
+                _clear_server_116_session(session)
                 # Retry once with fresh session
                 return _search_server_116(params, username, password, retry_count + 1)
             
@@ -607,11 +566,14 @@ def _search_server_116(params: dict, username=None, password=None, retry_count=0
         if is_html_response or is_login_page:
             print(f"ERROR: [SERVER_116] Response adalah HTML/login page - session expired!", file=sys.stderr)
             # Clear session dan retry dengan fresh login
-            _clear_server_116_session()
+            _clear_server_116_session(session)
             print(f"INFO: [SERVER_116] ✅ Session cleared, retry dengan fresh login", file=sys.stderr)
             # Retry once with fresh session (max 1 retry to avoid infinite loop)
             return _search_server_116(params, username, password, retry_count + 1)
         
+        # The server answered: closes a half-open breaker whose trial ran on a pooled session
+        _breaker_116.record_success()
+        
         # Parse response
         try:
             data = search_response.json()
@@ -624,7 +586,7 @@ def _search_server_116(params: dict, username=None, password=None, retry_count=0
                 error_msg = str(data.get('error', '')).lower() + str(data.get('message', '')).lower()
                 if any(keyword in error_msg for keyword in ['session', 'expired', 'unauthorized', 'login', 'auth']):
                     print(f"WARNING: [SERVER_116] Response menunjukkan session expired: {data.get('error', data.get('message', ''))}", file=sys.stderr)
-                    _clear_server_116_session()
+                    _clear_server_116_session(session)
                     print(f"INFO: [SERVER_116] ✅ Session cleared, retry dengan fresh login", file=sys.stderr)
                     # Retry once with fresh session
                     return _search_server_116(params, username, password, retry_count + 1)
@@ -633,7 +595,7 @@ def _search_server_116(params: dict, username=None, password=None, retry_count=0
             # If JSON parse fails, check if it's HTML (session expired)
             if is_html_response or is_login_page:
                 print(f"ERROR: [SERVER_116] Gagal parse JSON dan response adalah HTML - session expired!", file=sys.stderr)
-                _clear_server_116_session()
+                _clear_server_116_session(session)
                 print(f"INFO: [SERVER_116] ✅ Session cleared, retry dengan fresh login", file=sys.stderr)
                 return _search_server_116(params, username, password, retry_count + 1)
             else:
@@ -665,12 +627,279 @@ def _search_server_116(params: dict, username=None, password=None, retry_count=0
             return {"person": []}
             
     except Exception as e:
+        if _is_upstream_failure(e):
+            _breaker_116.record_failure(e)
         warning_key = "server_116_search_exception"
         if _should_show_warning(warning_key):
             print(f"WARNING: Server 116 - Exception saat pencarian: {e}", file=sys.stderr)
         return None
 
-def call_search(token: str, params: dict, username=None, password=None):
+# ---------- Parallel fan-out (server 116 + alternative server) ----------
+# wait_all: tunggu kedua sumber (maks. deadline masing-masing) lalu gabungkan.
+# first_then_backfill: kembalikan sumber pertama yang punya hasil; sumber yang
+#   lebih lambat disimpan sebagai backfill (lihat get_search_backfill).
+UPSTREAM_MERGE_POLICY = os.environ.get("UPSTREAM_MERGE_POLICY", "wait_all")
+UPSTREAM_FANOUT_WORKERS = int(os.environ.get("UPSTREAM_FANOUT_WORKERS", "32"))
+SOURCE_DEADLINES = {
+    'server_116': float(os.environ.get("SERVER_116_DEADLINE", "30")),
+    'alternative_server': float(os.environ.get("ALTERNATIVE_SERVER_DEADLINE", "30")),
+}
+
+_fanout_executor = None
+_fanout_executor_lock = threading.Lock()
+_search_backfill = TTLCache(max_size=1000, ttl=float(os.environ.get("SEARCH_BACKFILL_TTL", "300")))
+
+
+def _get_fanout_executor():
+    global _fanout_executor
+    if _fanout_executor is None:
+        with _fanout_executor_lock:
+            if _fanout_executor is None:
+                _fanout_executor = ThreadPoolExecutor(max_workers=UPSTREAM_FANOUT_WORKERS,
+                                                      thread_name_prefix='upstream-fanout')
+    return _fanout_executor
+
+
+def _person_count(result) -> int:
+    if not isinstance(result, dict):
+        return 0
+    person_list = result.get('person', [])
+    return len(person_list) if isinstance(person_list, list) else 0
+
+
+def _timed_source_call(func, params, username, password):
+    """Run one upstream search and return (result, elapsed_seconds, error)"""
+    started = time.monotonic()
+    try:
+        return func(dict(params), username, password), time.monotonic() - started, None
+    except Exception as e:
+        return None, time.monotonic() - started, f"{type(e).__name__}: {e}"
+
+
+def _source_timing(outcome=None, status=None) -> dict:
+    if outcome is None:
+        return {'status': status, 'elapsed_ms': None, 'count': 0}
+    result, elapsed, error = outcome
+    if error:
+        status = 'error'
+    elif result is None:
+        status = 'failed'
+    else:
+        status = 'ok' if _person_count(result) > 0 else 'empty'
+    timing = {'status': status, 'elapsed_ms': round(elapsed * 1000, 1), 'count': _person_count(result)}
+    if error:
+        timing['error'] = error
+    return timing
+
+
+def _store_backfill(backfill_key, source, future):
+    """Keep a late source result so the client can fetch it afterwards"""
+    def _done(f):
+        outcome = f.result()
+        _search_backfill.set(backfill_key, {
+            'source': source,
+            'result': outcome[0],
+            'timing': _source_timing(outcome),
+        })
+    future.add_done_callback(_done)
+
+
+def get_search_backfill(backfill_key: str):
+    """Late result of a first_then_backfill search, or None if not (yet) available"""
+    return _search_backfill.get(backfill_key)
+
+
+def _fan_out_fallback_search(params: dict, username=None, password=None, policy=None):
+    """Query server 116 and the alternative server concurrently.
+    
+    Returns (server_116_result, alternative_result, timings). A source that
+    misses its deadline counts as failed (None); with first_then_backfill its
+    result is stored under timings['backfill_key'] when it arrives.
+    """
+    policy = policy or UPSTREAM_MERGE_POLICY
+    executor = _get_fanout_executor()
+    started = time.monotonic()
+    sources = {
+        'server_116': _search_server_116,
+        'alternative_server': _search_alternative_server,
+    }
+    breakers = {
+        'server_116': _breaker_116,
+        'alternative_server': _breaker_alternative,
+    }
+    # Sources with an open breaker are skipped without touching the network
+    skipped = {name for name in sources if not breakers[name].allow_request()}
+    futures = {name: executor.submit(_timed_source_call, func, params, username, password)
+               for name, func in sources.items() if name not in skipped}
+    deadlines = {name: started + SOURCE_DEADLINES[name] for name in sources}
+    outcomes = {}
+    
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        expired = {name for name in pending if deadlines[name] <= now}
+        pending -= expired
+        if not pending:
+            break
+        
+        wait_for = min(deadlines[name] for name in pending) - now
+        done, _ = wait([futures[name] for name in pending], timeout=wait_for, return_when=FIRST_COMPLETED)
+        for name in list(pending):
+            if futures[name] in done:
+                outcomes[name] = futures[name].result()
+                pending.discard(name)
+        
+        if policy == 'first_then_backfill' and pending and any(
+                _person_count(outcome[0]) > 0 for outcome in outcomes.values()):
+            break
+    
+    timings = {name: _source_timing(status='circuit_open') for name in skipped}
+    backfill_key = None
+    for name, future in futures.items():
+        if name in outcomes:
+            timings[name] = _source_timing(outcomes[name])
+        elif not future.done() and policy == 'first_then_backfill' and (
+                time.monotonic() < deadlines[name]):
+            backfill_key = backfill_key or secrets.token_urlsafe(16)
+            _store_backfill(backfill_key, name, future)
+            timings[name] = _source_timing(status='pending')
+        else:
+            timings[name] = _source_timing(status='timeout')
+            print(f"WARNING: [CALL_SEARCH] {name} melewati deadline {SOURCE_DEADLINES[name]}s", file=sys.stderr)
+    
+    timings['total_ms'] = round((time.monotonic() - started) * 1000, 1)
+    timings['policy'] = policy
+    if backfill_key:
+        timings['backfill_key'] = backfill_key
+    
+    server_116_result = outcomes.get('server_116', (None, 0, None))[0]
+    alternative_result = outcomes.get('alternative_server', (None, 0, None))[0]
+    return server_116_result, alternative_result, timings
+
+
+# ---------- Identity result cache (in front of call_search) ----------
+# Memory tier per proses + disk tier opsional (IDENTITY_CACHE_DIR) yang dibagi antar proses.
+# Hasil berisi foto base64, jadi memory tier juga dibatasi ukuran total (IDENTITY_CACHE_MAX_MB).
+# Hasil "tidak ditemukan" disimpan lebih singkat (IDENTITY_CACHE_NEGATIVE_TTL).
+_identity_cache = ResultCache(
+    'identity',
+    max_size=int(os.environ.get("IDENTITY_CACHE_SIZE", "2000")),
+    max_bytes=int(float(os.environ.get("IDENTITY_CACHE_MAX_MB", "256")) * 1024 * 1024),
+    ttl=float(os.environ.get("IDENTITY_CACHE_TTL", "600")),
+    negative_ttl=float(os.environ.get("IDENTITY_CACHE_NEGATIVE_TTL", "60")),
+    disk_dir=os.environ.get("IDENTITY_CACHE_DIR") or None,
+    disk_max_files=int(os.environ.get("IDENTITY_CACHE_DISK_MAX_FILES", "20000")),
+)
+
+
+def _normalize_search_value(value) -> str:
+    return ' '.join(str(value).split()).lower()
+
+
+def _identity_cache_key(params: dict) -> str:
+    """Cache key from search params: empty values dropped, whitespace/case normalised"""
+    normalized = {k: _normalize_search_value(v) for k, v in params.items()
+                  if v is not None and str(v).strip() != ''}
+    return json.dumps(normalized, sort_keys=True)
+
+
+def _identity_cache_policy(result):
+    """Return 'positive', 'negative' or None (do not cache) for a call_search result"""
+    if not isinstance(result, dict) or result.get('_backfill_pending'):
+        return None
+    if result.get('_server_116_unavailable') or result.get('_alternative_server_unavailable'):
+        return None  # an upstream failed: at best a partial answer
+    person_list = result.get('person')
+    if not isinstance(person_list, list):
+        return None
+    # A merge with a source that failed, timed out or was skipped by its
+    # breaker is partial, like the all-failed case: don't serve it for a TTL
+    timings = result.get('_source_timings') or {}
+    if any(isinstance(t, dict) and t.get('status') not in ('ok', 'empty')
+           for t in timings.values()):
+        return None
+    return 'positive' if person_list else 'negative'
+
+
+_search_flight = get_flight('call_search')
+
+
+def call_search(token: str, params: dict, username=None, password=None, use_cache=True):
+    """Identity search (server 224, fallback 116 + alternative server) behind the result cache.
+    
+    Identical searches that are already in flight share that upstream call.
+    """
+    key = _identity_cache_key(params)
+    if use_cache:
+        if _identity_cache_sync is not None:
+            _identity_cache_sync()  # apply purges published by other processes first
+        cached, tier = _identity_cache.get(key)
+        if cached is not None:
+            print(f"INFO: [IDENTITY_CACHE] Hit ({tier}) untuk {key}", file=sys.stderr)
+            cached['_cache_hit'] = tier
+            return cached
+    return _search_flight.do(key, _search_and_cache, key, token, params, username, password)
+
+
+def _search_and_cache(key, token, params, username=None, password=None):
+    result = _call_search_uncached(token, params, username, password)
+    policy = _identity_cache_policy(result)
+    if policy:
+        _identity_cache.set(key, result, negative=(policy == 'negative'))
+    return result
+
+
+def purge_identity_cache(nik=None, name=None, memory_only=False) -> int:
+    """Drop cached identity results for a NIK and/or name (everything if both are empty).
+    
+    Only this process's memory tier (plus the shared disk tier) is purged;
+    other processes follow via publish_identity_cache_purge.
+    """
+    fragments = []
+    if nik:
+        fragments.append(json.dumps({'nik': _normalize_search_value(nik)})[1:-1])
+    if name:
+        fragments.append(json.dumps({'name': _normalize_search_value(name)})[1:-1])
+    if not fragments:
+        return _identity_cache.purge(memory_only=memory_only)
+    return _identity_cache.purge(lambda key: all(fragment in key for fragment in fragments),
+                                 memory_only=memory_only)
+
+
+# ---- Purges across processes (Flask workers, Telegram bot) via cache_invalidations ----
+_IDENTITY_INVALIDATION_SCOPE = 'identity'
+_identity_cache_sync = None
+
+
+def _apply_identity_purge_event(cache_key: str):
+    """Purge published by another process: only the memory tier, the disk tier is shared"""
+    try:
+        event = json.loads(cache_key)
+    except ValueError:
+        event = {}
+    purge_identity_cache(nik=event.get('nik'), name=event.get('name'), memory_only=True)
+
+
+def attach_identity_cache_invalidations(db):
+    """Let this process apply identity cache purges published through db (a UserDatabase)"""
+    global _identity_cache_sync
+    db.register_cache_invalidation_handler(_IDENTITY_INVALIDATION_SCOPE, _apply_identity_purge_event)
+    _identity_cache_sync = db.sync_cache_invalidations
+
+
+def publish_identity_cache_purge(db, nik=None, name=None):
+    """Ask every other process to purge the same identity entries from its memory tier"""
+    cache_key = json.dumps({'nik': nik or None, 'name': name or None})
+    if len(cache_key) > 255:  # cache_invalidations.cache_key: purge everything instead
+        cache_key = json.dumps({'nik': None, 'name': None})
+    db.publish_cache_invalidation(_IDENTITY_INVALIDATION_SCOPE, cache_key)
+
+
+def get_identity_cache_stats():
+    return _identity_cache.stats()
+
+
+def _call_search_uncached(token: str, params: dict, username=None, password=None):
     # Check if this is a fallback token - if so, skip server 224 and go directly to server 116
     is_fallback_token = token.startswith("fallback_token_")
     
@@ -697,20 +926,18 @@ def call_search(token: str, params: dict, username=None, password=None):
         try:
             # Use shorter timeout for faster failure detection (5 seconds in fallback mode)
             timeout = 5 if FALLBACK_MODE else 30
-            r = requests.get(url, params=params, headers=headers, timeout=timeout)
+            # No retries: a dead server 224 must fail fast so server 116 can take over
+            r = upstream_http.get(url, retry=False, params=params, headers=headers, timeout=timeout)
             r.raise_for_status()
             result = r.json()
             # Mark server as available on successful search
-            _server_224_status['available'] = True
-            _server_224_status['consecutive_failures'] = 0
+            _breaker_224.record_success()
             return result
         except (requests.exceptions.ConnectionError, 
                 requests.exceptions.Timeout, 
                 requests.exceptions.ConnectTimeout) as e:
             # Connection/timeout errors - mark server as unavailable IMMEDIATELY
-            _server_224_status['consecutive_failures'] += 1
-            _server_224_status['last_check'] = time.time()
-            _server_224_status['available'] = False  # Mark immediately
+            _breaker_224.record_failure(e)
             
             error_type = type(e).__name__
             warning_key = f"server_224_search_failed_{error_type}"
@@ -741,11 +968,18 @@ def call_search(token: str, params: dict, username=None, password=None):
         print(f"INFO: [FLEKSIBEL] ✅ Menggunakan server 116 dengan kredensial hardcoded: {SERVER_116_USERNAME}/@ab526d", file=sys.stderr)
         print(f"INFO: [FLEKSIBEL] ⚠️ PENTING: Server 116 dan 224 memiliki kredensial BERBEDA!", file=sys.stderr)
     
-    server_116_result = _search_server_116(params, username, password)
-    
-    # Always try alternative server for comparison (even if server 116 has results)
-    alternative_result = _search_alternative_server(params, username, password)
-    
+    # Query server 116 and the alternative server (for comparison) at the same time
+    server_116_result, alternative_result, timings = _fan_out_fallback_search(params, username, password)
+    result = _merge_fallback_results(server_116_result, alternative_result)
+    result['_source_timings'] = timings
+    if timings.get('backfill_key'):
+        result['_backfill_pending'] = True
+        result['_backfill_key'] = timings['backfill_key']
+    return result
+
+
+def _merge_fallback_results(server_116_result, alternative_result):
+    """Combine server 116 and alternative server results (server 116 first, dedup by NIK)"""
     # Get alternative server results
     alt_person_list = []
     alt_person_count = 0
@@ -933,25 +1167,20 @@ def _login_alternative_server(username=None, password=None):
     Returns:
         requests.Session object jika berhasil, None jika gagal
     """
-    global _alternative_server_session, _alternative_server_session_time
-    
-    # Use cached session if still valid
-    current_time = time.time()
-    if (_alternative_server_session is not None and 
-        current_time - _alternative_server_session_time < _alternative_server_session_timeout):
-        print(f"INFO: [ALTERNATIVE_SERVER] Menggunakan session cache", file=sys.stderr)
-        return _alternative_server_session
-    
+    # Concurrent callers share one login; sessions are refreshed in the background
+    return _alternative_server_sessions.get()
+
+def _new_alternative_server_session():
+    """Log in to the alternative server with a fresh session (called by _alternative_server_sessions only)"""
     # ALWAYS use hardcoded credentials for alternative server (ignore provided username/password)
     # Server alternatif memiliki kredensial sendiri yang berbeda dari server lain
     use_username = ALTERNATIVE_SERVER_USERNAME  # Always use 'ferdi'
     use_password = ALTERNATIVE_SERVER_PASSWORD  # Always use 'pafer123'
     
     print(f"INFO: [ALTERNATIVE_SERVER] ⚠️ PENTING: Menggunakan kredensial hardcoded untuk server alternatif: {use_username}/***", file=sys.stderr)
-    print(f"INFO: [ALTERNATIVE_SERVER] ⚠️ Kredensial dari parameter (username={username}) TIDAK digunakan untuk server alternatif", file=sys.stderr)
     
     try:
-        session = requests.Session()
+        session = upstream_http.new_session(ALTERNATIVE_SERVER_BASE)
         
         # Get login page first to get any CSRF token or session cookie
         login_page = session.get(ALTERNATIVE_SERVER_LOGIN_URL, timeout=10)
@@ -1110,23 +1339,22 @@ def _login_alternative_server(username=None, password=None):
             print(f"WARNING: [ALTERNATIVE_SERVER] ⚠️ Gagal verifikasi session: {verify_e}, tapi akan lanjutkan", file=sys.stderr)
         
         # Save session for future use
-        _alternative_server_session = session
-        _alternative_server_session_time = current_time
+        _breaker_alternative.record_success()
         
         print(f"INFO: [ALTERNATIVE_SERVER] ✅ Login berhasil dan session disimpan untuk username: {use_username}", file=sys.stderr)
         return session
         
     except requests.exceptions.ConnectionError as e:
+        _breaker_alternative.record_failure(e)
         print(f"ERROR: [ALTERNATIVE_SERVER] Tidak dapat terhubung ke server alternatif", file=sys.stderr)
-        _clear_alternative_server_session()
         return None
     except requests.exceptions.Timeout as e:
+        if _is_upstream_failure(e):
+            _breaker_alternative.record_failure(e)
         print(f"ERROR: [ALTERNATIVE_SERVER] Timeout saat mengakses server alternatif", file=sys.stderr)
-        _clear_alternative_server_session()
         return None
     except Exception as e:
         print(f"ERROR: [ALTERNATIVE_SERVER] Exception saat login: {e}", file=sys.stderr)
-        _clear_alternative_server_session()
         return None
 
 def _normalize_person_data(person_data: dict) -> dict:
@@ -1259,11 +1487,13 @@ def _search_alternative_server(params: dict, username=None, password=None, retry
         if search_response.status_code != 200:
             print(f"ERROR: [ALTERNATIVE_SERVER] Gagal melakukan pencarian: {search_response.status_code}", file=sys.stderr)
             print(f"ERROR: [ALTERNATIVE_SERVER] Response text: {search_response.text[:500]}", file=sys.stderr)
+            if search_response.status_code >= 500:
+                _breaker_alternative.record_failure(f"HTTP {search_response.status_code}")
             
             # If 401/403, likely session expired - clear and retry once
             if search_response.status_code in [401, 403]:
                 print(f"INFO: [ALTERNATIVE_SERVER] Status {search_response.status_code} - kemungkinan session expired, akan retry", file=sys.stderr)
-                _clear_alternative_server_session()
+                _clear_alternative_server_session(session)
                 return _search_alternative_server(params, username, password, retry_count + 1)
             
             return None
@@ -1305,10 +1535,13 @@ def _search_alternative_server(params: dict, username=None, password=None, retry
             print(f"ERROR: [ALTERNATIVE_SERVER] Response adalah login page - session expired!", file=sys.stderr)
             print(f"DEBUG: [ALTERNATIVE_SERVER] Response URL: {response_url}", file=sys.stderr)
             print(f"DEBUG: [ALTERNATIVE_SERVER] Has login form: {has_login_form}, Has result item: {has_result_item}, Has cari: {has_cari_nama}", file=sys.stderr)
-            _clear_alternative_server_session()
+            _clear_alternative_server_session(session)
             print(f"INFO: [ALTERNATIVE_SERVER] ✅ Session cleared, retry dengan fresh login", file=sys.stderr)
             return _search_alternative_server(params, username, password, retry_count + 1)
         
+        # The server answered: closes a half-open breaker whose trial ran on a pooled session
+        _breaker_alternative.record_success()
+        
         # If response is HTML but not login page, it's normal (server alternatif always returns HTML)
         if 'text/html' in content_type:
             print(f"INFO: [ALTERNATIVE_SERVER] Response adalah HTML (normal untuk server alternatif), akan parse HTML", file=sys.stderr)
@@ -1565,6 +1798,8 @@ def _search_alternative_server(params: dict, username=None, password=None, retry
         return {"person": person_list}
         
     except Exception as e:
+        if _is_upstream_failure(e):
+            _breaker_alternative.record_failure(e)
         print(f"WARNING: [ALTERNATIVE_SERVER] Exception saat pencarian: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
@@ -1572,42 +1807,268 @@ def _search_alternative_server(params: dict, username=None, password=None, retry
 
 # ---- face utilities (face_recognition) ----
 def load_image_file_to_encoding(path: Path):
-    """Return first face encoding from image file or None."""
+    """Return first face encoding from image file or None (encoded on the face engine pool)."""
     if not USE_FACE_LIB:
         raise RuntimeError("Library face_recognition tidak ditemukan. Install terlebih dahulu.")
-    img = face_recognition.load_image_file(str(path))
-    encs = face_recognition.face_encodings(img)
-    if not encs:
-        return None
-    return encs[0]
+    from face_engine import FAILED, get_face_engine
+    encoding = get_face_engine().encode(Path(path).read_bytes())
+    if encoding is FAILED:
+        raise RuntimeError(f"Gagal menghitung encoding wajah untuk {path}")
+    return encoding
 
-def get_encoding_from_base64_face(base64_str: str):
-    """Decode base64 image (face), save to temp, and return encoding or None."""
-    if not base64_str:
-        return None
-    if not USE_FACE_LIB:
-        raise RuntimeError("Library face_recognition tidak ditemukan. Install terlebih dahulu.")
-    # strip data: prefix bila ada
+# Persistent encoding store (content hash -> encoding, NIK -> hash); FACE_ENCODING_STORE=0 disables it
+_face_store = None
+_face_store_lock = threading.Lock()
+_face_store_disabled = os.environ.get("FACE_ENCODING_STORE", "1") == "0"  # also set when init fails
+
+
+def get_face_encoding_store():
+    """Shared FaceEncodingStore, or None when disabled / numpy unavailable"""
+    global _face_store, _face_store_disabled
+    if _face_store is None and not _face_store_disabled:
+        with _face_store_lock:
+            if _face_store is None and not _face_store_disabled:
+                try:
+                    from face_encoding_store import FaceEncodingStore
+                    store_dir = os.environ.get("FACE_ENCODING_STORE_DIR") or str(
+                        Path(__file__).resolve().parent.parent / "faces" / "encodings")
+                    _face_store = FaceEncodingStore(
+                        store_dir, lru_size=int(os.environ.get("FACE_ENCODING_LRU_SIZE", "4096")))
+                except Exception as e:
+                    print(f"WARNING: [FACE_STORE] Encoding store tidak tersedia: {e}", file=sys.stderr)
+                    _face_store_disabled = True
+    return _face_store
+
+
+def _decode_base64_image(base64_str: str) -> bytes:
     raw = base64_str
     if raw.startswith("data:"):
         raw = raw.split(",", 1)[1]
-    b = safe_b64decode(raw)
-    # write to temp file then load
-    import io
-    import numpy as np
-    from PIL import Image
-    img = Image.open(io.BytesIO(b)).convert("RGB")
-    arr = np.array(img)
-    encs = face_recognition.face_encodings(arr)
-    if not encs:
+    return safe_b64decode(raw)
+
+
+def get_encodings_from_base64_faces(faces, niks=None):
+    """Encodings for a batch of base64 face images, in input order (None = no face).
+    
+    Photos already in the encoding store cost a hash lookup; the rest are
+    encoded together on the face engine process pool. niks (optional, same
+    length as faces) links each photo to its NIK in the store.
+    """
+    if not USE_FACE_LIB:
+        raise RuntimeError("Library face_recognition tidak ditemukan. Install terlebih dahulu.")
+    from face_engine import FAILED, get_face_engine
+    niks = niks or [None] * len(faces)
+    store = get_face_encoding_store()
+    if store is not None:
+        from face_encoding_store import content_digest
+    
+    results = [None] * len(faces)
+    pending = []  # (index, image_bytes, digest) still to be encoded
+    for i, face_b64 in enumerate(faces):
+        if not face_b64:
+            continue
+        try:
+            image_bytes = _decode_base64_image(face_b64)
+        except Exception as e:
+            print(f"Warning: gagal decode face #{i}: {e}", file=sys.stderr)
+            continue
+        digest = None
+        if store is not None:
+            digest = content_digest(image_bytes)
+            found, encoding = store.lookup(digest)
+            if found:
+                results[i] = encoding
+                if niks[i]:
+                    store.link_nik(niks[i], digest)
+                continue
+        pending.append((i, image_bytes, digest))
+    
+    if pending:
+        encodings = get_face_engine().encode_many([image_bytes for _, image_bytes, _ in pending])
+        for (i, _, digest), encoding in zip(pending, encodings):
+            if encoding is FAILED:
+                continue  # timeout/error: not stored, so it is retried next time
+            results[i] = encoding
+            if store is not None:
+                store.store(digest, encoding)
+                if niks[i]:
+                    store.link_nik(niks[i], digest)
+    return results
+
+
+def get_encoding_from_base64_face(base64_str: str, nik=None):
+    """Decode base64 image (face) and return encoding or None.
+    
+    Encodings are looked up by image content hash first; nik (optional) links
+    the photo to that NIK in the store.
+    """
+    if not base64_str:
         return None
-    return encs[0]
+    return get_encodings_from_base64_faces([base64_str], [nik])[0]
+
+
+# Local face-to-NIK index (see face_index.py); FACE_INDEX=0 disables it
+_face_index = None
+_face_index_lock = threading.Lock()
+_face_index_disabled = os.environ.get("FACE_INDEX", "1") == "0"  # also set when init fails
+_face_index_writer = None
+_face_index_build = {'running': False, 'started_at': None, 'finished_at': None,
+                     'scanned': 0, 'added': 0, 'error': None}
+
+
+def get_face_index():
+    """Shared FaceIndex, or None when disabled / numpy unavailable"""
+    global _face_index, _face_index_disabled
+    if _face_index is None and not _face_index_disabled:
+        with _face_index_lock:
+            if _face_index is None and not _face_index_disabled:
+                try:
+                    from face_index import FaceIndex
+                    index_dir = os.environ.get("FACE_INDEX_DIR") or str(
+                        Path(__file__).resolve().parent.parent / "faces" / "index")
+                    _face_index = FaceIndex(
+                        index_dir,
+                        ivf_lists=int(os.environ.get("FACE_INDEX_IVF_LISTS", "0")),
+                        ivf_min_rows=int(os.environ.get("FACE_INDEX_IVF_MIN_ROWS", "50000")),
+                        nprobe=int(os.environ.get("FACE_INDEX_IVF_NPROBE", "8")))
+                except Exception as e:
+                    print(f"WARNING: [FACE_INDEX] Face index tidak tersedia: {e}", file=sys.stderr)
+                    _face_index_disabled = True
+    return _face_index
+
+
+def _index_faces(items):
+    """Encode a batch of (nik, base64 face) pairs and add them to the face index"""
+    index = get_face_index()
+    if index is None or not items or not USE_FACE_LIB:
+        return 0
+    encodings = get_encodings_from_base64_faces([face for _, face in items], [nik for nik, _ in items])
+    return index.add_many((nik, enc) for (nik, _), enc in zip(items, encodings) if enc is not None)
+
+
+def index_face_async(nik, face_b64):
+    """Add a newly saved person's photo to the face index in the background"""
+    global _face_index_writer
+    if not nik or not face_b64 or get_face_index() is None:
+        return
+    if _face_index_writer is None:
+        with _face_index_lock:
+            if _face_index_writer is None:
+                _face_index_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="face-index")
+
+    def _add():
+        try:
+            _index_faces([(str(nik), face_b64)])
+        except Exception as e:
+            print(f"WARNING: [FACE_INDEX] Gagal mengindeks wajah NIK {nik}: {e}", file=sys.stderr)
+    _face_index_writer.submit(_add)
+
+
+def build_face_index(sources):
+    """Index every (nik, base64 face) from sources that is not indexed yet.
+
+    Encodings already in the encoding store are added first without decoding
+    any image. Progress is reported by get_face_index_build_status().
+    """
+    index = get_face_index()
+    if index is None:
+        return 0
+    with _face_index_lock:
+        if _face_index_build['running']:
+            return 0
+        _face_index_build.update(running=True, started_at=time.time(), finished_at=None,
+                                 scanned=0, added=0, error=None)
+    def _count(key, amount=1):
+        # API handlers read the counters through get_face_index_build_status()
+        with _face_index_lock:
+            _face_index_build[key] += amount
+
+    try:
+        store = get_face_encoding_store()
+        if store is not None:
+            for nik, encoding in store.iter_nik_encodings():
+                if not index.has(nik) and index.add(nik, encoding):
+                    _count('added')
+
+        def _missing():
+            for source in sources:
+                for nik, face_b64 in source:
+                    _count('scanned')
+                    if nik and not index.has(nik):
+                        yield str(nik), face_b64
+
+        batch = []
+        for item in _missing():
+            batch.append(item)
+            if len(batch) >= 32:
+                _count('added', _index_faces(batch))
+                batch = []
+        _count('added', _index_faces(batch))
+        status = get_face_index_build_status()
+        print(f"INFO: [FACE_INDEX] Build selesai: {status['added']} wajah baru "
+              f"dari {status['scanned']} foto", file=sys.stderr)
+    except Exception as e:
+        with _face_index_lock:
+            _face_index_build['error'] = str(e)
+        print(f"ERROR: [FACE_INDEX] Build gagal: {e}", file=sys.stderr)
+    finally:
+        with _face_index_lock:
+            _face_index_build.update(running=False, finished_at=time.time())
+            added = _face_index_build['added']
+    return added
+
+
+def get_face_index_build_status():
+    with _face_index_lock:
+        return dict(_face_index_build)
+
+
+def search_face_index(face_b64, top_k=10, threshold=None):
+    """(nik, distance) pairs of the indexed faces nearest to a base64 query image.
+
+    Returns None when the index is unavailable or no face is found in the query.
+    """
+    index = get_face_index()
+    if index is None:
+        return None
+    q_enc = get_encoding_from_base64_face(face_b64)
+    if q_enc is None:
+        return None
+    return index.search(q_enc, top_k=top_k, threshold=threshold)
 
 def face_distance(a, b):
     """wrapper to compute euclidean distance"""
     import numpy as np
     return float(((a - b) ** 2).sum() ** 0.5)
 
+def match_faces(query_encodings, candidate_encodings, threshold=0.5, top_k=None):
+    """Match one or more query faces against a candidate set in one vectorized pass.
+    
+    Candidates are stacked into a float32 matrix and all query/candidate
+    euclidean distances are computed at once. Returns one list per query of
+    (candidate_index, distance) with distance <= threshold, nearest first,
+    cut to top_k if given.
+    """
+    import numpy as np
+    queries = np.asarray(query_encodings, dtype=np.float32).reshape(-1, 128)
+    if len(candidate_encodings) == 0:
+        return [[] for _ in range(len(queries))]
+    candidates = np.asarray(candidate_encodings, dtype=np.float32).reshape(-1, 128)
+    # |q - c|^2 = |q|^2 + |c|^2 - 2 q.c  (one matrix product for all pairs)
+    sq = (np.einsum('ij,ij->i', queries, queries)[:, None]
+          + np.einsum('ij,ij->i', candidates, candidates)[None, :]
+          - 2.0 * queries @ candidates.T)
+    distances = np.sqrt(np.maximum(sq, 0.0))
+    
+    results = []
+    for row in distances:
+        idx = np.flatnonzero(row <= threshold)
+        if top_k is not None and len(idx) > top_k:
+            idx = idx[np.argpartition(row[idx], top_k - 1)[:top_k]]
+        idx = idx[np.argsort(row[idx], kind='stable')]
+        results.append([(int(i), float(row[i])) for i in idx])
+    return results
+
 # --------------------------------------------
 
 def save_face_image(base64_str: str, out_dir: Path, filename_prefix: str = "face"):
@@ -1642,7 +2103,11 @@ def run_face_search_loop(token, params, query_image_path: Path, threshold: float
         sys.exit(2)
 
     print("Menghitung encoding untuk query image:", query_image_path)
-    q_enc = load_image_file_to_encoding(query_image_path)
+    try:
+        q_enc = load_image_file_to_encoding(query_image_path)
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(3)
     if q_enc is None:
         print("Tidak menemukan wajah pada query image.", file=sys.stderr)
         sys.exit(3)
@@ -1655,29 +2120,23 @@ def run_face_search_loop(token, params, query_image_path: Path, threshold: float
         print("Tidak ada person yang dikembalikan oleh API.")
         return
 
-    matches = []
+    candidates = []
     tmp_dir = Path(".") / "tmp_clearance_faces"
     tmp_dir.mkdir(exist_ok=True)
-    for p in people:
-        face_b64 = p.get("face") or ""
-        if not face_b64:
-            continue
-        # get encoding
-        try:
-            enc = get_encoding_from_base64_face(face_b64)
-        except Exception as e:
-            # skip if face lib error
-            print("Warning: gagal decode face untuk", p.get("ktp_number") or p.get("full_name"), "-", e)
-            continue
+    people = [p for p in people if p.get("face")]
+    # encode all candidate faces in one batch (process pool); None = no face detected
+    encodings = get_encodings_from_base64_faces([p["face"] for p in people],
+                                                [p.get("ktp_number") for p in people])
+    for p, enc in zip(people, encodings):
         if enc is None:
-            # no face detected in candidate image
             continue
-        # compute distance (euclidean)
-        import numpy as np
-        dist = np.linalg.norm(np.array(q_enc) - np.array(enc))
-        # lower distance == more similar. face_recognition uses 0.6 threshold commonly.
-        if dist <= threshold:
-            matches.append((dist, p, enc, face_b64))
+        candidates.append((p, enc, p["face"]))
+    # distance (euclidean) for all candidates at once; lower == more similar.
+    # face_recognition uses 0.6 threshold commonly.
+    matches = []
+    for idx, dist in match_faces([q_enc], [c[1] for c in candidates], threshold=threshold)[0]:
+        p, enc, face_b64 = candidates[idx]
+        matches.append((dist, p, enc, face_b64))
     # sort by distance asc
     matches.sort(key=lambda x: x[0])
     if not matches:
@@ -8,71 +8,786 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, List
 import os
 import threading
+import time
+import queue
+import atexit
+from collections import Counter, deque
+from ttl_cache import TTLCache
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within the timeout"""
+    pass
+
+
+class PooledConnection:
+    """Proxy around a raw MySQL connection checked out from ConnectionPool.
+    
+    Behaves like the underlying connection, except that close() returns it to
+    the pool instead of tearing down the TCP session.
+    """
+    
+    def __init__(self, pool, raw_conn, created_at):
+        self._pool = pool
+        self._raw = raw_conn
+        self._created_at = created_at
+    
+    def __getattr__(self, name):
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise AttributeError(f"Connection already returned to pool (accessing '{name}')")
+        return getattr(raw, name)
+    
+    def close(self):
+        """Return connection to the pool (safe to call more than once)"""
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw, self._created_at)
+    
+    def invalidate(self):
+        """Drop the underlying connection instead of returning it to the pool"""
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw, self._created_at, discard=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and isinstance(exc, Error):
+            self.invalidate()
+        else:
+            self.close()
+        return False
+
+
+class ConnectionPool:
+    """Bounded MySQL connection pool with checkout/return semantics.
+    
+    Keeps up to ``pool_size`` idle connections around, allows ``max_overflow``
+    extra connections under burst load (closed again on return), and blocks
+    callers for up to ``timeout`` seconds when everything is checked out.
+    Idle connections are health-checked before reuse and recycled after
+    ``recycle`` seconds.
+    """
+    
+    def __init__(self, connect_kwargs: Dict, pool_size: int = 10, max_overflow: int = 10,
+                 timeout: float = 30, recycle: int = 3600, ping_interval: float = 10):
+        self._connect_kwargs = connect_kwargs
+        self.pool_size = max(1, pool_size)
+        self.max_overflow = max(0, max_overflow)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        
+        self._cond = threading.Condition()
+        self._idle = deque()  # (raw_conn, created_at, returned_at)
+        self._open = 0  # idle + checked out
+        self._in_use = 0
+        
+        # Metrics
+        self._created = 0
+        self._discarded = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._health_check_failures = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+    
+    def checkout(self, force_ping: bool = False) -> PooledConnection:
+        """Check out a healthy connection, creating one if the pool allows it"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        raw = None
+        created_at = None
+        returned_at = None
+        
+        with self._cond:
+            waited = False
+            while True:
+                if self._idle:
+                    # LIFO keeps the warmest connections in use
+                    raw, created_at, returned_at = self._idle.pop()
+                    break
+                if self._open < self.pool_size + self.max_overflow:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.timeout}s "
+                        f"({self._in_use} in use, pool_size={self.pool_size}, max_overflow={self.max_overflow})"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                wait_time = time.monotonic() - started
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+        
+        # Network I/O happens outside the lock
+        try:
+            if raw is not None and not self._is_healthy(raw, created_at, returned_at, force_ping):
+                self._close_raw(raw)
+                with self._cond:
+                    self._discarded += 1
+                raw = None
+            
+            if raw is None:
+                raw = mysql.connector.connect(**self._connect_kwargs)
+                created_at = time.monotonic()
+                with self._cond:
+                    self._created += 1
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        
+        return PooledConnection(self, raw, created_at)
+    
+    def _is_healthy(self, raw, created_at, returned_at, force_ping=False) -> bool:
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            return False
+        if not force_ping and now - returned_at < self.ping_interval:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            with self._cond:
+                self._health_check_failures += 1
+            return False
+    
+    def _release(self, raw, created_at, discard=False):
+        if not discard:
+            try:
+                # A cursor left with unread rows would break the next borrower.
+                # No liveness ping here (is_connected() is a server round trip):
+                # idle connections are checked at checkout by _is_healthy.
+                if getattr(raw, 'unread_result', False):
+                    discard = True
+                elif getattr(raw, 'in_transaction', False):
+                    # Returned mid-transaction (e.g. an exception before commit)
+                    raw.rollback()
+            except Exception:
+                discard = True
+        
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._open > self.pool_size:
+                self._open -= 1
+                self._discarded += 1
+            else:
+                self._idle.append((raw, created_at, time.monotonic()))
+                raw = None
+            self._cond.notify()
+        
+        if raw is not None:
+            self._close_raw(raw)
+    
+    @staticmethod
+    def _close_raw(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+    
+    def dispose(self):
+        """Close all idle connections (checked-out ones are closed on return)"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._discarded += len(idle)
+            self._cond.notify_all()
+        for raw, _, _ in idle:
+            self._close_raw(raw)
+    
+    def stats(self) -> Dict:
+        """Snapshot of pool metrics"""
+        with self._cond:
+            return {
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': self._created,
+                'discarded': self._discarded,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'health_check_failures': self._health_check_failures,
+                'avg_wait_ms': round(self._wait_time_total / self._waits * 1000, 2) if self._waits else 0.0,
+                'max_wait_ms': round(self._wait_time_max * 1000, 2),
+            }
+
+
+class ActivityLogWriter:
+    """Write-behind logger for user_activities.
+    
+    Request threads only enqueue rows, stamped with their created_at at
+    enqueue time; a daemon thread drains the bounded queue and writes them
+    with multi-row INSERTs, so a backlog does not shift timestamps or rollup
+    days. A batch that fails is retried row by row, so only the bad rows are
+    dropped (and logged). While the database is unreachable batches are put
+    back on the queue and retried with backoff. When the queue is full new
+    rows are dropped (and counted) instead of blocking the request. Pending
+    rows are flushed at interpreter shutdown.
+    """
+    
+    INSERT_SQL = '''
+        INSERT INTO user_activities (user_id, activity_type, description, ip_address, user_agent, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    '''
+    ROLLUP_SQL = '''
+        INSERT INTO stats_rollup (metric, bucket_date, dim, user_id, total)
+        VALUES ('activity', DATE(%s), %s, %s, %s)
+        ON DUPLICATE KEY UPDATE total = total + VALUES(total)
+    '''
+    RETRY_BACKOFF_MIN = 1.0  # seconds before retrying after a connection failure
+    RETRY_BACKOFF_MAX = 30.0
+    
+    def __init__(self, get_connection, max_queue: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 1.0):
+        self._get_connection = get_connection
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._backoff = 0.0
+        
+        # Metrics
+        self._stats_lock = threading.Lock()
+        self._enqueued = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+        self._retries = 0
+    
+    def enqueue(self, row: tuple) -> bool:
+        """Queue one (user_id, activity_type, description, ip_address, user_agent) row"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(tuple(row) + (datetime.now(),))
+        except queue.Full:
+            with self._stats_lock:
+                self._dropped += 1
+            return False
+        with self._stats_lock:
+            self._enqueued += 1
+        return True
+    
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if self._backoff:
+                time.sleep(self._backoff)
+    
+    def _insert(self, conn, rows: list):
+        """Insert rows and their rollup counts in one transaction"""
+        cursor = conn.cursor()
+        try:
+            conn.start_transaction()
+            # mysql-connector rewrites executemany INSERTs into one multi-row statement
+            cursor.executemany(self.INSERT_SQL, rows)
+            
+            # Keep the per-day activity rollup in step with the rows just written
+            counts = Counter((row[0], row[1] or '', row[5].date()) for row in rows)
+            cursor.executemany(self.ROLLUP_SQL, [
+                (day, activity_type, user_id, count)
+                for (user_id, activity_type, day), count in counts.items()
+            ])
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cursor.close()
+    
+    def _requeue(self, rows: list, error):
+        """Put rows back after a connection failure and back off; drop only what no longer fits"""
+        self._backoff = min(max(self._backoff * 2, self.RETRY_BACKOFF_MIN), self.RETRY_BACKOFF_MAX)
+        dropped = []
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                dropped.append(row)
+        with self._stats_lock:
+            self._retries += 1
+            self._dropped += len(dropped)
+        print(f"Error writing {len(rows)} activity log rows, retrying in {self._backoff:.0f}s: {error}")
+        for row in dropped:
+            print(f"Dropped activity log row {row!r}: queue full")
+    
+    def _write(self, batch: list):
+        conn = None
+        written = 0
+        pending = list(batch)
+        try:
+            conn = self._get_connection()
+            if not conn:
+                raise mysql.connector.errors.InterfaceError("No database connection")
+            
+            try:
+                self._insert(conn, batch)
+                written = len(batch)
+                pending = []
+            except (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError):
+                raise
+            except Exception as e:
+                if len(batch) == 1:
+                    raise
+                # One bad row (e.g. a user deleted while its rows were queued)
+                # must not take the rest of the batch with it
+                print(f"Error writing {len(batch)} activity log rows, retrying row by row: {e}")
+                for row in batch:
+                    try:
+                        self._insert(conn, [row])
+                        written += 1
+                    except (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError):
+                        raise
+                    except Exception as row_error:
+                        with self._stats_lock:
+                            self._failed += 1
+                        print(f"Dropped activity log row {row!r}: {row_error}")
+                    pending.remove(row)
+            self._backoff = 0.0
+            with self._stats_lock:
+                self._batches += 1
+        except (PoolTimeoutError, mysql.connector.errors.InterfaceError,
+                mysql.connector.errors.OperationalError) as e:
+            # Database unreachable: keep the rows for a later attempt
+            self._requeue(pending, e)
+        except Exception as e:
+            with self._stats_lock:
+                self._failed += len(pending)
+            print(f"Error writing {len(pending)} activity log rows: {e}")
+            for row in pending:
+                print(f"Dropped activity log row {row!r}")
+        finally:
+            with self._stats_lock:
+                self._written += written
+            if conn:
+                conn.close()
+    
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until everything queued so far is written (or timeout)"""
+        if self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline or not self._thread.is_alive():
+                return False
+            time.sleep(0.02)
+        return True
+    
+    def stop(self, timeout: float = 5.0):
+        """Flush pending rows and stop the writer thread"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def stats(self) -> Dict:
+        """Snapshot of writer metrics"""
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'queue_max': self._queue.maxsize,
+                'enqueued': self._enqueued,
+                'written': self._written,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'batches': self._batches,
+                'retries': self._retries,
+            }
+
+
+class ApiKeyRotator:
+    """In-memory rotation over the active rows of api_keys.
+    
+    Active keys are loaded once and re-read every refresh_interval seconds
+    (or right after invalidate()). Picking a key and counting its use happens
+    in memory under a lock; usage counters are written back to api_keys in
+    batches by a daemon thread every flush_interval seconds.
+    """
+    
+    FLUSH_SQL = '''
+        UPDATE api_keys
+        SET usage_count = usage_count + %s,
+            last_used = GREATEST(COALESCE(last_used, %s), %s)
+        WHERE id = %s
+    '''
+    # Used when the key rolled over to a new day since the last flush
+    RESET_SQL = '''
+        UPDATE api_keys SET usage_count = %s, last_used = %s WHERE id = %s
+    '''
+    
+    def __init__(self, get_connection, refresh_interval: float = 60.0, flush_interval: float = 5.0):
+        self._get_connection = get_connection
+        self.refresh_interval = refresh_interval
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._keys = {}     # api_type -> [entry]
+        self._by_key = {}   # api_key -> entry
+        self._loaded_at = None
+        self._pending = {}  # key_id -> {'count', 'last_used', 'reset'}
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stopping = threading.Event()
+        
+        # Metrics
+        self._acquired = 0
+        self._unavailable = 0
+        self._reloads = 0
+        self._flushes = 0
+        self._flush_failures = 0
+    
+    @staticmethod
+    def _rotation_order(entry: Dict) -> tuple:
+        # Same order as before: priority, never used first, least recently used, id
+        last_used = entry['last_used']
+        return (-(entry['priority'] or 0), last_used is not None, last_used or datetime.min, entry['id'])
+    
+    def acquire(self, api_type: str) -> Optional[str]:
+        """Pick the next usable key of api_type and count one use of it"""
+        self._ensure_loaded()
+        self._ensure_started()
+        now = datetime.now()
+        today = now.date()
+        with self._lock:
+            best = None
+            for entry in self._keys.get(api_type, ()):
+                usage = entry['usage_count'] or 0
+                if entry['last_used'] and entry['last_used'].date() < today:
+                    usage = 0  # Daily limit starts over on a new day
+                limit = entry['daily_limit']
+                if limit and limit > 0 and usage >= limit:
+                    continue
+                if best is None or self._rotation_order(entry) < self._rotation_order(best):
+                    best = entry
+            
+            if best is None:
+                self._unavailable += 1
+                return None
+            
+            pending = self._pending.setdefault(best['id'], {'count': 0, 'last_used': now, 'reset': False})
+            if best['last_used'] and best['last_used'].date() < today:
+                best['usage_count'] = 0
+                pending['count'] = 0
+                pending['reset'] = True
+            best['usage_count'] = (best['usage_count'] or 0) + 1
+            best['last_used'] = now
+            pending['count'] += 1
+            pending['last_used'] = now
+            self._acquired += 1
+            return best['api_key']
+    
+    def record_usage(self, api_key: str, count: int = 1) -> bool:
+        """Count extra requests made with a key that was already acquired"""
+        now = datetime.now()
+        with self._lock:
+            entry = self._by_key.get(api_key)
+            if entry is None:
+                return False
+            entry['usage_count'] = (entry['usage_count'] or 0) + count
+            entry['last_used'] = now
+            pending = self._pending.setdefault(entry['id'], {'count': 0, 'last_used': now, 'reset': False})
+            pending['count'] += count
+            pending['last_used'] = now
+            return True
+    
+    def key_id(self, api_key: str) -> Optional[int]:
+        with self._lock:
+            entry = self._by_key.get(api_key)
+            return entry['id'] if entry else None
+    
+    def disable(self, key_id: int):
+        """Stop handing out a key right away (quota exceeded, deleted, ...)"""
+        with self._lock:
+            for api_type, entries in self._keys.items():
+                self._keys[api_type] = [e for e in entries if e['id'] != key_id]
+            self._by_key = {k: e for k, e in self._by_key.items() if e['id'] != key_id}
+    
+    def invalidate(self):
+        """Reload the key set from the database on next use"""
+        with self._lock:
+            self._loaded_at = None
+    
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh_interval:
+            return
+        if not self._reload_lock.acquire(blocking=loaded_at is None):
+            return  # Another thread is reloading; keep using the current set
+        try:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval:
+                self.reload()
+        finally:
+            self._reload_lock.release()
+    
+    def reload(self) -> bool:
+        """Flush pending usage, then re-read the active keys"""
+        self.flush()
+        cursor = None
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                raise Error("No database connection")
+            
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT id, api_key, api_type, usage_count, daily_limit, last_used, priority
+                FROM api_keys
+                WHERE status = 'active'
+            ''')
+            rows = cursor.fetchall()
+            
+            with self._lock:
+                keys = {}
+                by_key = {}
+                for row in rows:
+                    if not row.get('api_key'):
+                        continue
+                    # Uses counted after the flush above are not in the DB yet
+                    pending = self._pending.get(row['id'])
+                    if pending:
+                        base = 0 if pending['reset'] else (row['usage_count'] or 0)
+                        row['usage_count'] = base + pending['count']
+                        row['last_used'] = pending['last_used']
+                    keys.setdefault(row['api_type'], []).append(row)
+                    by_key[row['api_key']] = row
+                self._keys = keys
+                self._by_key = by_key
+                self._loaded_at = time.monotonic()
+                self._reloads += 1
+            return True
+        except Exception as e:
+            print(f"Error loading API keys: {e}")
+            with self._lock:
+                # Keep serving the last known set; retry after the next interval
+                self._loaded_at = time.monotonic()
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+    
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='api-key-flusher', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+    
+    def flush(self) -> bool:
+        """Write counted usage to api_keys"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return True
+            
+            increments = [(p['count'], p['last_used'], p['last_used'], key_id)
+                          for key_id, p in pending.items() if not p['reset']]
+            resets = [(p['count'], p['last_used'], key_id)
+                      for key_id, p in pending.items() if p['reset']]
+            cursor = None
+            conn = None
+            try:
+                conn = self._get_connection()
+                if not conn:
+                    raise Error("No database connection")
+                
+                cursor = conn.cursor()
+                if increments:
+                    cursor.executemany(self.FLUSH_SQL, increments)
+                if resets:
+                    cursor.executemany(self.RESET_SQL, resets)
+                with self._lock:
+                    self._flushes += 1
+                return True
+            except Exception as e:
+                print(f"Error flushing API key usage: {e}")
+                # Put the counts back so they go out with the next flush
+                with self._lock:
+                    self._flush_failures += 1
+                    for key_id, p in pending.items():
+                        current = self._pending.get(key_id)
+                        if current is None:
+                            self._pending[key_id] = p
+                        elif not current['reset']:
+                            current['count'] += p['count']
+                            current['reset'] = p['reset']
+                            current['last_used'] = max(current['last_used'], p['last_used'])
+                return False
+            finally:
+                if cursor:
+                    cursor.close()
+                if conn:
+                    conn.close()
+    
+    def stop(self):
+        """Stop the flusher thread and write what is still pending"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_interval + 1)
+        self.flush()
+    
+    def stats(self) -> Dict:
+        """Snapshot of rotator metrics"""
+        with self._lock:
+            return {
+                'keys': {api_type: len(entries) for api_type, entries in self._keys.items()},
+                'acquired': self._acquired,
+                'unavailable': self._unavailable,
+                'pending_keys': len(self._pending),
+                'reloads': self._reloads,
+                'flushes': self._flushes,
+                'flush_failures': self._flush_failures,
+            }
+
 
 class UserDatabase:
     def __init__(self):
-        # Use thread-local storage for connections (thread-safe)
-        self._local = threading.local()
+        self._pool = ConnectionPool(
+            self._connection_config(),
+            pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+            max_overflow=int(os.getenv('DB_POOL_MAX_OVERFLOW', 10)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+            recycle=int(os.getenv('DB_POOL_RECYCLE', 3600)),
+            ping_interval=float(os.getenv('DB_POOL_PING_INTERVAL', 10))
+        )
         self._init_connection = None  # Only for init_database
+        
+        # Validated sessions, shared by all request threads of this process.
+        # Other processes learn about logouts/user changes via cache_invalidations.
+        self._session_cache = TTLCache(
+            max_size=int(os.getenv('SESSION_CACHE_SIZE', 10000)),
+            ttl=float(os.getenv('SESSION_CACHE_TTL', 60))
+        )
+        self._invalidation_sync_interval = float(os.getenv('SESSION_CACHE_SYNC_INTERVAL', 2))
+        self._invalidation_last_id = None
+        self._invalidation_checked_at = 0.0
+        self._invalidation_cleaned_at = time.monotonic()
+        self._invalidation_lock = threading.Lock()
+        self._invalidation_handlers = {}  # scope -> handler(cache_key) for app-level caches
+        
+        # Activity/audit rows are written in the background, never on the request path
+        self._activity_writer = ActivityLogWriter(
+            self.get_connection,
+            max_queue=int(os.getenv('ACTIVITY_LOG_QUEUE_SIZE', 10000)),
+            batch_size=int(os.getenv('ACTIVITY_LOG_BATCH_SIZE', 200)),
+            flush_interval=float(os.getenv('ACTIVITY_LOG_FLUSH_INTERVAL', 1.0))
+        )
+        atexit.register(self._activity_writer.stop)
+        
+        # API keys are picked from memory; usage is flushed to api_keys in batches
+        self._api_keys = ApiKeyRotator(
+            self.get_connection,
+            refresh_interval=float(os.getenv('API_KEY_REFRESH_INTERVAL', 60)),
+            flush_interval=float(os.getenv('API_KEY_FLUSH_INTERVAL', 5))
+        )
+        atexit.register(self._api_keys.stop)
+        
+        # Dashboard/activity stats are read from stats_rollup and cached briefly
+        self._stats_cache = TTLCache(
+            max_size=256,
+            ttl=float(os.getenv('DASHBOARD_STATS_CACHE_TTL', 15))
+        )
+        
+        # Background backfill of the profiling summary columns (started by the migration)
+        self.profiling_backfill = None
+        
         self.init_database()
     
+    def _connection_config(self) -> Dict:
+        """Connection settings shared by every pooled connection"""
+        return {
+            'host': os.getenv('DB_HOST', 'localhost'),
+            'port': int(os.getenv('DB_PORT', 3306)),
+            'user': os.getenv('DB_USER', 'root'),
+            'password': os.getenv('DB_PASSWORD', ''),
+            'database': os.getenv('DB_NAME', 'clearance_facesearch'),
+            'charset': 'utf8mb4',
+            'collation': 'utf8mb4_unicode_ci',
+            'autocommit': True,
+            'connect_timeout': 30,  # Increased timeout
+            'sql_mode': 'STRICT_TRANS_TABLES,NO_ZERO_IN_DATE,NO_ZERO_DATE,ERROR_FOR_DIVISION_BY_ZERO,NO_AUTO_CREATE_USER,NO_ENGINE_SUBSTITUTION',
+            'use_unicode': True,
+            'raise_on_warnings': False
+        }
+    
     def get_connection(self, force_new=False):
-        """Get MySQL database connection - thread-safe version"""
+        """Check out a MySQL connection from the pool.
+        
+        Callers must call conn.close() when done; that returns the connection
+        to the pool. force_new=True forces a health-check ping before reuse.
+        """
         try:
-            # Get thread-local connection
-            if not force_new and hasattr(self._local, 'connection'):
-                conn = self._local.connection
-                if conn is not None:
-                    try:
-                        # Quick check if connection is still alive
-                        if hasattr(conn, 'is_connected') and conn.is_connected():
-                            return conn
-                        else:
-                            # Connection is dead, close it
-                            try:
-                                conn.close()
-                            except:
-                                pass
-                            self._local.connection = None
-                    except:
-                        # Error checking, assume dead
-                        try:
-                            conn.close()
-                        except:
-                            pass
-                        self._local.connection = None
-            
-            # Create new connection for this thread
-            conn = mysql.connector.connect(
-                host=os.getenv('DB_HOST', 'localhost'),
-                port=int(os.getenv('DB_PORT', 3306)),
-                user=os.getenv('DB_USER', 'root'),
-                password=os.getenv('DB_PASSWORD', ''),
-                database=os.getenv('DB_NAME', 'clearance_facesearch'),
-                charset='utf8mb4',
-                collation='utf8mb4_unicode_ci',
-                autocommit=True,
-                connect_timeout=30,  # Increased timeout
-                sql_mode='STRICT_TRANS_TABLES,NO_ZERO_IN_DATE,NO_ZERO_DATE,ERROR_FOR_DIVISION_BY_ZERO,NO_AUTO_CREATE_USER,NO_ENGINE_SUBSTITUTION',
-                use_unicode=True,
-                raise_on_warnings=False
-            )
-            
-            # Store in thread-local storage
-            self._local.connection = conn
-            return conn
-            
+            return self._pool.checkout(force_ping=force_new)
+        except PoolTimeoutError as e:
+            print(f"Error connecting to MySQL: {e}")
+            return None
         except Error as e:
             print(f"Error connecting to MySQL: {e}")
-            if hasattr(self._local, 'connection'):
-                self._local.connection = None
             return None
         except Exception as e:
             print(f"Unexpected error connecting to MySQL: {e}")
-            if hasattr(self._local, 'connection'):
-                self._local.connection = None
             return None
     
+    def get_pool_stats(self) -> Dict:
+        """Get connection pool metrics"""
+        return self._pool.stats()
+    
     def init_database(self):
         """Initialize the database with required tables"""
         db_name = os.getenv('DB_NAME', 'clearance_facesearch')
@@ -181,9 +896,14 @@ class UserDatabase:
                     INDEX idx_user_id (user_id),
                     INDEX idx_activity_type (activity_type),
                     INDEX idx_created_at (created_at),
+                    INDEX idx_user_type_created (user_id, activity_type, created_at),
+                    INDEX idx_user_created (user_id, created_at),
+                    INDEX idx_type_created (activity_type, created_at),
+                    FULLTEXT INDEX ft_description (description),
                     FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             ''')
+            self._migrate_user_activities_indexes(cursor)
             
             # System settings table
             cursor.execute('''
@@ -321,13 +1041,31 @@ class UserDatabase:
                     search_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     ip_address VARCHAR(45),
                     user_agent TEXT,
+                    nik VARCHAR(32) NULL,
+                    nkk VARCHAR(32) NULL,
+                    full_name VARCHAR(255) NULL,
+                    ttl VARCHAR(255) NULL,
+                    alamat VARCHAR(500) NULL,
+                    thumbnail_url VARCHAR(255) NULL,
+                    has_photo BOOLEAN NOT NULL DEFAULT FALSE,
+                    prov VARCHAR(100) NULL,
+                    kab_kota VARCHAR(100) NULL,
+                    kec VARCHAR(100) NULL,
                     INDEX idx_user_id (user_id),
                     INDEX idx_search_type (search_type),
                     INDEX idx_search_timestamp (search_timestamp),
+                    UNIQUE KEY uniq_nik (nik),
+                    INDEX idx_nkk (nkk),
+                    INDEX idx_full_name (full_name),
+                    INDEX idx_region (prov, kab_kota, kec),
+                    FULLTEXT INDEX ft_name_address (full_name, alamat),
                     FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             ''')
             
+            # Migrate existing profiling_data table - denormalized summary columns
+            self._migrate_profiling_identity_columns(cursor)
+            
             # Telegram users whitelist table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS telegram_users (
@@ -347,6 +1085,19 @@ class UserDatabase:
             ''')
             print("✅ Table 'telegram_users' ready")
             
+            # Cross-process cache invalidation events (see invalidate_session_cache)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS cache_invalidations (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    scope VARCHAR(50) NOT NULL,
+                    cache_key VARCHAR(255) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_created_at (created_at)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            ''')
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM cache_invalidations')
+            self._invalidation_last_id = cursor.fetchone()[0]
+            
             # Cek plat data table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS cek_plat_data (
@@ -382,6 +1133,22 @@ class UserDatabase:
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             ''')
             
+            # Pre-aggregated counters for the dashboard (see STATS_ROLLUP_SOURCES)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_rollup (
+                    metric VARCHAR(20) NOT NULL,
+                    bucket_date DATE NOT NULL,
+                    dim VARCHAR(50) NOT NULL DEFAULT '',
+                    user_id INT NOT NULL DEFAULT 0,
+                    total BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (metric, bucket_date, dim, user_id),
+                    INDEX idx_metric_user (metric, user_id)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            ''')
+            cursor.execute('SELECT COUNT(*) FROM stats_rollup')
+            if cursor.fetchone()[0] == 0:
+                self._rebuild_stats_rollup(cursor)
+            
             # Create default admin user if not exists
             self.create_default_admin()
             
@@ -391,6 +1158,260 @@ class UserDatabase:
             if cursor:
                 cursor.close()
     
+    def _migrate_user_activities_indexes(self, cursor):
+        """Add the composite and FULLTEXT indexes used by the activity log filters"""
+        indexes = [
+            ('idx_user_type_created', 'ADD INDEX idx_user_type_created (user_id, activity_type, created_at)'),
+            ('idx_user_created', 'ADD INDEX idx_user_created (user_id, created_at)'),
+            ('idx_type_created', 'ADD INDEX idx_type_created (activity_type, created_at)'),
+            ('ft_description', 'ADD FULLTEXT INDEX ft_description (description)'),
+        ]
+        for index_name, ddl in indexes:
+            try:
+                cursor.execute('''
+                    SELECT COUNT(*) as idx_count
+                    FROM INFORMATION_SCHEMA.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE()
+                    AND TABLE_NAME = 'user_activities'
+                    AND INDEX_NAME = %s
+                ''', (index_name,))
+                if cursor.fetchone()[0] > 0:
+                    continue
+                
+                cursor.execute(f'ALTER TABLE user_activities {ddl}')
+                print(f"Added index {index_name} to user_activities table")
+            except Error as e:
+                print(f"Error adding index {index_name} to user_activities: {e}")
+    
+    def _migrate_profiling_identity_columns(self, cursor):
+        """Add denormalized identity/summary columns to profiling_data and backfill existing rows"""
+        migrations = [
+            ('nik', '''
+                ALTER TABLE profiling_data
+                ADD COLUMN nik VARCHAR(32) NULL,
+                ADD COLUMN nkk VARCHAR(32) NULL,
+                ADD COLUMN full_name VARCHAR(255) NULL,
+                ADD UNIQUE KEY uniq_nik (nik),
+                ADD INDEX idx_nkk (nkk),
+                ADD INDEX idx_full_name (full_name)
+            '''),
+            ('thumbnail_url', '''
+                ALTER TABLE profiling_data
+                ADD COLUMN ttl VARCHAR(255) NULL,
+                ADD COLUMN alamat VARCHAR(500) NULL,
+                ADD COLUMN thumbnail_url VARCHAR(255) NULL,
+                ADD COLUMN has_photo BOOLEAN NOT NULL DEFAULT FALSE
+            '''),
+            ('prov', '''
+                ALTER TABLE profiling_data
+                ADD COLUMN prov VARCHAR(100) NULL,
+                ADD COLUMN kab_kota VARCHAR(100) NULL,
+                ADD COLUMN kec VARCHAR(100) NULL,
+                ADD INDEX idx_region (prov, kab_kota, kec),
+                ADD FULLTEXT INDEX ft_name_address (full_name, alamat)
+            '''),
+        ]
+        
+        added = False
+        for column, ddl in migrations:
+            try:
+                cursor.execute('''
+                    SELECT COUNT(*) as col_count
+                    FROM INFORMATION_SCHEMA.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE()
+                    AND TABLE_NAME = 'profiling_data'
+                    AND COLUMN_NAME = %s
+                ''', (column,))
+                if cursor.fetchone()[0] > 0:
+                    continue
+                
+                cursor.execute(ddl)
+                added = True
+                print(f"Added summary columns ({column}, ...) to profiling_data table")
+            except Error as e:
+                print(f"Error migrating profiling_data table: {e}")
+                return
+        
+        if added:
+            # Existing rows are filled in the background: on a large table this
+            # takes long and must not hold up start-up. If the process stops
+            # before it finishes, run backfill_profiling_columns.py.
+            self.start_profiling_backfill()
+    
+    def start_profiling_backfill(self, only_missing: bool = True) -> threading.Thread:
+        """Run backfill_profiling_identity_columns on a daemon thread"""
+        if self.profiling_backfill is not None and self.profiling_backfill.is_alive():
+            return self.profiling_backfill
+        
+        def _run():
+            updated = self.backfill_profiling_identity_columns(only_missing=only_missing)
+            print(f"Backfilled summary columns for {updated} profiling_data rows")
+        
+        self.profiling_backfill = threading.Thread(target=_run, name='profiling-backfill', daemon=True)
+        self.profiling_backfill.start()
+        print("Backfill of profiling_data summary columns started in the background")
+        return self.profiling_backfill
+    
+    @staticmethod
+    def _extract_summary_columns(person_data) -> Dict:
+        """Extract the denormalized list-view columns from a person_data dict"""
+        columns = {'nik': None, 'nkk': None, 'full_name': None, 'ttl': None,
+                   'alamat': None, 'thumbnail_url': None, 'has_photo': False,
+                   'prov': None, 'kab_kota': None, 'kec': None}
+        if not isinstance(person_data, dict):
+            return columns
+        
+        def _clean(value, max_len):
+            if value is None:
+                return None
+            value = str(value).strip()
+            return value[:max_len] if value else None
+        
+        columns['nik'] = _clean(person_data.get('ktp_number') or person_data.get('nik'), 32)
+        columns['nkk'] = _clean(person_data.get('family_cert_number') or person_data.get('nkk'), 32)
+        columns['full_name'] = _clean(person_data.get('full_name') or person_data.get('nama') or person_data.get('name'), 255)
+        
+        birth_place = person_data.get('birth_place') or person_data.get('tempat_lahir')
+        birth_date = person_data.get('date_of_birth') or person_data.get('tanggal_lahir')
+        if birth_place or birth_date:
+            columns['ttl'] = _clean(f"{birth_place or 'N/A'}, {birth_date or 'N/A'}", 255)
+        columns['alamat'] = _clean(person_data.get('address') or person_data.get('alamat'), 500)
+        columns['prov'] = _clean(person_data.get('province_name'), 100)
+        columns['kab_kota'] = _clean(person_data.get('regent_name'), 100)
+        columns['kec'] = _clean(person_data.get('district_name'), 100)
+        
+        # Keep only a reference to the photo; the base64 face stays in person_data
+        foto_bersih_url = person_data.get('foto_bersih_url')
+        if isinstance(foto_bersih_url, str) and not foto_bersih_url.startswith('data:'):
+            columns['thumbnail_url'] = _clean(foto_bersih_url, 255)
+        columns['has_photo'] = bool(person_data.get('face') or person_data.get('foto') or columns['thumbnail_url'])
+        return columns
+    
+    SUMMARY_COLUMNS = ('nik', 'nkk', 'full_name', 'ttl', 'alamat', 'thumbnail_url', 'has_photo',
+                       'prov', 'kab_kota', 'kec')
+    
+    def backfill_profiling_identity_columns(self, batch_size: int = 500, only_missing: bool = True) -> int:
+        """Populate the summary columns for rows that only have them inside person_data.
+        
+        Started in the background by init_database when the columns are first
+        added; run backfill_profiling_columns.py after importing an old dump
+        (e.g. profiling_data.sql) or if that run was interrupted. Each batch is
+        written with one multi-row UPDATE in its own transaction.
+        
+        nik is unique (it is the upsert key of save_profiling_data). Rows are
+        processed oldest first, so when the same NIK appears more than once the
+        oldest row keeps it and later duplicates keep nik = NULL: the NIK
+        filter, iter_profiling_faces and get_profiling_identities see one row
+        per NIK, and the duplicates are still found by name/address search.
+        """
+        cursor = None
+        conn = None
+        updated = 0
+        last_id = 0
+        missing_clause = 'AND nik IS NULL' if only_missing else ''
+        try:
+            conn = self.get_connection()
+            if not conn:
+                return 0
+            
+            cursor = conn.cursor(buffered=True)
+            
+            while True:
+                cursor.execute(f'''
+                    SELECT id, person_data FROM profiling_data
+                    WHERE id > %s {missing_clause} AND person_data IS NOT NULL
+                    ORDER BY id ASC
+                    LIMIT %s
+                ''', (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                
+                updates = []
+                for row_id, person_json in rows:
+                    try:
+                        person_data = json.loads(person_json) if person_json else None
+                    except (json.JSONDecodeError, ValueError, TypeError):
+                        continue
+                    columns = self._extract_summary_columns(person_data)
+                    if any(columns.values()):
+                        updates.append((row_id, columns))
+                if not updates:
+                    continue
+                
+                try:
+                    conn.start_transaction()
+                    self._resolve_backfill_niks(cursor, updates)
+                    self._update_summary_columns(cursor, updates)
+                    conn.commit()
+                except Error as e:
+                    conn.rollback()
+                    if e.errno != 1062:
+                        raise
+                    # A save claimed one of the NIKs meanwhile: write this batch row by row
+                    conn.start_transaction()
+                    for update in updates:
+                        try:
+                            self._update_summary_columns(cursor, [update])
+                        except Error as row_error:
+                            if row_error.errno != 1062:
+                                raise
+                            update[1]['nik'] = None
+                            self._update_summary_columns(cursor, [update])
+                    conn.commit()
+                updated += len(updates)
+            
+            return updated
+        except Error as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Error:
+                    pass
+            print(f"Error backfilling profiling summary columns: {e}")
+            return updated
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+    
+    @staticmethod
+    def _resolve_backfill_niks(cursor, updates: list):
+        """Clear the NIK of updates whose NIK an older row (or an earlier update) already holds"""
+        niks = list({columns['nik'] for _, columns in updates if columns['nik']})
+        if not niks:
+            return
+        cursor.execute(f'''
+            SELECT nik, id FROM profiling_data WHERE nik IN ({', '.join(['%s'] * len(niks))})
+        ''', niks)
+        claimed = dict(cursor.fetchall())
+        for row_id, columns in updates:
+            nik = columns['nik']
+            if not nik:
+                continue
+            if claimed.get(nik, row_id) != row_id:
+                columns['nik'] = None
+            else:
+                claimed[nik] = row_id
+    
+    def _update_summary_columns(self, cursor, updates: list):
+        """Set the summary columns of several rows with one UPDATE ... JOIN"""
+        first = 'SELECT %s AS id, ' + ', '.join(f'%s AS {name}' for name in self.SUMMARY_COLUMNS)
+        rest = 'SELECT ' + ', '.join(['%s'] * (len(self.SUMMARY_COLUMNS) + 1))
+        values_sql = ' UNION ALL '.join([first] + [rest] * (len(updates) - 1))
+        params = []
+        for row_id, columns in updates:
+            params.append(row_id)
+            params.extend(columns[name] for name in self.SUMMARY_COLUMNS)
+        assignments = ', '.join(f'pd.{name} = v.{name}' for name in self.SUMMARY_COLUMNS)
+        cursor.execute(f'''
+            UPDATE profiling_data pd
+            JOIN ({values_sql}) v ON pd.id = v.id
+            SET {assignments}
+        ''', params)
+    
     def create_default_admin(self):
         """Create default admin user if no users exist"""
         if not self.user_exists('admin'):
@@ -420,6 +1441,8 @@ class UserDatabase:
     def create_user(self, username: str, email: str, password: str, 
                    full_name: str, role: str = 'user', status: str = 'active') -> bool:
         """Create a new user"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -442,10 +1465,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
         """Authenticate user and return user data if successful"""
         cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -507,10 +1533,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def create_session(self, user_id: int, ip_address: str = None, user_agent: str = None) -> str:
         """Create a new session for user"""
         cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -532,10 +1561,21 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def validate_session(self, session_token: str) -> Optional[Dict]:
-        """Validate session token and return user data"""
+        """Validate session token and return user data (cached per process)"""
+        if not session_token:
+            return None
+        
+        self._sync_session_invalidations()
+        cached = self._session_cache.get(session_token)
+        if cached is not None:
+            return dict(cached)
+        
         cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -560,7 +1600,7 @@ class UserDatabase:
             if status != 'active':
                 return None
             
-            return {
+            user = {
                 'id': user_id,
                 'username': username,
                 'email': email,
@@ -568,15 +1608,160 @@ class UserDatabase:
                 'role': role,
                 'status': status
             }
+            
+            # Never cache past the session's own expiry
+            ttl = self._session_cache.ttl
+            if isinstance(expires_at, datetime):
+                ttl = min(ttl, (expires_at - datetime.now()).total_seconds())
+            self._session_cache.set(session_token, user, ttl=ttl)
+            
+            return dict(user)
         except Error as e:
             print(f"Error validating session: {e}")
             return None
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+    
+    def invalidate_session_cache(self, session_token: str = None, user_id: int = None,
+                                 publish: bool = True):
+        """Drop cached sessions by token or by user, locally and (publish=True) in other workers.
+        
+        Publishing borrows a pooled connection: call it after releasing your own.
+        """
+        if session_token:
+            self._session_cache.delete(session_token)
+        if user_id is not None:
+            self._session_cache.delete_where(lambda token, user: user.get('id') == user_id)
+        
+        if not publish:
+            return
+        
+        cursor = None
+        conn = None
+        try:
+            conn = self.get_connection()
+            if not conn:
+                return
+            
+            cursor = conn.cursor()
+            if session_token:
+                cursor.execute('''
+                    INSERT INTO cache_invalidations (scope, cache_key) VALUES ('session', %s)
+                ''', (session_token,))
+            if user_id is not None:
+                cursor.execute('''
+                    INSERT INTO cache_invalidations (scope, cache_key) VALUES ('user', %s)
+                ''', (str(user_id),))
+        except Error as e:
+            print(f"Error publishing session cache invalidation: {e}")
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+    
+    def _sync_session_invalidations(self):
+        """Apply invalidations published by other workers (polled at most every few seconds)"""
+        now = time.monotonic()
+        if now - self._invalidation_checked_at < self._invalidation_sync_interval:
+            return
+        if not self._invalidation_lock.acquire(blocking=False):
+            return  # Another thread is already syncing
+        
+        cursor = None
+        conn = None
+        try:
+            self._invalidation_checked_at = now
+            conn = self.get_connection()
+            if not conn:
+                return
+            
+            cursor = conn.cursor()
+            if self._invalidation_last_id is None:
+                # Fresh process: nothing cached yet, start from the current tail
+                cursor.execute('SELECT COALESCE(MAX(id), 0) FROM cache_invalidations')
+                self._invalidation_last_id = cursor.fetchone()[0]
+                return
+            
+            cursor.execute('''
+                SELECT id, scope, cache_key FROM cache_invalidations
+                WHERE id > %s ORDER BY id ASC
+            ''', (self._invalidation_last_id,))
+            rows = cursor.fetchall()
+            
+            for event_id, scope, cache_key in rows:
+                if scope == 'session':
+                    self._session_cache.delete(cache_key)
+                elif scope == 'user':
+                    self.invalidate_session_cache(user_id=int(cache_key), publish=False)
+                elif scope == 'api_keys':
+                    self._api_keys.invalidate()
+                elif scope in self._invalidation_handlers:
+                    try:
+                        self._invalidation_handlers[scope](cache_key)
+                    except Exception as e:
+                        print(f"Error applying {scope} cache invalidation: {e}")
+                self._invalidation_last_id = event_id
+            
+            # Housekeeping: events only matter for as long as a cache entry can live
+            if now - self._invalidation_cleaned_at > 3600:
+                self._invalidation_cleaned_at = now
+                cursor.execute('''
+                    DELETE FROM cache_invalidations WHERE created_at < DATE_SUB(NOW(), INTERVAL 1 DAY)
+                ''')
+        except Error as e:
+            print(f"Error syncing session cache invalidations: {e}")
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+            self._invalidation_lock.release()
+    
+    def register_cache_invalidation_handler(self, scope: str, handler):
+        """Apply invalidations of scope published by other processes with handler(cache_key)"""
+        self._invalidation_handlers[scope] = handler
+    
+    def sync_cache_invalidations(self):
+        """Poll for invalidations from other processes (rate-limited, see SESSION_CACHE_SYNC_INTERVAL)"""
+        self._sync_session_invalidations()
+    
+    def publish_cache_invalidation(self, scope: str, cache_key: str):
+        """Tell other processes to drop cached state of a registered scope"""
+        self._publish_cache_invalidation(scope, cache_key)
+    
+    def _publish_cache_invalidation(self, scope: str, cache_key: str):
+        """Tell other workers to drop cached state for scope/cache_key"""
+        cursor = None
+        conn = None
+        try:
+            conn = self.get_connection()
+            if not conn:
+                return
+            
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO cache_invalidations (scope, cache_key) VALUES (%s, %s)
+            ''', (scope, cache_key))
+        except Error as e:
+            print(f"Error publishing cache invalidation: {e}")
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+    
+    def get_session_cache_stats(self) -> Dict:
+        """Get session cache metrics"""
+        return self._session_cache.stats()
     
     def logout_session(self, session_token: str) -> bool:
         """Logout user by deactivating session"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -587,17 +1772,22 @@ class UserDatabase:
             cursor.execute('''
                 UPDATE sessions SET is_active = 0 WHERE session_token = %s
             ''', (session_token,))
-            
-            return True
         except Error as e:
             print(f"Error logging out session: {e}")
             return False
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+        
+        self.invalidate_session_cache(session_token=session_token)
+        return True
     
     def get_all_users(self) -> List[Dict]:
         """Get all users"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -630,9 +1820,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def update_user(self, user_id: int, **kwargs) -> bool:
         """Update user information"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -657,23 +1851,33 @@ class UserDatabase:
             
             query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
             cursor.execute(query, values)
-            
-            return True
         except Error as e:
             print(f"Error updating user: {e}")
             return False
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+        
+        # Cached sessions carry username/role/status
+        self.invalidate_session_cache(user_id=user_id)
+        return True
     
     def delete_user(self, user_id: int, soft_delete: bool = False) -> bool:
-        """Delete user (hard delete by default, or soft delete if specified)"""
+        """Delete user (hard delete by default, or soft delete if specified).
+        
+        The stats_rollup decrement and the DELETEs commit together.
+        """
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
                 return False
             
             cursor = conn.cursor()
+            conn.start_transaction()
             
             if soft_delete:
                 # Soft delete: set status to inactive
@@ -688,6 +1892,13 @@ class UserDatabase:
                 ''', (user_id,))
             else:
                 # Hard delete: completely remove from database
+                # Profiling/cek plat rows go with the user (ON DELETE CASCADE)
+                self._apply_stats_rollup(cursor, 'profiling', 'user_id = %s', (user_id,), sign=-1)
+                self._apply_stats_rollup(cursor, 'cek_plat', 'user_id = %s', (user_id,), sign=-1)
+                cursor.execute('''
+                    DELETE FROM stats_rollup WHERE metric = 'activity' AND user_id = %s
+                ''', (user_id,))
+                
                 # First delete related records
                 cursor.execute('DELETE FROM user_activities WHERE user_id = %s', (user_id,))
                 cursor.execute('DELETE FROM sessions WHERE user_id = %s', (user_id,))
@@ -696,37 +1907,40 @@ class UserDatabase:
                 cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
             
             conn.commit()
-            return True
         except Error as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Error:
+                    pass
             print(f"Error deleting user: {e}")
             return False
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+        
+        self.invalidate_session_cache(user_id=user_id)
+        return True
     
     def log_activity(self, user_id: int, activity_type: str, description: str, 
                     ip_address: str = None, user_agent: str = None):
-        """Log user activity"""
-        try:
-            conn = self.get_connection()
-            if not conn:
-                return
-            
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO user_activities (user_id, activity_type, description, ip_address, user_agent)
-                VALUES (%s, %s, %s, %s, %s)
-            ''', (user_id, activity_type, description, ip_address, user_agent))
-            
-        except Error as e:
-            print(f"Error logging activity: {e}")
-        finally:
-            if cursor:
-                cursor.close()
+        """Log user activity (queued, written in batches by the background writer)"""
+        self._activity_writer.enqueue((user_id, activity_type, description, ip_address, user_agent))
+    
+    def flush_activity_log(self, timeout: float = 5.0) -> bool:
+        """Wait until queued activity rows are written"""
+        return self._activity_writer.flush(timeout)
+    
+    def get_activity_log_stats(self) -> Dict:
+        """Get background activity writer metrics"""
+        return self._activity_writer.stats()
     
     def get_user_activities(self, user_id: int = None, limit: int = 100) -> List[Dict]:
         """Get user activities"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -776,9 +1990,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def user_exists(self, username: str) -> bool:
         """Check if user exists"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -801,6 +2019,8 @@ class UserDatabase:
     
     def get_user_by_username(self, username: str) -> Optional[Dict]:
         """Get user by username"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -823,34 +2043,61 @@ class UserDatabase:
     def save_profiling_data(self, user_id: int, search_type: str, search_params: dict, 
                            search_results: dict, person_data: dict = None, family_data: dict = None,
                            phone_data: dict = None, face_data: dict = None, 
-                           ip_address: str = None, user_agent: str = None) -> bool:
-        """Save profiling search data to database"""
+                           ip_address: str = None, user_agent: str = None,
+                           upsert: bool = False) -> bool:
+        """Save profiling search data to database.
+        
+        Duplicate NIKs are rejected by the unique index on profiling_data.nik.
+        With upsert=True the existing row for that NIK is refreshed instead
+        (it keeps its owner). The row and its stats_rollup counts change in
+        one transaction.
+        """
+        cursor = None
+        conn = None
+        columns = self._extract_summary_columns(person_data)
+        nik = columns['nik']
         try:
             conn = self.get_connection()
             if not conn:
                 return False
             
             cursor = conn.cursor()
+            conn.start_transaction()
             
-            # Check if NIK already exists in person_data
-            if person_data and person_data.get('ktp_number'):
-                nik = person_data.get('ktp_number')
-                cursor.execute('''
-                    SELECT COUNT(*) FROM profiling_data 
-                    WHERE person_data LIKE %s
-                ''', (f'%"ktp_number": "{nik}"%',))
-                
-                existing_count = cursor.fetchone()[0]
-                if existing_count > 0:
-                    print(f"Data with NIK {nik} already exists. Skipping save.")
-                    return False
-            
-            cursor.execute('''
+            query = '''
                 INSERT INTO profiling_data 
                 (user_id, search_type, search_params, search_results, person_data, 
-                 family_data, phone_data, face_data, ip_address, user_agent)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (
+                 family_data, phone_data, face_data, ip_address, user_agent,
+                 nik, nkk, full_name, ttl, alamat, thumbnail_url, has_photo, prov, kab_kota, kec)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            '''
+            if upsert and nik:
+                query += '''
+                ON DUPLICATE KEY UPDATE
+                    search_type = VALUES(search_type),
+                    search_params = VALUES(search_params),
+                    search_results = VALUES(search_results),
+                    person_data = VALUES(person_data),
+                    family_data = COALESCE(VALUES(family_data), family_data),
+                    phone_data = COALESCE(VALUES(phone_data), phone_data),
+                    face_data = COALESCE(VALUES(face_data), face_data),
+                    nkk = COALESCE(VALUES(nkk), nkk),
+                    full_name = COALESCE(VALUES(full_name), full_name),
+                    ttl = COALESCE(VALUES(ttl), ttl),
+                    alamat = COALESCE(VALUES(alamat), alamat),
+                    thumbnail_url = COALESCE(VALUES(thumbnail_url), thumbnail_url),
+                    has_photo = VALUES(has_photo) OR has_photo,
+                    prov = COALESCE(VALUES(prov), prov),
+                    kab_kota = COALESCE(VALUES(kab_kota), kab_kota),
+                    kec = COALESCE(VALUES(kec), kec),
+                    search_timestamp = CURRENT_TIMESTAMP,
+                    ip_address = VALUES(ip_address),
+                    user_agent = VALUES(user_agent)
+                '''
+                # The row may move to another day/search_type bucket
+                self._apply_stats_rollup(cursor, 'profiling', 'nik = %s', (nik,), sign=-1)
+            
+            cursor.execute(query, (
                 user_id, search_type, 
                 json.dumps(search_params) if search_params else None,
                 json.dumps(search_results) if search_results else None,
@@ -858,12 +2105,28 @@ class UserDatabase:
                 json.dumps(family_data) if family_data else None,
                 json.dumps(phone_data) if phone_data else None,
                 json.dumps(face_data) if face_data else None,
-                ip_address, user_agent
+                ip_address, user_agent,
+                nik, columns['nkk'], columns['full_name'], columns['ttl'], columns['alamat'],
+                columns['thumbnail_url'], columns['has_photo'],
+                columns['prov'], columns['kab_kota'], columns['kec']
             ))
             
+            if upsert and nik:
+                self._apply_stats_rollup(cursor, 'profiling', 'nik = %s', (nik,))
+            else:
+                self._apply_stats_rollup(cursor, 'profiling', 'id = %s', (cursor.lastrowid,))
+            
             conn.commit()
             return True
         except Error as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Error:
+                    pass
+            if e.errno == 1062:  # Duplicate NIK
+                print(f"Data with NIK {nik} already exists. Skipping save.")
+                return False
             print(f"Error saving profiling data: {e}")
             return False
         finally:
@@ -872,124 +2135,270 @@ class UserDatabase:
             if conn:
                 conn.close()
 
+    # Shown by the report list for rows without a region (see _profiling_filter_conditions)
+    PROFILING_REGION_DEFAULTS = {'prov': 'Jambi', 'kab_kota': 'Jambi'}
+    # Must match the server's innodb_ft_min_token_size
+    PROFILING_FT_MIN_TOKEN_SIZE = int(os.getenv('PROFILING_FT_MIN_TOKEN_SIZE', 3))
+    
+    PROFILING_JSON_FIELDS = ['search_params', 'search_results', 'person_data',
+                             'family_data', 'phone_data', 'face_data']
+    
+    # List-view projection: no JSON blobs, no base64 photos
+    PROFILING_SUMMARY_COLUMNS = '''pd.id, pd.user_id, pd.search_type, pd.search_timestamp,
+                pd.nik, pd.nkk, pd.full_name, pd.ttl, pd.alamat, pd.thumbnail_url, pd.has_photo,
+                pd.prov, pd.kab_kota, pd.kec'''
+    
+    def _parse_profiling_json_fields(self, result: Dict) -> Dict:
+        """Parse JSON text columns of a profiling_data row in place"""
+        for field in self.PROFILING_JSON_FIELDS:
+            # Check if field exists in result
+            if field not in result:
+                result[field] = None
+                continue
+            
+            field_value = result[field]
+            
+            # If already parsed (dict/list), keep it
+            if isinstance(field_value, (dict, list)):
+                continue
+            
+            # If None or empty, set to None
+            if field_value is None:
+                result[field] = None
+                continue
+            
+            # If it's a string, try to parse as JSON
+            if isinstance(field_value, str):
+                field_value = field_value.strip()
+                if not field_value or field_value == 'NULL' or field_value.lower() == 'null':
+                    result[field] = None
+                else:
+                    try:
+                        parsed = json.loads(field_value)
+                        result[field] = parsed if parsed is not None else None
+                    except (json.JSONDecodeError, ValueError) as e:
+                        # If parsing fails, try to fix common issues
+                        error_msg = str(e)
+                        
+                        # Handle unterminated strings (common issue with large base64 data)
+                        if 'Unterminated string' in error_msg or 'char' in error_msg:
+                            # Try to truncate and parse what we can, or set to None
+                            # For search_results, we might want to keep partial data
+                            if field == 'search_results':
+                                # Try to extract what we can before the error
+                                try:
+                                    # Find the position of error
+                                    if 'char' in error_msg:
+                                        # Extract position from error message
+                                        match = re.search(r'char (\d+)', error_msg)
+                                        if match:
+                                            error_pos = int(match.group(1))
+                                            # Try to parse up to error position (with some buffer)
+                                            truncated = field_value[:error_pos-100] + '"}'
+                                            parsed = json.loads(truncated)
+                                            result[field] = parsed
+                                        else:
+                                            result[field] = None
+                                    else:
+                                        result[field] = None
+                                except:
+                                    result[field] = None
+                            else:
+                                result[field] = None
+                        else:
+                            # For other JSON errors, set to None
+                            result[field] = None
+                        
+                        # Only log if it's not a common unterminated string issue
+                        if 'Unterminated string' not in error_msg:
+                            print(f"Warning: Failed to parse {field} as JSON: {e}")
+            else:
+                # For other types, keep as is or set to None
+                result[field] = field_value if field_value is not None else None
+        
+        return result
+    
+    @staticmethod
+    def encode_profiling_cursor(row: Dict) -> Optional[str]:
+        """Build a keyset cursor ("search_timestamp,id") from the last row of a page"""
+        if not row or row.get('search_timestamp') is None or row.get('id') is None:
+            return None
+        ts = row['search_timestamp']
+        ts_str = ts.strftime('%Y-%m-%dT%H:%M:%S') if hasattr(ts, 'strftime') else str(ts)
+        return f"{ts_str},{row['id']}"
+    
+    @staticmethod
+    def decode_profiling_cursor(cursor_value: str) -> Optional[tuple]:
+        """Parse a keyset cursor into (search_timestamp, id); None if malformed"""
+        try:
+            ts_str, row_id = cursor_value.rsplit(',', 1)
+            return datetime.fromisoformat(ts_str.strip().replace(' ', 'T')), int(row_id)
+        except (AttributeError, ValueError):
+            return None
+    
+    @staticmethod
+    def _profiling_filter_conditions(user_id: int = None, search_type: str = None, query: str = None,
+                                     prov: str = None, kab_kota: str = None, kec: str = None,
+                                     start_date: str = None, end_date: str = None) -> tuple:
+        """Build WHERE conditions shared by the profiling list and count queries.
+        
+        Region equality runs on idx_region, a half-open search_timestamp range,
+        NIK prefix on uniq_nik and free-text words through the ft_name_address
+        FULLTEXT index (word-prefix match). Words shorter than the FULLTEXT
+        minimum token size would match nothing there, so they fall back to a
+        substring LIKE on name/address. A region filter equal to the list's
+        display default ('Jambi') also matches rows without a region.
+        """
+        conditions = []
+        params = []
+        
+        if user_id:
+            conditions.append('pd.user_id = %s')
+            params.append(user_id)
+        
+        if search_type:
+            conditions.append('pd.search_type = %s')
+            params.append(search_type)
+        
+        for column, value in (('prov', prov), ('kab_kota', kab_kota), ('kec', kec)):
+            if value:
+                value = value.strip()
+                default = UserDatabase.PROFILING_REGION_DEFAULTS.get(column)
+                if default and value.lower() == default.lower():
+                    # The report list shows NULL regions as the default
+                    conditions.append(f'(pd.{column} = %s OR pd.{column} IS NULL)')
+                else:
+                    conditions.append(f'pd.{column} = %s')
+                params.append(value)
+        
+        # Half-open range on the raw column keeps idx_search_timestamp usable
+        for value, operator, shift in ((start_date, '>=', 0), (end_date, '<', 1)):
+            if not value:
+                continue
+            try:
+                bound = datetime.strptime(value[:10], '%Y-%m-%d') + timedelta(days=shift)
+            except ValueError:
+                print(f"Ignoring invalid profiling date filter: {value}")
+                continue
+            conditions.append(f'pd.search_timestamp {operator} %s')
+            params.append(bound)
+        
+        if query and query.strip():
+            query = query.strip()
+            if query.isdigit():
+                conditions.append('pd.nik LIKE %s')
+                params.append(f'{query}%')
+            else:
+                # Boolean mode: every word must match, as a prefix
+                terms = [t for t in re.sub(r'[+\-<>()~*"@]+', ' ', query).split() if t]
+                min_token = UserDatabase.PROFILING_FT_MIN_TOKEN_SIZE
+                long_terms = [t for t in terms if len(t) >= min_token]
+                if long_terms:
+                    conditions.append('MATCH(pd.full_name, pd.alamat) AGAINST (%s IN BOOLEAN MODE)')
+                    params.append(' '.join(f'+{t}*' for t in long_terms))
+                for term in terms:
+                    if len(term) < min_token:
+                        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                        conditions.append('(pd.full_name LIKE %s OR pd.alamat LIKE %s)')
+                        params.extend([pattern, pattern])
+        
+        return conditions, params
+    
     def get_profiling_data(self, user_id: int = None, search_type: str = None, 
-                          limit: int = 100, offset: int = 0) -> list:
-        """Get profiling data with optional filters"""
+                          limit: int = 100, offset: int = 0, cursor: str = None,
+                          summary: bool = False, **filters) -> list:
+        """Get profiling data with optional filters, newest first.
+        
+        Pass the cursor from encode_profiling_cursor(last_row) to fetch the
+        next page by keyset (search_timestamp, id) instead of OFFSET, so deep
+        pages cost the same as the first one.
+        
+        With summary=True only the denormalized list columns are selected and
+        no JSON blobs are loaded; use get_profiling_data_by_id for details.
+        Extra filters (query, prov, kab_kota, kec, start_date, end_date) are
+        applied in SQL, see _profiling_filter_conditions.
+        """
+        db_cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
                 return []
             
-            cursor = conn.cursor(dictionary=True)
+            db_cursor = conn.cursor(dictionary=True)
             
             # Build query with optional filters
-            query = '''
-                SELECT pd.*, u.username, u.full_name as user_name
+            columns = self.PROFILING_SUMMARY_COLUMNS if summary else 'pd.*'
+            query = f'''
+                SELECT {columns}, u.username, u.full_name as user_name
                 FROM profiling_data pd
                 JOIN users u ON pd.user_id = u.id
             '''
-            conditions = []
-            params = []
-            
-            if user_id:
-                conditions.append('pd.user_id = %s')
-                params.append(user_id)
+            conditions, params = self._profiling_filter_conditions(user_id, search_type, **filters)
             
-            if search_type:
-                conditions.append('pd.search_type = %s')
-                params.append(search_type)
+            keyset = self.decode_profiling_cursor(cursor) if cursor else None
+            if keyset:
+                conditions.append('(pd.search_timestamp < %s OR (pd.search_timestamp = %s AND pd.id < %s))')
+                params.extend([keyset[0], keyset[0], keyset[1]])
             
             if conditions:
                 query += ' WHERE ' + ' AND '.join(conditions)
             
-            query += ' ORDER BY pd.search_timestamp DESC LIMIT %s OFFSET %s'
-            params.extend([limit, offset])
+            query += ' ORDER BY pd.search_timestamp DESC, pd.id DESC LIMIT %s'
+            params.append(limit)
+            if not keyset:
+                query += ' OFFSET %s'
+                params.append(offset)
             
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+            db_cursor.execute(query, params)
+            results = db_cursor.fetchall()
             
-            # Parse JSON fields - ensure ALL fields are properly parsed
-            for result in results:
-                for field in ['search_params', 'search_results', 'person_data', 
-                             'family_data', 'phone_data', 'face_data']:
-                    # Check if field exists in result
-                    if field not in result:
-                        result[field] = None
-                        continue
-                    
-                    field_value = result[field]
-                    
-                    # If already parsed (dict/list), keep it
-                    if isinstance(field_value, (dict, list)):
-                        continue
-                    
-                    # If None or empty, set to None
-                    if field_value is None:
-                        result[field] = None
-                        continue
-                    
-                    # If it's a string, try to parse as JSON
-                    if isinstance(field_value, str):
-                        field_value = field_value.strip()
-                        if not field_value or field_value == 'NULL' or field_value.lower() == 'null':
-                            result[field] = None
-                        else:
-                            try:
-                                parsed = json.loads(field_value)
-                                result[field] = parsed if parsed is not None else None
-                            except (json.JSONDecodeError, ValueError) as e:
-                                # If parsing fails, try to fix common issues
-                                error_msg = str(e)
-                                
-                                # Handle unterminated strings (common issue with large base64 data)
-                                if 'Unterminated string' in error_msg or 'char' in error_msg:
-                                    # Try to truncate and parse what we can, or set to None
-                                    # For search_results, we might want to keep partial data
-                                    if field == 'search_results':
-                                        # Try to extract what we can before the error
-                                        try:
-                                            # Find the position of error
-                                            if 'char' in error_msg:
-                                                # Extract position from error message
-                                                import re
-                                                match = re.search(r'char (\d+)', error_msg)
-                                                if match:
-                                                    error_pos = int(match.group(1))
-                                                    # Try to parse up to error position (with some buffer)
-                                                    truncated = field_value[:error_pos-100] + '"}'
-                                                    parsed = json.loads(truncated)
-                                                    result[field] = parsed
-                                                else:
-                                                    result[field] = None
-                                            else:
-                                                result[field] = None
-                                        except:
-                                            result[field] = None
-                                    else:
-                                        result[field] = None
-                                else:
-                                    # For other JSON errors, set to None
-                                    result[field] = None
-                                
-                                # Only log if it's not a common unterminated string issue
-                                if 'Unterminated string' not in error_msg:
-                                    print(f"Warning: Failed to parse {field} as JSON: {e}")
-                    else:
-                        # For other types, keep as is or set to None
-                        result[field] = field_value if field_value is not None else None
+            if not summary:
+                for result in results:
+                    self._parse_profiling_json_fields(result)
             
             return results
         except Error as e:
             print(f"Error getting profiling data: {e}")
             return []
+        finally:
+            if db_cursor:
+                db_cursor.close()
+            if conn:
+                conn.close()
+
+    def get_profiling_data_by_id(self, profiling_id: int) -> Optional[Dict]:
+        """Get a single profiling data row by primary key"""
+        cursor = None
+        conn = None
+        try:
+            conn = self.get_connection()
+            if not conn:
+                return None
+            
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT pd.*, u.username, u.full_name as user_name
+                FROM profiling_data pd
+                JOIN users u ON pd.user_id = u.id
+                WHERE pd.id = %s
+            ''', (profiling_id,))
+            result = cursor.fetchone()
+            
+            return self._parse_profiling_json_fields(result) if result else None
+        except Error as e:
+            print(f"Error getting profiling data by id: {e}")
+            return None
         finally:
             if cursor:
                 cursor.close()
             if conn:
                 conn.close()
 
-    def get_profiling_data_count(self, user_id: int = None, search_type: str = None) -> int:
-        """Get count of profiling data with optional filters"""
+    def get_profiling_data_count(self, user_id: int = None, search_type: str = None, **filters) -> int:
+        """Get count of profiling data with the same filters as get_profiling_data"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -998,16 +2407,7 @@ class UserDatabase:
             cursor = conn.cursor()
             
             query = 'SELECT COUNT(*) FROM profiling_data pd'
-            conditions = []
-            params = []
-            
-            if user_id:
-                conditions.append('pd.user_id = %s')
-                params.append(user_id)
-            
-            if search_type:
-                conditions.append('pd.search_type = %s')
-                params.append(search_type)
+            conditions, params = self._profiling_filter_conditions(user_id, search_type, **filters)
             
             if conditions:
                 query += ' WHERE ' + ' AND '.join(conditions)
@@ -1025,8 +2425,80 @@ class UserDatabase:
             if conn:
                 conn.close()
 
+    def iter_profiling_faces(self, batch_size: int = 100):
+        """Yield (nik, base64 face) for every profiling row with a NIK and a photo.
+
+        Rows are read by id in batches; the connection is released between
+        batches, so the caller may do slow work (face encoding) per item.
+        """
+        last_id = 0
+        while True:
+            cursor = None
+            conn = None
+            try:
+                conn = self.get_connection()
+                if not conn:
+                    return
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, nik, person_data FROM profiling_data
+                    WHERE id > %s AND nik IS NOT NULL AND has_photo = 1
+                    ORDER BY id ASC
+                    LIMIT %s
+                ''', (last_id, batch_size))
+                rows = cursor.fetchall()
+            except Error as e:
+                print(f"Error reading profiling faces: {e}")
+                return
+            finally:
+                if cursor:
+                    cursor.close()
+                if conn:
+                    conn.close()
+            if not rows:
+                return
+
+            for row_id, nik, person_json in rows:
+                last_id = row_id
+                try:
+                    person_data = json.loads(person_json) if person_json else {}
+                except (json.JSONDecodeError, ValueError, TypeError):
+                    continue
+                face = person_data.get('face') or person_data.get('foto') if isinstance(person_data, dict) else None
+                if isinstance(face, str) and face:
+                    yield nik, face
+
+    def get_profiling_identities(self, niks: List[str]) -> Dict[str, Dict]:
+        """Summary columns (full_name, ttl, alamat, thumbnail_url) of the given NIKs"""
+        if not niks:
+            return {}
+        cursor = None
+        conn = None
+        try:
+            conn = self.get_connection()
+            if not conn:
+                return {}
+
+            cursor = conn.cursor(dictionary=True)
+            placeholders = ', '.join(['%s'] * len(niks))
+            cursor.execute(f'''
+                SELECT nik, full_name, ttl, alamat, thumbnail_url FROM profiling_data
+                WHERE nik IN ({placeholders})
+            ''', list(niks))
+            return {row['nik']: row for row in cursor.fetchall()}
+        except Error as e:
+            print(f"Error getting profiling identities: {e}")
+            return {}
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
     def delete_profiling_data(self, profiling_id: int) -> bool:
         """Delete profiling data by ID"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1034,11 +2506,19 @@ class UserDatabase:
             
             cursor = conn.cursor()
             
+            # Rollup decrement and DELETE commit together
+            conn.start_transaction()
+            self._apply_stats_rollup(cursor, 'profiling', 'id = %s', (profiling_id,), sign=-1)
             cursor.execute('DELETE FROM profiling_data WHERE id = %s', (profiling_id,))
             conn.commit()
             
             return True
         except Error as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Error:
+                    pass
             print(f"Error deleting profiling data: {e}")
             return False
         finally:
@@ -1071,6 +2551,8 @@ class UserDatabase:
             # Log the data being saved
             print(f"[DB] Saving cek plat data: no_polisi={no_polisi}, user_id={user_id}, nama_pemilik={nama_pemilik}")
             
+            # Row and rollup increment commit together
+            conn.start_transaction()
             cursor.execute('''
                 INSERT INTO cek_plat_data 
                 (user_id, no_polisi, nama_pemilik, alamat, merk_kendaraan, type_kendaraan, 
@@ -1086,11 +2568,17 @@ class UserDatabase:
                 coordinates_lat, coordinates_lon, accuracy_score, accuracy_details, display_name,
                 ip_address, user_agent
             ))
+            self._apply_stats_rollup(cursor, 'cek_plat', 'id = %s', (cursor.lastrowid,))
             
             conn.commit()
             print(f"[DB] Successfully saved cek plat data for {no_polisi}")
             return True
         except Error as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Error:
+                    pass
             print(f"[DB ERROR] Error saving cek plat data: {e}")
             import traceback
             print(f"[DB ERROR] Traceback: {traceback.format_exc()}")
@@ -1103,6 +2591,8 @@ class UserDatabase:
 
     def get_cekplat_data(self, user_id: int = None, limit: int = 100, offset: int = 0) -> list:
         """Get cek plat data with optional filters"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1144,6 +2634,8 @@ class UserDatabase:
 
     def get_cekplat_data_count(self, user_id: int = None) -> int:
         """Get count of cek plat data with optional filters"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1177,6 +2669,8 @@ class UserDatabase:
 
     def delete_cekplat_data(self, cekplat_id: int) -> bool:
         """Delete cek plat data by ID"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1184,11 +2678,19 @@ class UserDatabase:
             
             cursor = conn.cursor()
             
+            # Rollup decrement and DELETE commit together
+            conn.start_transaction()
+            self._apply_stats_rollup(cursor, 'cek_plat', 'id = %s', (cekplat_id,), sign=-1)
             cursor.execute('DELETE FROM cek_plat_data WHERE id = %s', (cekplat_id,))
             conn.commit()
             
             return True
         except Error as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Error:
+                    pass
             print(f"Error deleting cek plat data: {e}")
             return False
         finally:
@@ -1198,8 +2700,80 @@ class UserDatabase:
                 conn.close()
 
     # Dashboard Statistics Methods
+    
+    # metric -> (source table, timestamp column, dimension expression, per-user column or None)
+    STATS_ROLLUP_SOURCES = {
+        'profiling': ('profiling_data', 'search_timestamp', 'search_type', None),
+        'cek_plat': ('cek_plat_data', 'search_timestamp', 'SUBSTRING(no_polisi, 1, 2)', None),
+        'activity': ('user_activities', 'created_at', 'activity_type', 'user_id'),
+    }
+    
+    def _apply_stats_rollup(self, cursor, metric: str, where: str = None, params: tuple = (),
+                            sign: int = 1):
+        """Add (sign=1) or subtract (sign=-1) the source rows matching `where` to stats_rollup"""
+        table, ts_column, dim_expr, user_column = self.STATS_ROLLUP_SOURCES[metric]
+        where_clause = f'WHERE {where}' if where else ''
+        group_by = f"DATE({ts_column}), COALESCE({dim_expr}, '')"
+        if user_column:
+            group_by += f', {user_column}'
+        cursor.execute(f'''
+            INSERT INTO stats_rollup (metric, bucket_date, dim, user_id, total)
+            SELECT %s, DATE({ts_column}), COALESCE({dim_expr}, ''), {user_column or 0},
+                   {'-' if sign < 0 else ''}COUNT(*)
+            FROM {table}
+            {where_clause}
+            GROUP BY {group_by}
+            ON DUPLICATE KEY UPDATE total = total + VALUES(total)
+        ''', (metric, *params))
+    
+    def _rebuild_stats_rollup(self, cursor):
+        """Recompute stats_rollup from the source tables (full scan, run rarely)"""
+        cursor.execute('DELETE FROM stats_rollup')
+        for metric in self.STATS_ROLLUP_SOURCES:
+            self._apply_stats_rollup(cursor, metric)
+        self._stats_cache.clear()
+        print("✅ Stats rollup rebuilt")
+    
+    def rebuild_stats_rollup(self) -> bool:
+        """Rebuild dashboard counters, e.g. after manual changes to the data tables"""
+        cursor = None
+        conn = None
+        try:
+            conn = self.get_connection()
+            if not conn:
+                return False
+            
+            cursor = conn.cursor()
+            conn.start_transaction()
+            self._rebuild_stats_rollup(cursor)
+            conn.commit()
+            return True
+        except Error as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Error:
+                    pass
+            print(f"Error rebuilding stats rollup: {e}")
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+    
+    def get_stats_cache_stats(self) -> Dict:
+        """Get dashboard stats cache metrics"""
+        return self._stats_cache.stats()
+    
     def get_dashboard_stats(self) -> Dict:
-        """Get dashboard statistics"""
+        """Get dashboard statistics (from stats_rollup, cached for a few seconds)"""
+        cached = self._stats_cache.get('dashboard')
+        if cached is not None:
+            return cached
+        
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1208,10 +2782,18 @@ class UserDatabase:
             cursor = conn.cursor(dictionary=True)
             stats = {}
             
-            # Total searches (from profiling_data)
-            cursor.execute('SELECT COUNT(*) as total FROM profiling_data')
-            result = cursor.fetchone()
-            stats['total_searches'] = result['total'] if result else 0
+            # Search types distribution (also gives total searches and face matches)
+            cursor.execute('''
+                SELECT dim as search_type, CAST(SUM(total) AS SIGNED) as count
+                FROM stats_rollup
+                WHERE metric = 'profiling'
+                GROUP BY dim
+                HAVING count > 0
+            ''')
+            search_types = cursor.fetchall()
+            stats['search_types'] = {row['search_type']: row['count'] for row in search_types}
+            stats['total_searches'] = sum(stats['search_types'].values())
+            stats['face_matches'] = stats['search_types'].get('face', 0)
             
             # Active users (users with recent login)
             cursor.execute('''
@@ -1223,15 +2805,6 @@ class UserDatabase:
             result = cursor.fetchone()
             stats['active_users'] = result['active_users'] if result else 0
             
-            # Face matches (face search type)
-            cursor.execute('''
-                SELECT COUNT(*) as face_matches 
-                FROM profiling_data 
-                WHERE search_type = 'face'
-            ''')
-            result = cursor.fetchone()
-            stats['face_matches'] = result['face_matches'] if result else 0
-            
             # System alerts (failed searches or errors)
             cursor.execute('''
                 SELECT COUNT(*) as system_alerts 
@@ -1242,54 +2815,44 @@ class UserDatabase:
             result = cursor.fetchone()
             stats['system_alerts'] = result['system_alerts'] if result else 0
             
-            # Search types distribution
-            cursor.execute('''
-                SELECT search_type, COUNT(*) as count 
-                FROM profiling_data 
-                GROUP BY search_type
-            ''')
-            search_types = cursor.fetchall()
-            stats['search_types'] = {row['search_type']: row['count'] for row in search_types}
-            
             # Daily activity (last 7 days)
             cursor.execute('''
-                SELECT DATE(search_timestamp) as date, 
-                       COUNT(*) as profiling_searches
-                FROM profiling_data 
-                WHERE search_timestamp >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-                GROUP BY DATE(search_timestamp)
+                SELECT bucket_date as date,
+                       CAST(SUM(total) AS SIGNED) as profiling_searches
+                FROM stats_rollup
+                WHERE metric = 'profiling'
+                AND bucket_date >= DATE(DATE_SUB(NOW(), INTERVAL 7 DAY))
+                GROUP BY bucket_date
+                HAVING profiling_searches > 0
                 ORDER BY date
             ''')
-            daily_activity = cursor.fetchall()
-            stats['daily_activity'] = daily_activity
+            stats['daily_activity'] = cursor.fetchall()
             
             # Cek plat daily activity (last 7 days)
             cursor.execute('''
-                SELECT DATE(search_timestamp) as date,
-                       COUNT(*) as cek_plat_searches
-                FROM cek_plat_data
-                WHERE search_timestamp >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-                GROUP BY DATE(search_timestamp)
+                SELECT bucket_date as date,
+                       CAST(SUM(total) AS SIGNED) as cek_plat_searches
+                FROM stats_rollup
+                WHERE metric = 'cek_plat'
+                AND bucket_date >= DATE(DATE_SUB(NOW(), INTERVAL 7 DAY))
+                GROUP BY bucket_date
+                HAVING cek_plat_searches > 0
                 ORDER BY date
             ''')
-            cek_plat_daily_activity = cursor.fetchall()
-            stats['cek_plat_daily_activity'] = cek_plat_daily_activity
-
-            # Cek plat data count
-            cursor.execute('SELECT COUNT(*) as cek_plat_count FROM cek_plat_data')
-            result = cursor.fetchone()
-            stats['cek_plat_searches'] = result['cek_plat_count'] if result else 0
+            stats['cek_plat_daily_activity'] = cursor.fetchall()
             
             # Cek plat by region (first 2 letters of no_polisi)
             cursor.execute('''
-                SELECT SUBSTRING(no_polisi, 1, 2) as region, COUNT(*) as count
-                FROM cek_plat_data 
-                GROUP BY SUBSTRING(no_polisi, 1, 2)
+                SELECT dim as region, CAST(SUM(total) AS SIGNED) as count
+                FROM stats_rollup
+                WHERE metric = 'cek_plat'
+                GROUP BY dim
+                HAVING count > 0
                 ORDER BY count DESC
-                LIMIT 7
             ''')
             cek_plat_regions = cursor.fetchall()
-            stats['cek_plat_regions'] = cek_plat_regions
+            stats['cek_plat_searches'] = sum(row['count'] for row in cek_plat_regions)
+            stats['cek_plat_regions'] = cek_plat_regions[:7]
             
             # Recent activities
             cursor.execute('''
@@ -1302,6 +2865,7 @@ class UserDatabase:
             recent_activities = cursor.fetchall()
             stats['recent_activities'] = recent_activities
             
+            self._stats_cache.set('dashboard', stats)
             return stats
             
         except Error as e:
@@ -1312,157 +2876,224 @@ class UserDatabase:
                 cursor.close()
             if conn:
                 conn.close()
-
-    def get_user_activities_filtered(self, user_id: int = None, activity_type: str = None,
-                                     start_date: str = None, end_date: str = None,
-                                     search: str = None, page: int = 1, per_page: int = 50) -> List[Dict]:
-        """Get user activities with filters and pagination"""
+
+    ACTIVITY_COLUMNS = '''ua.id, ua.user_id, ua.activity_type, ua.description, ua.ip_address,
+                          ua.user_agent, ua.created_at, u.username, u.full_name, u.role'''
+    
+    def _activity_filter(self, cursor, user_id: int = None, activity_type: str = None,
+                         start_date: str = None, end_date: str = None, search: str = None) -> tuple:
+        """Build (source, conditions, params) for the activity list and count queries.
+        
+        Dates become a half-open created_at range so the (user_id, activity_type,
+        created_at) indexes stay usable. Free text goes through the ft_description
+        FULLTEXT index; matching usernames/full names are looked up in the small
+        users table first and unioned in by user_id.
+        """
+        source = 'user_activities ua'
+        conditions = []
+        params = []
+        
+        if user_id:
+            conditions.append('ua.user_id = %s')
+            params.append(user_id)
+        
+        if activity_type:
+            conditions.append('ua.activity_type = %s')
+            params.append(activity_type)
+        
+        for value, operator, shift in ((start_date, '>=', 0), (end_date, '<', 1)):
+            if not value:
+                continue
+            try:
+                bound = datetime.strptime(value[:10], '%Y-%m-%d') + timedelta(days=shift)
+            except ValueError:
+                print(f"Ignoring invalid activity date filter: {value}")
+                continue
+            conditions.append(f'ua.created_at {operator} %s')
+            params.append(bound)
+        
+        if search and search.strip():
+            search = search.strip()
+            cursor.execute('''
+                SELECT id FROM users WHERE username LIKE %s OR full_name LIKE %s
+            ''', (f'%{search}%', f'%{search}%'))
+            user_ids = [row['id'] for row in cursor.fetchall()]
+            
+            branches = []
+            source_params = []
+            terms = [t for t in re.sub(r'[+\-<>()~*"@]+', ' ', search).split() if t]
+            if terms:
+                branches.append('''
+                    SELECT id FROM user_activities
+                    WHERE MATCH(description) AGAINST (%s IN BOOLEAN MODE)
+                ''')
+                source_params.append(' '.join(f'+{t}*' for t in terms))
+            if user_ids:
+                placeholders = ', '.join(['%s'] * len(user_ids))
+                branches.append(f'SELECT id FROM user_activities WHERE user_id IN ({placeholders})')
+                source_params.extend(user_ids)
+            if not branches:
+                conditions.append('1=0')
+            else:
+                # UNION of two index lookups instead of an OR that forces a table scan
+                source = f'''({' UNION '.join(branches)}) search_hits
+                    JOIN user_activities ua ON ua.id = search_hits.id'''
+                params = source_params + params
+        
+        return source, conditions, params
+    
+    def _activity_count_from_rollup(self, cursor, user_id: int = None, activity_type: str = None,
+                                    start_date: str = None, end_date: str = None) -> int:
+        """Count activities from stats_rollup (only valid without a free-text search)"""
+        conditions = ["metric = 'activity'"]
+        params = []
+        if user_id:
+            conditions.append('user_id = %s')
+            params.append(user_id)
+        if activity_type:
+            conditions.append('dim = %s')
+            params.append(activity_type)
+        for value, operator in ((start_date, '>='), (end_date, '<=')):
+            if not value:
+                continue
+            try:
+                day = datetime.strptime(value[:10], '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            conditions.append(f'bucket_date {operator} %s')
+            params.append(day)
+        
+        cursor.execute(f'''
+            SELECT CAST(COALESCE(SUM(total), 0) AS SIGNED) as total
+            FROM stats_rollup
+            WHERE {' AND '.join(conditions)}
+        ''', params)
+        result = cursor.fetchone()
+        return max(0, result['total']) if result else 0
+    
+    @staticmethod
+    def _format_activity_row(row: Dict) -> Dict:
+        # Handle created_at date conversion
+        created_at = row.get('created_at')
+        if created_at:
+            if isinstance(created_at, str):
+                # Already a string, use as is
+                created_at_str = created_at
+            elif hasattr(created_at, 'isoformat'):
+                # Convert datetime to ISO format string
+                created_at_str = created_at.isoformat()
+            else:
+                # Fallback to string conversion
+                created_at_str = str(created_at)
+        else:
+            created_at_str = None
+        
+        return {
+            'id': row.get('id'),
+            'user_id': row.get('user_id'),
+            'activity_type': row.get('activity_type'),
+            'description': row.get('description'),
+            'ip_address': row.get('ip_address'),
+            'user_agent': row.get('user_agent'),
+            'created_at': created_at_str,
+            'username': row.get('username'),
+            'full_name': row.get('full_name'),
+            'role': row.get('role')
+        }
+    
+    def get_user_activities_page(self, user_id: int = None, activity_type: str = None,
+                                 start_date: str = None, end_date: str = None,
+                                 search: str = None, page: int = 1, per_page: int = 50) -> tuple:
+        """Get one page of filtered activities and the total count in one checkout.
+        
+        Without a search the total comes from stats_rollup (cost grows with the
+        number of days, not rows). With a search the total is returned by the
+        page query itself via COUNT(*) OVER (), so the table is read once.
+        Returns (activities, total).
+        """
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
-                return []
+                return [], 0
             
             cursor = conn.cursor(dictionary=True)
             
-            # Build WHERE clause
-            where_conditions = []
-            params = []
-            
-            if user_id:
-                where_conditions.append('ua.user_id = %s')
-                params.append(user_id)
-            
-            if activity_type:
-                where_conditions.append('ua.activity_type = %s')
-                params.append(activity_type)
-            
-            if start_date:
-                where_conditions.append('DATE(ua.created_at) >= %s')
-                params.append(start_date)
-            
-            if end_date:
-                where_conditions.append('DATE(ua.created_at) <= %s')
-                params.append(end_date)
-            
-            if search:
-                where_conditions.append('(ua.description LIKE %s OR u.username LIKE %s OR u.full_name LIKE %s)')
-                search_param = f'%{search}%'
-                params.extend([search_param, search_param, search_param])
+            total = None
+            if not (search and search.strip()):
+                total = self._activity_count_from_rollup(cursor, user_id, activity_type,
+                                                         start_date, end_date)
             
-            where_clause = ' AND '.join(where_conditions) if where_conditions else '1=1'
+            source, conditions, params = self._activity_filter(
+                cursor, user_id, activity_type, start_date, end_date, search)
+            where_clause = ' AND '.join(conditions) if conditions else '1=1'
             
-            # Calculate offset
-            offset = (page - 1) * per_page
-            
-            # Execute query
-            query = f'''
-                SELECT ua.id, ua.user_id, ua.activity_type, ua.description, ua.ip_address,
-                       ua.user_agent, ua.created_at, u.username, u.full_name, u.role
-                FROM user_activities ua
+            offset = (max(1, page) - 1) * per_page
+            window_count = ', COUNT(*) OVER () as total_count' if total is None else ''
+            cursor.execute(f'''
+                SELECT {self.ACTIVITY_COLUMNS}{window_count}
+                FROM {source}
                 JOIN users u ON ua.user_id = u.id
                 WHERE {where_clause}
-                ORDER BY ua.created_at DESC
+                ORDER BY ua.created_at DESC, ua.id DESC
                 LIMIT %s OFFSET %s
-            '''
-            params.extend([per_page, offset])
-            
-            cursor.execute(query, params)
-            
-            activities = []
+            ''', params + [per_page, offset])
             rows = cursor.fetchall()
-            print(f"✅ Found {len(rows)} activities in database")  # Debug log
-            
-            for row in rows:
-                # Handle created_at date conversion
-                created_at = row.get('created_at')
-                if created_at:
-                    if isinstance(created_at, str):
-                        # Already a string, use as is
-                        created_at_str = created_at
-                    elif hasattr(created_at, 'isoformat'):
-                        # Convert datetime to ISO format string
-                        created_at_str = created_at.isoformat()
-                    else:
-                        # Fallback to string conversion
-                        created_at_str = str(created_at)
-                else:
-                    created_at_str = None
-                
-                activity = {
-                    'id': row.get('id'),
-                    'user_id': row.get('user_id'),
-                    'activity_type': row.get('activity_type'),
-                    'description': row.get('description'),
-                    'ip_address': row.get('ip_address'),
-                    'user_agent': row.get('user_agent'),
-                    'created_at': created_at_str,
-                    'username': row.get('username'),
-                    'full_name': row.get('full_name'),
-                    'role': row.get('role')
-                }
-                activities.append(activity)
             
-            print(f"✅ Returning {len(activities)} activities to frontend")  # Debug log
-            return activities
+            if total is None:
+                if rows:
+                    total = rows[0]['total_count']
+                else:
+                    # Past the last page: the window count is not available
+                    cursor.execute(f'SELECT COUNT(*) as total FROM {source} WHERE {where_clause}', params)
+                    result = cursor.fetchone()
+                    total = result['total'] if result else 0
+            
+            activities = [self._format_activity_row(row) for row in rows]
+            print(f"✅ Returning {len(activities)} of {total} activities to frontend")  # Debug log
+            return activities, total
         except Error as e:
             print(f"Error getting filtered activities: {e}")
-            return []
+            return [], 0
         finally:
             if cursor:
                 cursor.close()
             if conn:
                 conn.close()
+    
+    def get_user_activities_filtered(self, user_id: int = None, activity_type: str = None,
+                                     start_date: str = None, end_date: str = None,
+                                     search: str = None, page: int = 1, per_page: int = 50) -> List[Dict]:
+        """Get user activities with filters and pagination"""
+        activities, _ = self.get_user_activities_page(user_id, activity_type, start_date,
+                                                      end_date, search, page, per_page)
+        return activities
 
     def get_user_activities_count(self, user_id: int = None, activity_type: str = None,
                                   start_date: str = None, end_date: str = None,
                                   search: str = None) -> int:
         """Get total count of user activities with filters"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
                 return 0
             
-            cursor = conn.cursor()
-            
-            # Build WHERE clause (same as get_user_activities_filtered)
-            where_conditions = []
-            params = []
-            
-            if user_id:
-                where_conditions.append('ua.user_id = %s')
-                params.append(user_id)
-            
-            if activity_type:
-                where_conditions.append('ua.activity_type = %s')
-                params.append(activity_type)
-            
-            if start_date:
-                where_conditions.append('DATE(ua.created_at) >= %s')
-                params.append(start_date)
-            
-            if end_date:
-                where_conditions.append('DATE(ua.created_at) <= %s')
-                params.append(end_date)
-            
-            if search:
-                where_conditions.append('(ua.description LIKE %s OR u.username LIKE %s OR u.full_name LIKE %s)')
-                search_param = f'%{search}%'
-                params.extend([search_param, search_param, search_param])
-            
-            where_clause = ' AND '.join(where_conditions) if where_conditions else '1=1'
+            cursor = conn.cursor(dictionary=True)
             
-            # Execute count query
-            query = f'''
-                SELECT COUNT(*) as total
-                FROM user_activities ua
-                JOIN users u ON ua.user_id = u.id
-                WHERE {where_clause}
-            '''
+            if not (search and search.strip()):
+                return self._activity_count_from_rollup(cursor, user_id, activity_type,
+                                                        start_date, end_date)
             
-            cursor.execute(query, params)
+            source, conditions, params = self._activity_filter(
+                cursor, user_id, activity_type, start_date, end_date, search)
+            where_clause = ' AND '.join(conditions) if conditions else '1=1'
+            cursor.execute(f'SELECT COUNT(*) as total FROM {source} WHERE {where_clause}', params)
             result = cursor.fetchone()
             
-            return result[0] if result else 0
+            return result['total'] if result else 0
         except Error as e:
             print(f"Error getting activities count: {e}")
             return 0
@@ -1473,7 +3104,14 @@ class UserDatabase:
                 conn.close()
 
     def get_activity_stats(self, user_id: int = None) -> Dict:
-        """Get activity statistics per user"""
+        """Get activity statistics per user (from stats_rollup, cached for a few seconds)"""
+        cache_key = ('activity', user_id)
+        cached = self._stats_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1483,52 +3121,34 @@ class UserDatabase:
             stats = {}
             
             # Build WHERE clause
-            where_clause = 'WHERE ua.user_id = %s' if user_id else ''
+            user_filter = 'AND user_id = %s' if user_id else ''
             params = [user_id] if user_id else []
             
-            # Total activities
-            query = f'''
-                SELECT COUNT(*) as total
-                FROM user_activities ua
-                {where_clause}
-            '''
-            cursor.execute(query, params)
-            result = cursor.fetchone()
-            stats['total_activities'] = result.get('total', 0) if result else 0
-            
-            # Activities by type
+            # Activities by type (also gives total activities)
             query = f'''
-                SELECT activity_type, COUNT(*) as count
-                FROM user_activities ua
-                {where_clause}
-                GROUP BY activity_type
+                SELECT dim as activity_type, CAST(SUM(total) AS SIGNED) as count
+                FROM stats_rollup
+                WHERE metric = 'activity' {user_filter}
+                GROUP BY dim
+                HAVING count > 0
                 ORDER BY count DESC
             '''
             cursor.execute(query, params)
             activity_types = cursor.fetchall()
             stats['by_type'] = {row.get('activity_type'): row.get('count', 0) for row in activity_types}
+            stats['total_activities'] = sum(stats['by_type'].values())
             
             # Activities by day (last 7 days)
-            if user_id:
-                # If filtering by user, need to add WHERE clause properly
-                query = f'''
-                    SELECT DATE(created_at) as date, COUNT(*) as count
-                    FROM user_activities ua
-                    WHERE ua.user_id = %s
-                    AND created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-                    GROUP BY DATE(created_at)
-                    ORDER BY date DESC
-                '''
-                cursor.execute(query, [user_id])
-            else:
-                query = '''
-                    SELECT DATE(created_at) as date, COUNT(*) as count
-                    FROM user_activities ua
-                    WHERE created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-                    GROUP BY DATE(created_at)
-                    ORDER BY date DESC
-                '''
-                cursor.execute(query)
+            query = f'''
+                SELECT bucket_date as date, CAST(SUM(total) AS SIGNED) as count
+                FROM stats_rollup
+                WHERE metric = 'activity' {user_filter}
+                AND bucket_date >= DATE(DATE_SUB(NOW(), INTERVAL 7 DAY))
+                GROUP BY bucket_date
+                HAVING count > 0
+                ORDER BY date DESC
+            '''
+            cursor.execute(query, params)
             
             daily_activities = cursor.fetchall()
             # Convert date objects to strings for JSON serialization
@@ -1553,10 +3173,13 @@ class UserDatabase:
             # Top users by activity (if not filtering by user)
             if not user_id:
                 query = '''
-                    SELECT u.id, u.username, u.full_name, u.role, COUNT(*) as activity_count
-                    FROM user_activities ua
-                    JOIN users u ON ua.user_id = u.id
+                    SELECT u.id, u.username, u.full_name, u.role,
+                           CAST(SUM(r.total) AS SIGNED) as activity_count
+                    FROM stats_rollup r
+                    JOIN users u ON r.user_id = u.id
+                    WHERE r.metric = 'activity'
                     GROUP BY u.id, u.username, u.full_name, u.role
+                    HAVING activity_count > 0
                     ORDER BY activity_count DESC
                     LIMIT 10
                 '''
@@ -1602,6 +3225,7 @@ class UserDatabase:
             stats['recent_types'] = {row.get('activity_type'): row.get('count', 0) for row in recent_types}
             
             print(f"✅ Activity stats generated: total={stats.get('total_activities', 0)}, top_users={len(stats.get('top_users', []))}")  # Debug log
+            self._stats_cache.set(cache_key, stats)
             return stats
         except Error as e:
             print(f"Error getting activity stats: {e}")
@@ -1614,227 +3238,37 @@ class UserDatabase:
 
     # API Keys Management Methods
     def get_api_key(self, api_type: str = 'GOOGLE_CSE') -> Optional[str]:
-        """Get an active API key from database with rotation logic"""
-        max_retries = 3  # Increased retries for better reliability
-        for attempt in range(max_retries):
-            cursor = None
-            conn = None
-            try:
-                # Always get fresh connection for thread safety (each thread gets its own)
-                conn = self.get_connection(force_new=True)
-                if not conn:
-                    if attempt < max_retries - 1:
-                        import time
-                        time.sleep(0.1 * (attempt + 1))  # Small delay before retry
-                        continue
-                    return None
-                
-                # Use a single cursor for all operations to avoid sync issues
-                cursor = conn.cursor(buffered=True)
-                
-                # Set connection timeout to prevent hanging
-                try:
-                    cursor.execute("SET SESSION wait_timeout = 300")
-                    cursor.execute("SET SESSION interactive_timeout = 300")
-                except:
-                    pass  # Ignore if can't set timeout
-                
-                # Get the best available API key
-                cursor.execute('''
-                    SELECT id, api_key, usage_count, daily_limit, last_used
-                    FROM api_keys
-                    WHERE api_type = %s AND status = 'active'
-                    ORDER BY priority DESC, (last_used IS NULL) DESC, last_used ASC, id ASC
-                    LIMIT 1
-                ''', (api_type,))
-                
-                result = cursor.fetchone()
-                
-                # Validate result before unpacking - check None first!
-                if result is None:
-                    if cursor:
-                        cursor.close()
-                    return None
-                
-                # Check if result has enough elements (must be tuple/list with 5 elements)
-                try:
-                    if len(result) < 5:
-                        if cursor:
-                            cursor.close()
-                        return None
-                except (TypeError, AttributeError):
-                    # Result is not a sequence, can't unpack
-                    if cursor:
-                        cursor.close()
-                    return None
-                
-                # Now safe to unpack
-                try:
-                    key_id, api_key, usage_count, daily_limit, last_used = result
-                except (ValueError, TypeError) as e:
-                    # Can't unpack - wrong number of values or wrong type
-                    print(f"Error unpacking result: {e}, result: {result}")
-                    if cursor:
-                        cursor.close()
-                    return None
-                
-                # Validate all values are not None
-                if key_id is None or api_key is None:
-                    if cursor:
-                        cursor.close()
-                    return None
-                
-                # Check if daily limit is exceeded
-                if daily_limit and daily_limit > 0 and usage_count and usage_count >= daily_limit:
-                    # Check if it's a new day (reset usage)
-                    if last_used and hasattr(last_used, 'date') and last_used.date() < datetime.now().date():
-                        # Reset usage count for new day
-                        cursor.execute('''
-                            UPDATE api_keys SET usage_count = 0 WHERE id = %s
-                        ''', (key_id,))
-                        usage_count = 0
-                    else:
-                        # Try next key
-                        cursor.execute('''
-                            SELECT id, api_key, usage_count, daily_limit, last_used
-                            FROM api_keys
-                            WHERE api_type = %s AND status = 'active' AND id != %s
-                            ORDER BY priority DESC, (last_used IS NULL) DESC, last_used ASC, id ASC
-                            LIMIT 1
-                        ''', (api_type, key_id))
-                        next_result = cursor.fetchone()
-                        
-                        # Validate next_result before unpacking - check None first!
-                        if next_result is None:
-                            if cursor:
-                                cursor.close()
-                            return None
-                        
-                        # Check if next_result has enough elements
-                        try:
-                            if len(next_result) < 5:
-                                if cursor:
-                                    cursor.close()
-                                return None
-                        except (TypeError, AttributeError):
-                            # next_result is not a sequence
-                            if cursor:
-                                cursor.close()
-                            return None
-                        
-                        # Now safe to unpack
-                        try:
-                            key_id, api_key, usage_count, daily_limit, last_used = next_result
-                        except (ValueError, TypeError) as e:
-                            # Can't unpack
-                            print(f"Error unpacking next_result: {e}, result: {next_result}")
-                            if cursor:
-                                cursor.close()
-                            return None
-                        
-                        # Validate values are not None
-                        if key_id is None or api_key is None:
-                            if cursor:
-                                cursor.close()
-                            return None
-                
-                # Update last_used and increment usage_count
-                cursor.execute('''
-                    UPDATE api_keys 
-                    SET usage_count = usage_count + 1, last_used = NOW()
-                    WHERE id = %s
-                ''', (key_id,))
-                
-                # Close cursor before returning
-                if cursor:
-                    try:
-                        cursor.close()
-                    except:
-                        pass
-                    cursor = None
-                
-                # Close connection after use (thread-safe: each thread has its own)
-                if conn:
-                    try:
-                        # Don't close thread-local connection, just clear it if needed
-                        # Connection will be reused in same thread
-                        pass
-                    except:
-                        pass
-                
-                return api_key
-                
-            except Error as e:
-                error_msg = str(e)
-                print(f"Error getting API key (attempt {attempt + 1}/{max_retries}): {e}")
-                
-                # Close cursor on error
-                if cursor:
-                    try:
-                        cursor.close()
-                    except:
-                        pass
-                    cursor = None
-                
-                # Close connection on error
-                if conn:
-                    try:
-                        conn.close()
-                    except:
-                        pass
-                    # Clear thread-local connection
-                    if hasattr(self._local, 'connection'):
-                        self._local.connection = None
-                
-                # If it's a connection/packet error and we have retries left, try again
-                if (('Lost connection' in error_msg or 'not available' in error_msg or 
-                     'Malformed packet' in error_msg or '2027' in error_msg) and 
-                    attempt < max_retries - 1):
-                    import time
-                    time.sleep(0.2 * (attempt + 1))  # Delay before retry
-                    continue
-                
-                # If no more retries or different error, return None
-                if attempt >= max_retries - 1:
-                    return None
-                    
-            except Exception as e:
-                error_msg = str(e)
-                print(f"Unexpected error getting API key (attempt {attempt + 1}/{max_retries}): {e}")
-                
-                # Close cursor on error
-                if cursor:
-                    try:
-                        cursor.close()
-                    except:
-                        pass
-                    cursor = None
-                
-                # Close connection on error
-                if conn:
-                    try:
-                        conn.close()
-                    except:
-                        pass
-                    # Clear thread-local connection
-                    if hasattr(self._local, 'connection'):
-                        self._local.connection = None
-                
-                # If it's a subscriptable error or fetch error, try again with fresh connection
-                if (('subscriptable' in error_msg or 'fetch' in error_msg.lower() or 
-                     'NoneType' in error_msg) and attempt < max_retries - 1):
-                    import time
-                    time.sleep(0.2 * (attempt + 1))  # Delay before retry
-                    continue
-                
-                # If no more retries, return None
-                if attempt >= max_retries - 1:
-                    return None
+        """Get an active API key with rotation logic (served from memory, see ApiKeyRotator)"""
+        self._sync_session_invalidations()
+        return self._api_keys.acquire(api_type)
+    
+    def record_api_key_usage(self, api_key: str, count: int = 1) -> bool:
+        """Count additional requests made with a key from get_api_key"""
+        return self._api_keys.record_usage(api_key, count)
+    
+    def get_api_key_id(self, api_key: str) -> Optional[int]:
+        """Look up the id of a key handed out by get_api_key"""
+        return self._api_keys.key_id(api_key)
+    
+    def get_api_key_stats(self) -> Dict:
+        """Get API key rotator metrics"""
+        return self._api_keys.stats()
+    
+    def _api_keys_changed(self, key_id: int = None):
+        """Refresh the in-memory key set here and in the other workers.
         
-        return None
+        Flushing and publishing borrow pooled connections: call it after releasing your own.
+        """
+        self._api_keys.flush()
+        if key_id is not None:
+            self._api_keys.disable(key_id)
+        self._api_keys.invalidate()
+        self._publish_cache_invalidation('api_keys', '*')
     
     def get_all_api_keys(self, api_type: str = None) -> List[Dict]:
         """Get all API keys with optional filter by type"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1887,11 +3321,15 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def create_api_key(self, api_key: str, api_type: str = 'GOOGLE_CSE', 
                       description: str = None, priority: int = 0, 
                       daily_limit: int = 100, status: str = 'active') -> bool:
         """Create a new API key"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1903,17 +3341,25 @@ class UserDatabase:
                 INSERT INTO api_keys (api_key, api_type, description, priority, daily_limit, status)
                 VALUES (%s, %s, %s, %s, %s, %s)
             ''', (api_key, api_type, description, priority, daily_limit, status))
-            
-            return True
         except Error as e:
             print(f"Error creating API key: {e}")
             return False
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+        
+        self._api_keys_changed()
+        return True
     
     def update_api_key(self, key_id: int, **kwargs) -> bool:
         """Update API key information"""
+        # Pending usage must land before a possible usage_count overwrite
+        # (flushed before borrowing our own connection)
+        self._api_keys.flush()
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1941,17 +3387,22 @@ class UserDatabase:
             
             query = f"UPDATE api_keys SET {', '.join(update_fields)} WHERE id = %s"
             cursor.execute(query, values)
-            
-            return True
         except Error as e:
             print(f"Error updating API key: {e}")
             return False
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+        
+        self._api_keys_changed(key_id)
+        return True
     
     def delete_api_key(self, key_id: int) -> bool:
         """Delete an API key"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1960,17 +3411,25 @@ class UserDatabase:
             cursor = conn.cursor()
             
             cursor.execute('DELETE FROM api_keys WHERE id = %s', (key_id,))
-            
-            return True
         except Error as e:
             print(f"Error deleting API key: {e}")
             return False
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+        
+        self._api_keys_changed(key_id)
+        return True
     
     def mark_api_key_quota_exceeded(self, key_id: int, error_message: str = None) -> bool:
         """Mark API key as quota exceeded"""
+        # Stop handing the key out before the DB write, not after the next reload
+        self._api_keys.disable(key_id)
+        
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -1986,17 +3445,23 @@ class UserDatabase:
                     updated_at = NOW()
                 WHERE id = %s
             ''', (error_message, key_id))
-            
-            return True
         except Error as e:
             print(f"Error marking API key quota exceeded: {e}")
             return False
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+        
+        self._api_keys_changed(key_id)
+        return True
     
     def reset_api_key_usage(self, key_id: int = None) -> bool:
         """Reset usage count for API key(s) - useful for daily reset"""
+        self._api_keys.flush()
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -2029,44 +3494,33 @@ class UserDatabase:
                         error_message = NULL
                     WHERE DATE(last_used) < CURDATE() OR last_used IS NULL
                 ''')
-            
-            return True
         except Error as e:
             print(f"Error resetting API key usage: {e}")
             return False
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
+        
+        self._api_keys_changed()
+        return True
 
     def log_export_audit(self, user_id: int, export_type: str, record_ids: list, 
                         filename: str, file_path: str, ip_address: str = None, 
                         user_agent: str = None) -> bool:
-        """Log export audit trail"""
-        try:
-            conn = self.get_connection()
-            if not conn:
-                return False
-            
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO user_activities (user_id, activity_type, description, ip_address, user_agent)
-                VALUES (%s, %s, %s, %s, %s)
-            ''', (user_id, 'export', 
-                  f'Exported {len(record_ids)} records to {export_type}: {filename}', 
-                  ip_address, user_agent))
-            
-            return True
-        except Error as e:
-            print(f"Error logging export audit: {e}")
-            return False
-        finally:
-            if cursor:
-                cursor.close()
+        """Log export audit trail (through the same background writer as log_activity)"""
+        return self._activity_writer.enqueue((
+            user_id, 'export',
+            f'Exported {len(record_ids)} records to {export_type}: {filename}',
+            ip_address, user_agent
+        ))
     
     # Telegram User Management Methods
     def is_telegram_user_allowed(self, telegram_id: int) -> bool:
         """Check if telegram user is allowed to use the bot"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -2086,12 +3540,16 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def add_telegram_user(self, telegram_id: int, username: str = None, 
                          first_name: str = None, last_name: str = None, 
                          is_allowed: bool = False, added_by: int = None, 
                          notes: str = None) -> bool:
         """Add or update telegram user"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -2118,9 +3576,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def get_telegram_user(self, telegram_id: int) -> Optional[Dict]:
         """Get telegram user by ID"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -2139,9 +3601,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def remove_telegram_user(self, telegram_id: int) -> bool:
         """Remove telegram user from whitelist (set is_allowed = False)"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -2161,9 +3627,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def get_all_telegram_users(self, only_allowed: bool = False) -> List[Dict]:
         """Get all telegram users"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -2189,9 +3659,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def get_pending_telegram_users(self) -> List[Dict]:
         """Get pending telegram users (not allowed yet)"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -2211,9 +3685,13 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
     
     def update_telegram_user_last_used(self, telegram_id: int) -> bool:
         """Update last_used timestamp for telegram user"""
+        cursor = None
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -2233,6 +3711,8 @@ class UserDatabase:
         finally:
             if cursor:
                 cursor.close()
+            if conn:
+                conn.close()
 
 # Global database instance
 db = UserDatabase()
@@ -0,0 +1,193 @@
+"""
+Persistent face-encoding store.
+
+Maps the content hash (SHA-1) of a face image to its 128-d encoding, so a
+photo that was encoded once never goes through face detection again.
+
+Files (in FACE_ENCODING_STORE_DIR):
+- encodings.bin: append-only fixed-size records (hash, has_face flag,
+  128 x float32), read through numpy.memmap. Images without a detectable
+  face are recorded too (has_face=0), so they are not re-detected either.
+- nik_index.txt: append-only "nik,hash" lines (last line for a NIK wins).
+
+Several processes may append to the same files; each process maps rows
+added by others on its next miss. Hot vectors are kept in an in-memory LRU.
+"""
+import hashlib
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from ttl_cache import TTLCache
+
+ENCODING_DIM = 128
+RECORD_DTYPE = np.dtype([
+    ('digest', 'u1', (20,)),  # raw bytes: numpy 'S' strings would drop trailing NULs
+    ('has_face', 'u1'),
+    ('pad', 'u1', (3,)),
+    ('encoding', '<f4', (ENCODING_DIM,)),
+])
+
+_MISSING = object()
+
+
+def content_digest(image_bytes: bytes) -> bytes:
+    """20-byte SHA-1 of the image bytes (the store key)"""
+    return hashlib.sha1(image_bytes).digest()
+
+
+class FaceEncodingStore:
+    """Content hash -> face encoding, persisted in a memory-mapped record file"""
+
+    def __init__(self, directory, lru_size: int = 4096):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.records_path = self.directory / 'encodings.bin'
+        self.nik_path = self.directory / 'nik_index.txt'
+        self._lock = threading.Lock()
+        # Encodings never go stale (keyed by content): the TTL is effectively unlimited
+        self._lru = TTLCache(max_size=lru_size, ttl=365 * 24 * 3600)
+        self._rows = {}        # digest -> row number in encodings.bin
+        self._nik_digest = {}  # nik -> digest
+        self._mmap = None
+        self._mapped_rows = 0
+        self._nik_offset = 0
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        with self._lock:
+            self._refresh_locked()
+
+    # ---- loading ----
+    def _refresh_locked(self):
+        """Map rows / NIK links appended since the last refresh (by any process)"""
+        try:
+            size = self.records_path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        rows = size // RECORD_DTYPE.itemsize
+        if rows > self._mapped_rows:
+            self._mmap = np.memmap(self.records_path, dtype=RECORD_DTYPE, mode='r', shape=(rows,))
+            digests = self._mmap['digest'][self._mapped_rows:rows]
+            for offset, digest in enumerate(digests):
+                self._rows[digest.tobytes()] = self._mapped_rows + offset
+            self._mapped_rows = rows
+        try:
+            with open(self.nik_path, 'r', encoding='ascii') as f:
+                f.seek(self._nik_offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            chunk = ''
+        # Only consume complete lines; a partial line is picked up next time
+        complete = chunk[:chunk.rfind('\n') + 1]
+        for line in complete.splitlines():
+            nik, _, digest_hex = line.partition(',')
+            if nik and len(digest_hex) == 40:
+                self._nik_digest[nik] = bytes.fromhex(digest_hex)
+        self._nik_offset += len(complete)
+
+    def _read_row_locked(self, digest: bytes):
+        row = self._rows.get(digest)
+        if row is None:
+            self._refresh_locked()
+            row = self._rows.get(digest)
+            if row is None:
+                return _MISSING
+        record = self._mmap[row]
+        if not record['has_face']:
+            return None
+        return np.array(record['encoding'], dtype=np.float64)
+
+    # ---- public API ----
+    def lookup(self, digest: bytes) -> Tuple[bool, Optional[np.ndarray]]:
+        """(found, encoding); found with encoding None means "no face in this image" """
+        cached = self._lru.get(digest, _MISSING)
+        if cached is not _MISSING:
+            with self._lock:
+                self._hits += 1
+            return True, cached
+        with self._lock:
+            encoding = self._read_row_locked(digest)
+            if encoding is _MISSING:
+                self._misses += 1
+                return False, None
+            self._hits += 1
+        self._lru.set(digest, encoding)
+        return True, encoding
+
+    def store(self, digest: bytes, encoding: Optional[np.ndarray]):
+        """Persist the encoding (or "no face" when encoding is None) for digest"""
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record['digest'] = np.frombuffer(digest, dtype=np.uint8)
+        if encoding is not None:
+            record['has_face'] = 1
+            record['encoding'] = np.asarray(encoding, dtype=np.float32)
+        with self._lock:
+            if digest in self._rows:
+                return
+            try:
+                # One write() per record with O_APPEND: records from other processes don't interleave
+                fd = os.open(self.records_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, record.tobytes())
+                finally:
+                    os.close(fd)
+                self._writes += 1
+            except OSError as e:
+                print(f"WARNING: [FACE_STORE] Gagal menyimpan encoding: {e}", file=sys.stderr)
+        self._lru.set(digest, None if encoding is None else np.asarray(encoding, dtype=np.float64))
+
+    def link_nik(self, nik: str, digest: bytes):
+        """Remember that nik's current photo has this content hash"""
+        nik = str(nik).strip()
+        if not nik or ',' in nik or '\n' in nik:
+            return
+        with self._lock:
+            if self._nik_digest.get(nik) == digest:
+                return
+            try:
+                with open(self.nik_path, 'a', encoding='ascii') as f:
+                    f.write(f"{nik},{digest.hex()}\n")
+                self._nik_digest[nik] = digest
+            except OSError as e:
+                print(f"WARNING: [FACE_STORE] Gagal menyimpan NIK index: {e}", file=sys.stderr)
+
+    def get_by_nik(self, nik: str) -> Optional[np.ndarray]:
+        """Last known encoding for a NIK's photo, or None"""
+        with self._lock:
+            digest = self._nik_digest.get(str(nik).strip())
+            if digest is None:
+                self._refresh_locked()
+                digest = self._nik_digest.get(str(nik).strip())
+        if digest is None:
+            return None
+        found, encoding = self.lookup(digest)
+        return encoding if found else None
+
+    def iter_nik_encodings(self):
+        """Yield (nik, encoding) for every NIK whose photo has a known face encoding"""
+        with self._lock:
+            self._refresh_locked()
+            links = list(self._nik_digest.items())
+        for nik, digest in links:
+            found, encoding = self.lookup(digest)
+            if found and encoding is not None:
+                yield nik, encoding
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'records': self._mapped_rows,
+                'niks': len(self._nik_digest),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'writes': self._writes,
+                'lru': self._lru.stats(),
+                'path': str(self.directory),
+            }
@@ -0,0 +1,318 @@
+"""
+Process pool for CPU-bound face work: face detection + 128-d encoding
+(face_recognition / dlib) and advanced face analysis (ai_enhancements).
+
+The work runs in worker processes (sized to the CPU count by default), so it
+neither holds the GIL of the Flask process nor blocks its request threads.
+Each worker loads the dlib models once at start-up. Images are submitted in
+batches; every image has its own timeout, and a timed-out or failed image
+yields FAILED instead of stalling the whole request.
+
+Workers use the "spawn" start method (the only one on Windows) through
+spawn_context, so they do not re-import the entry script (app.py). The pool
+is shared by all requests, so an image's timeout starts when a worker
+reports that it picked the image up, not when it was submitted; an image
+still queued after FACE_ENGINE_QUEUE_TIMEOUT is given up as well. A
+timed-out image is left to finish (other requests' images on the same pool
+keep running); only when every worker is stuck on a timed-out image is the
+pool retired and a fresh one started for new work. FACE_ENGINE_WORKERS=0
+runs everything in-process.
+"""
+import importlib
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from spawn_context import worker_context
+
+FACE_ENGINE_WORKERS = int(os.environ.get("FACE_ENGINE_WORKERS") or os.cpu_count() or 1)
+FACE_ENGINE_TIMEOUT = float(os.environ.get("FACE_ENGINE_TIMEOUT", "10"))  # seconds per image, from its start
+FACE_ENGINE_QUEUE_TIMEOUT = float(os.environ.get("FACE_ENGINE_QUEUE_TIMEOUT", "60"))  # seconds waiting for a worker
+
+# Returned for an image whose encoding failed or timed out (None means "no face found")
+FAILED = 'failed'
+
+
+# ---------- worker side ----------
+_worker_analyzers = {}
+_worker_started = None
+
+
+def _worker_init(started_queue=None):
+    """Load the dlib models once per worker (first face_encodings call is the slow one)"""
+    global _worker_started
+    _worker_started = started_queue
+    try:
+        import numpy as np
+        import face_recognition
+        face_recognition.face_encodings(np.zeros((64, 64, 3), dtype=np.uint8))
+    except Exception as e:
+        print(f"WARNING: [FACE_ENGINE] Worker {os.getpid()} gagal memuat model wajah: {e}", file=sys.stderr)
+
+
+def encode_image_bytes(image_bytes: bytes):
+    """Face detection + 128-d encoding of an image; None if no face is found"""
+    import io
+    import numpy as np
+    import face_recognition
+    from PIL import Image
+    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    encs = face_recognition.face_encodings(np.array(img))
+    if not encs:
+        return None
+    return encs[0]
+
+
+def _run_face_analysis(module_name: str, image_bytes: bytes):
+    """Run AIEnhancements._analyze_face_local of module_name (one analyzer per worker)"""
+    analyzer = _worker_analyzers.get(module_name)
+    if analyzer is None:
+        module = importlib.import_module(module_name)
+        analyzer = getattr(module, 'ai_enhancements', None)
+        if not isinstance(analyzer, module.AIEnhancements):
+            analyzer = module.AIEnhancements()
+        _worker_analyzers[module_name] = analyzer
+    return analyzer._analyze_face_local(image_bytes)
+
+
+def _run_job(job_id: int, fn, *args):
+    """Report job_id as started to the parent, then run fn(*args)"""
+    if _worker_started is not None:
+        _worker_started.put(job_id)
+    return fn(*args)
+
+
+# ---------- parent side ----------
+class FaceEngine:
+    """Batch face encoding / analysis on a process pool"""
+
+    POLL_INTERVAL = 0.1  # seconds between start checks of a queued image
+
+    def __init__(self, workers: int = FACE_ENGINE_WORKERS, timeout: float = FACE_ENGINE_TIMEOUT,
+                 queue_timeout: float = FACE_ENGINE_QUEUE_TIMEOUT):
+        self.workers = max(0, workers)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._started_queue = None
+        self._job_ids = itertools.count()
+        # job_id -> [executor, monotonic start time or None while queued, overdue]
+        self._jobs = {}
+        self._submitted = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._queue_timeouts = 0
+        self._errors = 0
+        self._restarts = 0
+        self._max_queue_depth = 0
+        self._busy_seconds = 0.0
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers == 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                if self._started_queue is None:
+                    self._started_queue = worker_context().SimpleQueue()
+                    threading.Thread(target=self._listen_started, name='face-engine-started',
+                                     daemon=True).start()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=worker_context(),
+                    initializer=_worker_init,
+                    initargs=(self._started_queue,),
+                )
+                print(f"INFO: [FACE_ENGINE] Process pool dimulai dengan {self.workers} worker", file=sys.stderr)
+            return self._executor
+
+    def _listen_started(self):
+        """Record the start time of every job a worker picks up"""
+        while True:
+            job_id = self._started_queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job[1] = time.monotonic()
+
+    def _reset_executor(self, executor) -> bool:
+        """Replace executor by a fresh pool on next use; its running jobs are left to finish.
+
+        Returns False if another thread already replaced it.
+        """
+        with self._lock:
+            replaced = self._executor is executor
+            if replaced:
+                self._executor = None
+                self._restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+        return replaced
+
+    def _on_done(self, job_id: int):
+        with self._lock:
+            self._completed += 1
+            self._jobs.pop(job_id, None)
+
+    def _submit(self, fn, *args):
+        """Submit fn(*args); returns (job_id, executor, future)"""
+        with self._lock:
+            job_id = next(self._job_ids)
+            # Registered before submit so an early start report is not lost
+            job = self._jobs[job_id] = [None, None, False]
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_run_job, job_id, fn, *args)
+        except (BrokenProcessPool, RuntimeError):
+            # A worker died (e.g. killed by the OS): start a fresh pool once
+            self._reset_executor(executor)
+            executor = self._get_executor()
+            future = executor.submit(_run_job, job_id, fn, *args)
+        with self._lock:
+            job[0] = executor
+            self._submitted += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._submitted - self._completed)
+        future.add_done_callback(lambda _, job_id=job_id: self._on_done(job_id))
+        return job_id, executor, future
+
+    def _abandon(self, job_id: int, future) -> bool:
+        """Give up waiting for a job; False if it was still queued.
+
+        A job that already runs is left to finish. If that leaves every worker
+        of its pool busy with timed-out jobs, the pool is retired so new work
+        gets a fresh one (nothing still healthy runs on the old pool).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                # Finished right at the deadline
+                self._timeouts += 1
+                return True
+            if job[1] is None:
+                self._queue_timeouts += 1
+                queued = True
+            else:
+                self._timeouts += 1
+                job[2] = True
+                queued = False
+                executor = job[0]
+                overdue = sum(1 for other in self._jobs.values() if other[0] is executor and other[2])
+        if queued:
+            future.cancel()
+            return False
+        if overdue >= self.workers and self._reset_executor(executor):
+            print(f"WARNING: [FACE_ENGINE] Semua {self.workers} worker macet melewati batas waktu "
+                  f"{self.timeout}s, process pool baru dimulai", file=sys.stderr)
+        return True
+
+    def _result(self, job_id: int, future):
+        """Result of a job: `timeout` seconds from its start, `queue_timeout` seconds to start"""
+        queued_until = time.monotonic() + self.queue_timeout
+        while True:
+            if future.done():
+                return future.result()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                started = job[1] if job is not None else None
+            if started is None:
+                remaining = queued_until - time.monotonic()
+                wait = min(remaining, self.POLL_INTERVAL)
+            else:
+                remaining = wait = started + self.timeout - time.monotonic()
+            if remaining <= 0:
+                raise FutureTimeout()
+            try:
+                return future.result(timeout=wait)
+            except FutureTimeout:
+                continue
+
+    def _collect(self, jobs) -> List:
+        """Wait for (job_id, executor, future) jobs in order; FAILED for each that fails or times out"""
+        started = time.monotonic()
+        results = []
+        for job_id, executor, future in jobs:
+            try:
+                results.append(self._result(job_id, future))
+            except FutureTimeout:
+                if self._abandon(job_id, future):
+                    print(f"WARNING: [FACE_ENGINE] Gambar melewati batas waktu {self.timeout}s", file=sys.stderr)
+                else:
+                    print(f"WARNING: [FACE_ENGINE] Gambar tidak mendapat worker dalam "
+                          f"{self.queue_timeout}s", file=sys.stderr)
+                results.append(FAILED)
+            except BrokenProcessPool as e:
+                print(f"WARNING: [FACE_ENGINE] Process pool rusak: {e}", file=sys.stderr)
+                with self._lock:
+                    self._errors += 1
+                self._reset_executor(executor)
+                results.append(FAILED)
+            except Exception as e:
+                print(f"WARNING: [FACE_ENGINE] Gagal memproses gambar: {e}", file=sys.stderr)
+                with self._lock:
+                    self._errors += 1
+                results.append(FAILED)
+        with self._lock:
+            self._busy_seconds += time.monotonic() - started
+        return results
+
+    def encode_many(self, images: List[bytes]) -> List:
+        """Encodings for a batch of images: ndarray, None (no face) or FAILED, in input order"""
+        if not images:
+            return []
+        if self.workers == 0:
+            results = []
+            for image_bytes in images:
+                try:
+                    results.append(encode_image_bytes(image_bytes))
+                except Exception as e:
+                    print(f"WARNING: [FACE_ENGINE] Gagal encode gambar: {e}", file=sys.stderr)
+                    results.append(FAILED)
+            return results
+        return self._collect([self._submit(encode_image_bytes, image_bytes) for image_bytes in images])
+
+    def encode(self, image_bytes: bytes):
+        return self.encode_many([image_bytes])[0]
+
+    def analyze(self, module_name: str, image_bytes: bytes):
+        """Run the face analysis of module_name's AIEnhancements in a worker; FAILED on error/timeout"""
+        if self.workers == 0:
+            return FAILED  # caller analyses in-process
+        return self._collect([self._submit(_run_face_analysis, module_name, image_bytes)])[0]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'started': self._executor is not None,
+                'timeout_per_image': self.timeout,
+                'queue_timeout': self.queue_timeout,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'queue_depth': self._submitted - self._completed,
+                'max_queue_depth': self._max_queue_depth,
+                'timeouts': self._timeouts,
+                'queue_timeouts': self._queue_timeouts,
+                'running_timed_out': sum(1 for job in self._jobs.values() if job[2]),
+                'errors': self._errors,
+                'restarts': self._restarts,
+                'busy_seconds': round(self._busy_seconds, 2),
+            }
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_face_engine() -> FaceEngine:
+    """Process-wide FaceEngine (the pool itself starts on first use)"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = FaceEngine()
+    return _engine
+
@@ -0,0 +1,240 @@
+"""
+Local face embedding index (NIK -> 128-d face encoding) for face-to-NIK search.
+
+File (in FACE_INDEX_DIR):
+- faces.bin: append-only fixed-size records (NIK, 128 x float32), one per
+  indexed photo, read through numpy.memmap. Each record is one O_APPEND
+  write, so processes sharing the file never split a NIK from its vector.
+
+When a NIK gets a new photo a new row is appended; only the newest row of
+each NIK is searched. Search is exact brute force by default. With
+FACE_INDEX_IVF_LISTS > 0 and at least FACE_INDEX_IVF_MIN_ROWS photos, an
+IVF (k-means partitioned) index is trained in the background and queries
+only scan the FACE_INDEX_IVF_NPROBE nearest partitions.
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+ENCODING_DIM = 128
+NIK_DTYPE = np.dtype('S24')
+RECORD_DTYPE = np.dtype([
+    ('nik', NIK_DTYPE),
+    ('vector', '<f4', (ENCODING_DIM,)),
+])
+
+
+class FaceIndex:
+    """Memory-mapped face encoding records (NIK + vector)"""
+
+    def __init__(self, directory, ivf_lists: int = 0, ivf_min_rows: int = 50000, nprobe: int = 8):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.records_path = self.directory / 'faces.bin'
+        self.ivf_lists = max(0, ivf_lists)
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = max(1, nprobe)
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, ENCODING_DIM), dtype=np.float32)
+        self._niks = np.zeros(0, dtype=NIK_DTYPE)
+        self._norms = np.zeros(0, dtype=np.float32)  # squared row norms (capacity >= _rows)
+        self._live = np.zeros(0, dtype=bool)          # newest row of its NIK (capacity >= _rows)
+        self._latest = {}                             # nik -> row
+        self._rows = 0
+        self._adds = 0
+        self._searches = 0
+        self._search_seconds = 0.0
+        # IVF state (replaced as a whole by the trainer thread)
+        self._ivf = None  # (centroids, lists, trained_rows)
+        self._training = False
+        with self._lock:
+            self._refresh_locked()
+
+    # ---- loading ----
+    def _file_rows(self) -> int:
+        try:
+            return self.records_path.stat().st_size // RECORD_DTYPE.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def _refresh_locked(self):
+        """Map rows appended since the last refresh (by this or another process)"""
+        rows = self._file_rows()
+        if rows <= self._rows:
+            return
+        start = self._rows
+        records = np.memmap(self.records_path, dtype=RECORD_DTYPE, mode='r', shape=(rows,))
+        self._vectors = records['vector']
+        self._niks = records['nik']
+        if rows > len(self._norms):
+            # Grow geometrically so indexing N photos one by one copies O(N), not O(N^2)
+            capacity = max(rows, 2 * len(self._norms), 1024)
+            norms = np.zeros(capacity, dtype=np.float32)
+            norms[:start] = self._norms[:start]
+            live = np.zeros(capacity, dtype=bool)
+            live[:start] = self._live[:start]
+            self._norms, self._live = norms, live
+        self._norms[start:rows] = np.einsum('ij,ij->i', self._vectors[start:rows], self._vectors[start:rows])
+        self._live[start:rows] = True
+        for row in range(start, rows):
+            nik = self._niks[row].decode('ascii')
+            previous = self._latest.get(nik)
+            if previous is not None:
+                self._live[previous] = False
+            self._latest[nik] = row
+        self._rows = rows
+
+    # ---- writing ----
+    def add(self, nik: str, encoding) -> bool:
+        """Index encoding as the current photo of nik; False if unchanged or invalid"""
+        nik = str(nik or '').strip()
+        if not nik or len(nik) > NIK_DTYPE.itemsize or not nik.isascii() or encoding is None:
+            return False
+        vector = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record['nik'] = nik
+        record['vector'] = vector
+        with self._lock:
+            self._refresh_locked()
+            row = self._latest.get(nik)
+            if row is not None and np.allclose(self._vectors[row], vector, atol=1e-6):
+                return False
+            try:
+                # One write() per record with O_APPEND: records from other processes don't interleave
+                fd = os.open(self.records_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, record.tobytes())
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                print(f"WARNING: [FACE_INDEX] Gagal menambah NIK {nik}: {e}", file=sys.stderr)
+                return False
+            self._adds += 1
+            self._refresh_locked()
+        self._maybe_train()
+        return True
+
+    def add_many(self, items: Iterable[Tuple[str, object]]) -> int:
+        """Add (nik, encoding) pairs; returns the number of rows written"""
+        return sum(1 for nik, encoding in items if self.add(nik, encoding))
+
+    def has(self, nik: str) -> bool:
+        with self._lock:
+            return str(nik).strip() in self._latest
+
+    # ---- IVF ----
+    def _maybe_train(self):
+        if not self.ivf_lists:
+            return
+        with self._lock:
+            live = len(self._latest)
+            ivf = self._ivf
+            # Train once big enough, retrain when the index doubled since the last training
+            due = live >= self.ivf_min_rows and (ivf is None or self._rows >= 2 * ivf[2])
+            if not due or self._training:
+                return
+            self._training = True
+        threading.Thread(target=self._train, name='face-index-ivf', daemon=True).start()
+
+    def _train(self, iterations: int = 10):
+        """k-means on a sample, then assign every row to its nearest centroid"""
+        try:
+            started = time.time()
+            with self._lock:
+                rows = self._rows
+                vectors = self._vectors
+            lists = min(self.ivf_lists, rows)
+            rng = np.random.default_rng(0)
+            sample = np.asarray(vectors[np.sort(rng.choice(rows, size=min(rows, lists * 64), replace=False))])
+            centroids = sample[rng.choice(len(sample), size=lists, replace=False)].copy()
+            for _ in range(iterations):
+                assign = self._nearest_centroids(sample, centroids, 1)[:, 0]
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                counts = np.bincount(assign, minlength=lists)
+                filled = counts > 0  # empty partitions keep their old centroid
+                centroids[filled] = sums[filled] / counts[filled, None]
+            assignment = np.empty(rows, dtype=np.int32)
+            for start in range(0, rows, 65536):
+                chunk = np.asarray(vectors[start:start + 65536])
+                assignment[start:start + len(chunk)] = self._nearest_centroids(chunk, centroids, 1)[:, 0]
+            order = np.argsort(assignment, kind='stable')
+            bounds = np.searchsorted(assignment[order], np.arange(lists + 1))
+            inverted = [order[bounds[c]:bounds[c + 1]] for c in range(lists)]
+            with self._lock:
+                self._ivf = (centroids, inverted, rows)
+            print(f"INFO: [FACE_INDEX] IVF dilatih: {lists} partisi, {rows} baris, "
+                  f"{time.time() - started:.1f}s", file=sys.stderr)
+        except Exception as e:
+            print(f"WARNING: [FACE_INDEX] Gagal melatih IVF: {e}", file=sys.stderr)
+        finally:
+            with self._lock:
+                self._training = False
+
+    @staticmethod
+    def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, count: int) -> np.ndarray:
+        d2 = (np.einsum('ij,ij->i', centroids, centroids)[None, :]
+              - 2.0 * (vectors @ centroids.T))
+        if count >= centroids.shape[0]:
+            return np.argsort(d2, axis=1)
+        part = np.argpartition(d2, count - 1, axis=1)[:, :count]
+        return np.take_along_axis(part, np.argsort(np.take_along_axis(d2, part, axis=1), axis=1), axis=1)
+
+    # ---- search ----
+    def search(self, query, top_k: int = 10, threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Nearest indexed NIKs to query as (nik, euclidean distance), nearest first"""
+        started = time.perf_counter()
+        q = np.asarray(query, dtype=np.float32).reshape(ENCODING_DIM)
+        with self._lock:
+            self._refresh_locked()
+            vectors, niks, norms = self._vectors, self._niks, self._norms
+            rows, ivf = self._rows, self._ivf
+            # _live is updated in place by later adds: search a consistent copy
+            live = self._live[:rows].copy()
+        if rows == 0 or top_k <= 0:
+            return []
+
+        if ivf is not None:
+            centroids, inverted, trained_rows = ivf
+            probes = self._nearest_centroids(q[None, :], centroids, self.nprobe)[0]
+            # Rows added after training are not in any list yet: scan them directly
+            candidates = np.concatenate([inverted[c] for c in probes] + [np.arange(trained_rows, rows)])
+            candidates = candidates[live[candidates]]
+            d2 = norms[candidates] - 2.0 * (np.asarray(vectors[candidates]) @ q) + q @ q
+        else:
+            candidates = np.flatnonzero(live[:rows])
+            d2 = (norms[:rows] - 2.0 * (vectors[:rows] @ q) + q @ q)[candidates]
+
+        dist = np.sqrt(np.maximum(d2, 0.0))
+        if threshold is not None:
+            keep = dist <= threshold
+            candidates, dist = candidates[keep], dist[keep]
+        if len(dist) > top_k:
+            part = np.argpartition(dist, top_k - 1)[:top_k]
+            candidates, dist = candidates[part], dist[part]
+        order = np.argsort(dist)
+        results = [(niks[candidates[i]].decode('ascii'), float(dist[i])) for i in order]
+        with self._lock:
+            self._searches += 1
+            self._search_seconds += time.perf_counter() - started
+        return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            ivf = self._ivf
+            return {
+                'rows': self._rows,
+                'niks': len(self._latest),
+                'adds': self._adds,
+                'searches': self._searches,
+                'avg_search_ms': round(self._search_seconds * 1000 / self._searches, 3) if self._searches else 0.0,
+                'mode': 'ivf' if ivf is not None else 'exact',
+                'ivf_lists': len(ivf[1]) if ivf is not None else 0,
+                'ivf_training': self._training,
+                'path': str(self.directory),
+            }
@@ -0,0 +1,315 @@
+"""
+Watermark removal for KTP photos (OpenCV inpainting).
+
+Kept free of Flask/app imports so the functions can run in worker
+processes of the photo-cleaning queue (photo_jobs.py).
+
+Two implementations, selected with WATERMARK_MODE or the mode argument:
+- classic: detect_text_watermark + full-image inpainting (PIL in/out).
+- fast: detect_text_watermark_fast (one combined HSV mask, component stats
+  instead of a contour loop, optional downscaled analysis) and inpainting
+  limited to the bounding box of the mask. benchmark_watermark.py compares
+  both on the photos in frontend/static/clean_photos.
+"""
+import io
+import logging
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 'classic': original multi-pass detector; 'fast': single-pass vectorized variant
+WATERMARK_MODE = os.environ.get("WATERMARK_MODE", "classic").strip().lower()
+# fast mode analyses images downscaled to at most this many pixels per side (0 = full size)
+WATERMARK_FAST_MAX_SIDE = int(os.environ.get("WATERMARK_FAST_MAX_SIDE") or 800)
+
+
+def detect_text_watermark(image_cv):
+    """Detect watermark with minimal impact on image quality"""
+    gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    
+    # Initialize mask
+    watermark_mask = np.zeros_like(gray)
+    
+    # Method 1: Detect very bright pixels only (watermark text overlays)
+    # Use higher threshold to avoid affecting normal image content
+    _, bright_mask = cv2.threshold(gray, 220, 255, cv2.THRESH_BINARY)
+    
+    # Method 2: Detect semi-transparent white overlays in HSV
+    hsv = cv2.cvtColor(image_cv, cv2.COLOR_BGR2HSV)
+    
+    # More conservative ranges for semi-transparent white overlays
+    white_ranges = [
+        ([0, 0, 200], [180, 20, 255]),   # High threshold for semi-transparent
+        ([0, 0, 220], [180, 15, 255]),   # Very high threshold
+        ([0, 0, 240], [180, 10, 255]),   # Extremely high threshold
+    ]
+    
+    for lower, upper in white_ranges:
+        white_mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
+        watermark_mask = cv2.bitwise_or(watermark_mask, white_mask)
+    
+    # Method 3: Detect small rectangular regions that might be text
+    # Find contours in bright areas with high threshold
+    contours, _ = cv2.findContours(bright_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    for contour in contours:
+        x, y, w_rect, h_rect = cv2.boundingRect(contour)
+        # Check if it's a reasonable size for text characters
+        if 3 < w_rect < 40 and 2 < h_rect < 20:
+            # Check if it's bright enough to be watermark text
+            roi = gray[y:y+h_rect, x:x+w_rect]
+            if np.mean(roi) > 220:  # High threshold for watermark
+                # Small padding to cover the character
+                padding = 1
+                x1 = max(0, x - padding)
+                y1 = max(0, y - padding)
+                x2 = min(w, x + w_rect + padding)
+                y2 = min(h, y + h_rect + padding)
+                cv2.rectangle(watermark_mask, (x1, y1), (x2, y2), 255, -1)
+    
+    # Method 4: Detect text patterns using morphological operations
+    # Use smaller kernels to avoid affecting large areas
+    kernel_horizontal = cv2.getStructuringElement(cv2.MORPH_RECT, (8, 1))
+    horizontal = cv2.morphologyEx(gray, cv2.MORPH_OPEN, kernel_horizontal)
+    _, text_h_mask = cv2.threshold(horizontal, 220, 255, cv2.THRESH_BINARY)
+    
+    kernel_vertical = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 8))
+    vertical = cv2.morphologyEx(gray, cv2.MORPH_OPEN, kernel_vertical)
+    _, text_v_mask = cv2.threshold(vertical, 220, 255, cv2.THRESH_BINARY)
+    
+    watermark_mask = cv2.bitwise_or(watermark_mask, text_h_mask)
+    watermark_mask = cv2.bitwise_or(watermark_mask, text_v_mask)
+    
+    # Clean up the mask
+    # Remove small noise
+    kernel_clean = np.ones((2,2), np.uint8)
+    watermark_mask = cv2.morphologyEx(watermark_mask, cv2.MORPH_OPEN, kernel_clean)
+    
+    # Close small gaps
+    kernel_close = np.ones((2,2), np.uint8)
+    watermark_mask = cv2.morphologyEx(watermark_mask, cv2.MORPH_CLOSE, kernel_close)
+    
+    # Minimal dilation to preserve image quality
+    kernel_dilate = np.ones((2,2), np.uint8)
+    watermark_mask = cv2.dilate(watermark_mask, kernel_dilate, iterations=1)
+    
+    return watermark_mask
+
+def detect_text_watermark_fast(image_cv, max_side=None):
+    """Single-pass variant of detect_text_watermark.
+
+    Large images are analysed at most max_side pixels per side (default
+    WATERMARK_FAST_MAX_SIDE) and the mask is scaled back to full size.
+    """
+    max_side = WATERMARK_FAST_MAX_SIDE if max_side is None else max_side
+    full_h, full_w = image_cv.shape[:2]
+    scale = min(1.0, max_side / max(full_h, full_w)) if max_side else 1.0
+    if scale < 1.0:
+        size = (max(1, round(full_w * scale)), max(1, round(full_h * scale)))
+        image_cv = cv2.resize(image_cv, size, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+
+    # Very bright pixels (watermark text overlays)
+    bright = cv2.compare(gray, 220, cv2.CMP_GT)
+
+    # The three HSV ranges of the classic detector are nested in the widest one
+    hsv = cv2.cvtColor(image_cv, cv2.COLOR_BGR2HSV)
+    watermark_mask = cv2.inRange(hsv, np.array([0, 0, 200]), np.array([180, 20, 255]))
+
+    # Text-sized bright blobs: component stats + integral-image means instead of a contour loop
+    _, _, stats, _ = cv2.connectedComponentsWithStats(bright, connectivity=8)
+    x, y, bw, bh = (stats[1:, i].astype(np.int64) for i in range(4))
+    keep = (bw > 3 * scale) & (bw < 40 * scale) & (bh > 2 * scale) & (bh < 20 * scale)
+    if keep.any():
+        x, y, bw, bh = x[keep], y[keep], bw[keep], bh[keep]
+        integral = cv2.integral(gray, sdepth=cv2.CV_64F)
+        sums = (integral[y + bh, x + bw] - integral[y, x + bw]
+                - integral[y + bh, x] + integral[y, x])
+        bright_enough = sums / (bw * bh) > 220
+        x, y, bw, bh = x[bright_enough], y[bright_enough], bw[bright_enough], bh[bright_enough]
+        # Paint all padded boxes at once with a 2-D difference array (inclusive corners, like cv2.rectangle)
+        x1, y1 = np.maximum(x - 1, 0), np.maximum(y - 1, 0)
+        x2, y2 = np.minimum(x + bw + 1, w), np.minimum(y + bh + 1, h)
+        diff = np.zeros((h + 2, w + 2), dtype=np.int32)
+        np.add.at(diff, (y1, x1), 1)
+        np.add.at(diff, (y1, x2 + 1), -1)
+        np.add.at(diff, (y2 + 1, x1), -1)
+        np.add.at(diff, (y2 + 1, x2 + 1), 1)
+        boxes = diff.cumsum(axis=0).cumsum(axis=1)[:h, :w] > 0
+        watermark_mask[boxes] = 255
+
+    # Thin horizontal/vertical strokes; opening the binary mask equals thresholding the opened gray image
+    kernel_horizontal = cv2.getStructuringElement(cv2.MORPH_RECT, (8, 1))
+    kernel_vertical = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 8))
+    watermark_mask |= cv2.morphologyEx(bright, cv2.MORPH_OPEN, kernel_horizontal)
+    watermark_mask |= cv2.morphologyEx(bright, cv2.MORPH_OPEN, kernel_vertical)
+
+    kernel = np.ones((2, 2), np.uint8)
+    watermark_mask = cv2.morphologyEx(watermark_mask, cv2.MORPH_OPEN, kernel)
+    watermark_mask = cv2.morphologyEx(watermark_mask, cv2.MORPH_CLOSE, kernel)
+    watermark_mask = cv2.dilate(watermark_mask, kernel, iterations=1)
+
+    if scale < 1.0:
+        watermark_mask = cv2.resize(watermark_mask, (full_w, full_h), interpolation=cv2.INTER_NEAREST)
+        # Cover the pixels lost to rounding at the mask edges
+        watermark_mask = cv2.dilate(watermark_mask, np.ones((3, 3), np.uint8), iterations=1)
+    return watermark_mask
+
+def clean_watermark(image_bytes, mode=None):
+    """Clean watermark with minimal impact on image quality.
+
+    mode: 'classic' or 'fast' (default WATERMARK_MODE).
+    """
+    if (mode or WATERMARK_MODE) == 'fast':
+        return _clean_watermark_fast(image_bytes)
+    return _clean_watermark_classic(image_bytes)
+
+
+def _clean_watermark_classic(image_bytes):
+    try:
+        logger.info("Starting conservative watermark removal process")
+        
+        # Convert bytes to PIL Image
+        from PIL import Image
+        image = Image.open(io.BytesIO(image_bytes))
+        image_array = np.array(image)
+        
+        # Convert to OpenCV format (BGR)
+        if len(image_array.shape) == 3:
+            image_cv = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+        else:
+            image_cv = image_array
+        
+        # Create a copy for processing
+        result = image_cv.copy()
+        
+        # Detect watermark
+        watermark_mask = detect_text_watermark(image_cv)
+        
+        # Apply inpainting if watermark detected
+        if np.any(watermark_mask):
+            mask_area = np.sum(watermark_mask > 0)
+            total_area = watermark_mask.shape[0] * watermark_mask.shape[1]
+            mask_ratio = mask_area / total_area
+            
+            logger.info(f"Watermark detected, covers {mask_ratio:.2%} of image")
+            
+            # Use conservative inpainting to preserve image quality
+            if mask_ratio > 0.1:  # Large watermark area
+                result = cv2.inpaint(result, watermark_mask, 3, cv2.INPAINT_TELEA)
+                logger.info("Using Telea inpainting (radius=3) for large area")
+            else:  # Small watermark area
+                result = cv2.inpaint(result, watermark_mask, 2, cv2.INPAINT_TELEA)
+                logger.info("Using Telea inpainting (radius=2) for small area")
+            
+            # Single cleanup pass for remaining artifacts
+            logger.info("Applying single cleanup pass")
+            
+            # Convert to HSV for color-based cleaning
+            hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV)
+            
+            # Remove only very bright white overlays
+            cleanup_thresholds = [220, 240]
+            
+            for threshold in cleanup_thresholds:
+                lower_white = np.array([0, 0, threshold])
+                upper_white = np.array([180, 20, 255])  # Narrow saturation range
+                white_mask = cv2.inRange(hsv, lower_white, upper_white)
+                
+                if np.any(white_mask):
+                    # Minimal dilation for white areas
+                    white_mask_dilated = cv2.dilate(white_mask, np.ones((2,2), np.uint8), iterations=1)
+                    result = cv2.inpaint(result, white_mask_dilated, 1, cv2.INPAINT_TELEA)
+                    logger.info(f"Cleanup: Removed white artifacts (threshold={threshold})")
+        else:
+            logger.info("No watermark detected")
+        
+        # Convert back to RGB
+        result_rgb = cv2.cvtColor(result, cv2.COLOR_BGR2RGB)
+        
+        # Convert back to PIL Image
+        result_image = Image.fromarray(result_rgb)
+        
+        # Convert to bytes with high quality
+        output_buffer = io.BytesIO()
+        result_image.save(output_buffer, format='JPEG', quality=98)
+        cleaned_bytes = output_buffer.getvalue()
+        
+        logger.info(f"Successfully cleaned watermark with minimal impact, output size: {len(cleaned_bytes)} bytes")
+        return cleaned_bytes
+        
+    except Exception as e:
+        logger.error(f"Error in conservative watermark removal: {e}")
+        return None
+
+
+def _inpaint_roi(image, mask, radius):
+    """Telea inpainting limited to the bounding box of mask (plus the inpaint radius)"""
+    x, y, w, h = cv2.boundingRect(mask)
+    pad = radius + 2
+    x0, y0 = max(0, x - pad), max(0, y - pad)
+    x1, y1 = min(image.shape[1], x + w + pad), min(image.shape[0], y + h + pad)
+    result = image.copy()
+    result[y0:y1, x0:x1] = cv2.inpaint(image[y0:y1, x0:x1], mask[y0:y1, x0:x1], radius, cv2.INPAINT_TELEA)
+    return result
+
+
+def _clean_watermark_fast(image_bytes):
+    try:
+        image_cv = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image_cv is None:
+            logger.error("Error in fast watermark removal: image could not be decoded")
+            return None
+
+        result = image_cv
+        watermark_mask = detect_text_watermark_fast(image_cv)
+        if watermark_mask.any():
+            mask_ratio = cv2.countNonZero(watermark_mask) / watermark_mask.size
+            logger.info(f"Watermark detected, covers {mask_ratio:.2%} of image")
+            result = _inpaint_roi(result, watermark_mask, 3 if mask_ratio > 0.1 else 2)
+
+            # One cleanup pass: the classic threshold-240 pass only repeats a subset of this mask
+            hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV)
+            white_mask = cv2.inRange(hsv, np.array([0, 0, 220]), np.array([180, 20, 255]))
+            if white_mask.any():
+                white_mask = cv2.dilate(white_mask, np.ones((2, 2), np.uint8), iterations=1)
+                result = _inpaint_roi(result, white_mask, 1)
+        else:
+            logger.info("No watermark detected")
+
+        ok, encoded = cv2.imencode('.jpg', result, [cv2.IMWRITE_JPEG_QUALITY, 98])
+        if not ok:
+            logger.error("Error in fast watermark removal: JPEG encoding failed")
+            return None
+        return encoded.tobytes()
+
+    except Exception as e:
+        logger.error(f"Error in fast watermark removal: {e}")
+        return None
+
+
+def clean_photo_to_file(image_bytes, output_path, mode=None):
+    """Clean image_bytes and atomically write the JPEG to output_path; True on success"""
+    cleaned_bytes = clean_watermark(image_bytes, mode)
+    if not cleaned_bytes:
+        return False
+    directory = os.path.dirname(output_path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.jpg', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(cleaned_bytes)
+        # Readers never see a half-written photo
+        os.replace(tmp_path, output_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
@@ -0,0 +1,299 @@
+"""
+Background queue for cleaning KTP photos (watermark removal).
+
+Requests enqueue a job and return immediately; the photo is written to
+<output_dir>/<nik>.jpg when the job finishes. Download (I/O) runs on a
+small thread pool, the OpenCV work on a process pool (PHOTO_JOB_WORKERS,
+0 = in the job thread). A NIK has at most one job queued or running:
+later requests for it join that job. A worker writes a job-specific file
+that the job's own thread renames to <nik>.jpg, so a timed-out job can
+never overwrite the photo of a later job.
+
+The process pool is shared by all NIKs, so a job's timeout starts when a
+worker reports that it picked the job up (PHOTO_JOB_QUEUE_TIMEOUT bounds
+the wait for a worker). A timed-out job is left to finish in its worker and
+its output is discarded; only when every worker is stuck on a timed-out job
+is the pool retired and a fresh one started.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from photo_cleaning import clean_photo_to_file
+from spawn_context import worker_context
+from ttl_cache import TTLCache
+
+PHOTO_JOB_WORKERS = int(os.environ.get("PHOTO_JOB_WORKERS") or max(1, (os.cpu_count() or 2) // 2))
+PHOTO_JOB_TIMEOUT = float(os.environ.get("PHOTO_JOB_TIMEOUT", "60"))  # seconds per photo, from its start
+PHOTO_JOB_QUEUE_TIMEOUT = float(os.environ.get("PHOTO_JOB_QUEUE_TIMEOUT", "120"))  # seconds waiting for a worker
+
+# ---------- worker side ----------
+_worker_started = None
+
+
+def _worker_init(started_queue):
+    global _worker_started
+    _worker_started = started_queue
+
+
+def _clean_in_worker(job_id: int, image_bytes: bytes, path: str) -> bool:
+    """Report job_id as started to the parent, then clean image_bytes into path"""
+    _worker_started.put(job_id)
+    return clean_photo_to_file(image_bytes, path)
+
+
+def _discard(path: Path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# ---------- parent side ----------
+class PhotoJobQueue:
+    """Per-NIK de-duplicated photo-cleaning jobs"""
+
+    POLL_INTERVAL = 0.2  # seconds between start checks of a queued job
+
+    def __init__(self, output_dir, download: Callable[[str], Optional[bytes]],
+                 workers: int = PHOTO_JOB_WORKERS, timeout: float = PHOTO_JOB_TIMEOUT,
+                 queue_timeout: float = PHOTO_JOB_QUEUE_TIMEOUT):
+        self.output_dir = Path(output_dir)
+        self.download = download
+        self.workers = max(0, workers)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = {}  # nik -> job (queued / running)
+        self._finished = TTLCache(max_size=5000, ttl=3600)  # nik -> last finished job
+        self._threads = ThreadPoolExecutor(max_workers=max(2, self.workers * 2), thread_name_prefix='photo-job')
+        self._processes = None
+        self._started_queue = None
+        self._process_ids = itertools.count()
+        # process job id -> [executor, monotonic start time or None while queued, timed out]
+        self._process_jobs = {}
+        self._sequence = 0
+        self._submitted = 0
+        self._deduplicated = 0
+        self._done = 0
+        self._failed = 0
+        self._timeouts = 0
+
+    def photo_path(self, nik: str) -> Path:
+        return self.output_dir / f"{nik}.jpg"
+
+    def photo_url(self, nik: str) -> str:
+        return f"/static/clean_photos/{nik}.jpg"
+
+    # ---- submitting ----
+    def submit(self, nik: str, url: Optional[str] = None, image_bytes: Optional[bytes] = None,
+               force: bool = False) -> Dict:
+        """Queue cleaning of nik's photo from url or image_bytes; returns the job status.
+
+        Without force, an existing clean photo is kept and no job is queued.
+        """
+        nik = str(nik)
+        with self._lock:
+            job = self._active.get(nik)
+            if job is not None:
+                self._deduplicated += 1
+                return self._public(job)
+            if not force and self.photo_path(nik).exists():
+                return {'nik': nik, 'status': 'done', 'url': self.photo_url(nik)}
+            self._sequence += 1
+            job = self._active[nik] = {
+                'nik': nik,
+                'status': 'queued',
+                'url': self.photo_url(nik),
+                'submitted_at': time.time(),
+                'finished_at': None,
+                'error': None,
+                '_event': threading.Event(),
+                '_path': self.output_dir / f".{nik}.{self._sequence}.part",
+            }
+            self._submitted += 1
+        self._threads.submit(self._run, job, url, image_bytes)
+        return self._public(job)
+
+    @staticmethod
+    def _public(job: Dict) -> Dict:
+        return {k: v for k, v in job.items() if not k.startswith('_')}
+
+    # ---- running ----
+    def _get_processes(self):
+        with self._lock:
+            if self._processes is None:
+                if self._started_queue is None:
+                    self._started_queue = worker_context().SimpleQueue()
+                    threading.Thread(target=self._listen_started, name='photo-job-started',
+                                     daemon=True).start()
+                self._processes = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context(),
+                                                      initializer=_worker_init, initargs=(self._started_queue,))
+            return self._processes
+
+    def _listen_started(self):
+        """Record the start time of every job a worker picks up"""
+        while True:
+            job_id = self._started_queue.get()
+            with self._lock:
+                process_job = self._process_jobs.get(job_id)
+                if process_job is not None:
+                    process_job[1] = time.monotonic()
+
+    def _reset_processes(self, executor):
+        """Start a fresh pool for the next jobs; running jobs of the old one are left to finish"""
+        with self._lock:
+            replaced = self._processes is executor
+            if replaced:
+                self._processes = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        return replaced
+
+    def _on_process_done(self, job_id: int, future, path: Path):
+        with self._lock:
+            process_job = self._process_jobs.pop(job_id, None)
+        if process_job is not None and process_job[2]:
+            # Finished after its job gave up: the output belongs to nobody
+            _discard(path)
+
+    def _wait_process_job(self, job_id: int, future) -> bool:
+        """Result of a pool job: `timeout` seconds from its start, `queue_timeout` seconds to start"""
+        queued_until = time.monotonic() + self.queue_timeout
+        while True:
+            if future.done():
+                return future.result()
+            with self._lock:
+                process_job = self._process_jobs.get(job_id)
+                started = process_job[1] if process_job is not None else None
+            if started is None:
+                remaining = queued_until - time.monotonic()
+                wait = min(remaining, self.POLL_INTERVAL)
+            else:
+                remaining = wait = started + self.timeout - time.monotonic()
+            if remaining <= 0:
+                raise FutureTimeout()
+            try:
+                return future.result(timeout=wait)
+            except FutureTimeout:
+                continue
+
+    def _abandon(self, job_id: int, future):
+        """Give up a pool job; a running one is left to finish (its output is discarded)"""
+        with self._lock:
+            self._timeouts += 1
+            process_job = self._process_jobs.get(job_id)
+            if process_job is None:
+                return 'selesai tepat di batas waktu'
+            if process_job[1] is None and future.cancel():
+                return f"tidak mendapat worker dalam {self.queue_timeout}s"
+            process_job[2] = True
+            executor = process_job[0]
+            stuck = sum(1 for other in self._process_jobs.values() if other[0] is executor and other[2])
+        if stuck >= self.workers and self._reset_processes(executor):
+            print(f"WARNING: [PHOTO_JOBS] Semua {self.workers} worker macet melewati batas waktu "
+                  f"{self.timeout}s, process pool baru dimulai", file=sys.stderr)
+        return f"melewati batas waktu {self.timeout}s"
+
+    def _clean(self, image_bytes: bytes, path: Path) -> bool:
+        if self.workers == 0:
+            return clean_photo_to_file(image_bytes, str(path))
+        with self._lock:
+            job_id = next(self._process_ids)
+            # Registered before submit so an early start report is not lost
+            process_job = self._process_jobs[job_id] = [None, None, False]
+        executor = self._get_processes()
+        try:
+            future = executor.submit(_clean_in_worker, job_id, image_bytes, str(path))
+        except (BrokenProcessPool, RuntimeError):
+            with self._lock:
+                self._process_jobs.pop(job_id, None)
+            self._reset_processes(executor)
+            raise
+        process_job[0] = executor
+        future.add_done_callback(lambda f: self._on_process_done(job_id, f, path))
+        try:
+            return self._wait_process_job(job_id, future)
+        except FutureTimeout:
+            raise TimeoutError(self._abandon(job_id, future))
+        except BrokenProcessPool:
+            # A worker died: start a fresh pool for the next jobs
+            self._reset_processes(executor)
+            raise
+
+    def _run(self, job: Dict, url: Optional[str], image_bytes: Optional[bytes]):
+        nik = job['nik']
+        error = None
+        try:
+            with self._lock:
+                job['status'] = 'running'
+            if image_bytes is None and url:
+                image_bytes = self.download(url)
+                if not image_bytes:
+                    error = 'download gagal'
+            if image_bytes and not self._clean(image_bytes, job['_path']):
+                error = 'pembersihan watermark gagal'
+            elif image_bytes:
+                os.replace(job['_path'], self.photo_path(nik))
+            elif error is None:
+                error = 'tidak ada foto'
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if error:
+            _discard(job['_path'])
+        with self._lock:
+            job['status'] = 'failed' if error else 'done'
+            job['error'] = error
+            job['finished_at'] = time.time()
+            if error:
+                self._failed += 1
+            else:
+                self._done += 1
+            self._active.pop(nik, None)
+            self._finished.set(nik, self._public(job))
+        if error:
+            print(f"WARNING: [PHOTO_JOBS] Gagal membersihkan foto NIK {nik}: {error}", file=sys.stderr)
+        job['_event'].set()
+
+    # ---- status ----
+    def status(self, nik: str) -> Optional[Dict]:
+        """Status of nik's current or last job; 'done' if a clean photo exists without a job"""
+        nik = str(nik)
+        with self._lock:
+            job = self._active.get(nik)
+            if job is not None:
+                return self._public(job)
+        finished = self._finished.get(nik)
+        if finished is not None:
+            return finished
+        if self.photo_path(nik).exists():
+            return {'nik': nik, 'status': 'done', 'url': self.photo_url(nik)}
+        return None
+
+    def wait(self, nik: str, timeout: float) -> Optional[Dict]:
+        """Wait up to timeout seconds for nik's active job, then return its status"""
+        with self._lock:
+            job = self._active.get(str(nik))
+        if job is not None:
+            job['_event'].wait(timeout)
+        return self.status(nik)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            states = [job['status'] for job in self._active.values()]
+            return {
+                'workers': self.workers,
+                'queued': states.count('queued'),
+                'running': states.count('running'),
+                'submitted': self._submitted,
+                'deduplicated': self._deduplicated,
+                'done': self._done,
+                'failed': self._failed,
+                'timeouts': self._timeouts,
+                'running_timed_out': sum(1 for process_job in self._process_jobs.values() if process_job[2]),
+            }
@@ -0,0 +1,193 @@
+"""
+Two-tier cache for JSON-serialisable upstream results (identity lookups).
+
+Memory tier: TTLCache shared by the Flask threads of one process, bounded
+by entry count and (optionally) by the total size of the stored JSON.
+Disk tier (optional): one JSON file per key in a directory, so results
+survive restarts and are shared by worker processes and the Telegram bot.
+"Not found" results can be cached with their own (shorter) TTL.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ttl_cache import TTLCache
+
+
+class ResultCache:
+    """Memory + optional disk cache with separate TTLs for hits and "not found" results"""
+
+    def __init__(self, name: str, max_size: int = 2000, ttl: float = 600, negative_ttl: float = 60,
+                 disk_dir: Optional[str] = None, disk_max_files: int = 20000, max_bytes: int = 0):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.disk_dir = disk_dir or None
+        self.disk_max_files = max(1, disk_max_files)
+        # Values are kept as JSON text: every hit hands out a fresh copy, and
+        # len(text) is its size in bytes (json.dumps escapes non-ASCII)
+        self._memory = TTLCache(max_size=max_size, ttl=ttl, max_weight=max_bytes,
+                                weigher=lambda entry: len(entry[0]))
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._negative_stores = 0
+        self._disk_errors = 0
+        self._writes_since_prune = 0
+
+    def _count(self, attr: str):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    # ---- disk tier ----
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _disk_read(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self._count('_disk_errors')
+            return None
+        if entry.get('key') != key or entry.get('expires_at', 0) <= time.time():
+            return None
+        return entry
+
+    def _disk_write(self, key: str, text: str, ttl: float, negative: bool):
+        entry = {'key': key, 'expires_at': time.time() + ttl, 'negative': negative, 'value': text}
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=self.disk_dir)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            self._count('_disk_errors')
+            print(f"WARNING: [RESULT_CACHE] {self.name}: gagal menulis cache disk: {e}", file=sys.stderr)
+            return
+        with self._lock:
+            self._writes_since_prune += 1
+            prune = self._writes_since_prune >= 200
+            if prune:
+                self._writes_since_prune = 0
+        if prune:
+            self._disk_prune()
+
+    def _disk_files(self):
+        try:
+            return [os.path.join(self.disk_dir, n) for n in os.listdir(self.disk_dir)
+                    if n.endswith('.json')]
+        except OSError:
+            return []
+
+    def _disk_prune(self):
+        """Delete expired files, then the oldest ones above disk_max_files"""
+        now = time.time()
+        remaining = []
+        for path in self._disk_files():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    expires_at = json.load(f).get('expires_at', 0)
+                if expires_at <= now:
+                    os.remove(path)
+                else:
+                    remaining.append((os.path.getmtime(path), path))
+            except (OSError, ValueError):
+                continue
+        if len(remaining) > self.disk_max_files:
+            remaining.sort()
+            for _, path in remaining[:len(remaining) - self.disk_max_files]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # ---- public API ----
+    def get(self, key: str) -> Tuple[Any, Optional[str]]:
+        """Return (value, tier) where tier is 'memory' or 'disk'; (None, None) on a miss"""
+        entry = self._memory.get(key)
+        tier = 'memory'
+        if entry is None and self.disk_dir:
+            disk_entry = self._disk_read(key)
+            if disk_entry is not None:
+                tier = 'disk'
+                entry = (disk_entry['value'], disk_entry.get('negative', False))
+                # Promote for the rest of its lifetime
+                self._memory.set(key, entry, ttl=disk_entry['expires_at'] - time.time())
+        if entry is None:
+            self._count('_misses')
+            return None, None
+        text, negative = entry
+        self._count('_memory_hits' if tier == 'memory' else '_disk_hits')
+        if negative:
+            self._count('_negative_hits')
+        return json.loads(text), tier
+
+    def set(self, key: str, value: Any, negative: bool = False):
+        """Cache value; negative=True uses the "not found" TTL"""
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            return
+        try:
+            text = json.dumps(value)
+        except (TypeError, ValueError):
+            return  # not serialisable: don't cache
+        self._memory.set(key, (text, negative), ttl=ttl)
+        self._count('_negative_stores' if negative else '_stores')
+        if self.disk_dir:
+            self._disk_write(key, text, ttl, negative)
+
+    def purge(self, predicate: Optional[Callable[[str], bool]] = None, memory_only: bool = False) -> int:
+        """Remove entries whose key matches predicate (all entries if None); returns count"""
+        if predicate is None:
+            removed = self._memory.clear()
+        else:
+            removed = self._memory.delete_where(lambda k, v: predicate(k))
+        if self.disk_dir and not memory_only:
+            for path in self._disk_files():
+                try:
+                    if predicate is not None:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            if not predicate(json.load(f).get('key', '')):
+                                continue
+                    os.remove(path)
+                    removed += 1
+                except (OSError, ValueError):
+                    continue
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            stats = {
+                'memory_hits': self._memory_hits,
+                'disk_hits': self._disk_hits,
+                'negative_hits': self._negative_hits,
+                'misses': self._misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'stores': self._stores,
+                'negative_stores': self._negative_stores,
+                'ttl': self.ttl,
+                'negative_ttl': self.negative_ttl,
+                'disk_enabled': bool(self.disk_dir),
+                'disk_errors': self._disk_errors,
+            }
+        memory = self._memory.stats()
+        stats['memory_size'] = memory['size']
+        stats['memory_max_size'] = memory['max_size']
+        stats['memory_bytes'] = memory['weight']
+        stats['memory_max_bytes'] = memory['max_weight']
+        stats['memory_evictions'] = memory['evictions']
+        return stats
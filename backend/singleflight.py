@@ -0,0 +1,98 @@
+"""
+In-flight request coalescing ("single flight").
+
+When several threads ask for the same key at the same time, only the first
+one runs the upstream call; the others wait for it and get (a copy of) the
+same result, or the same exception.
+"""
+import copy
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls, keyed by a caller-supplied key"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call
+        self._requests = 0
+        self._executed = 0
+        self._coalesced = 0
+        self._max_waiters = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) unless an identical call (same key) is already running"""
+        with self._lock:
+            self._requests += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._coalesced += 1
+                self._max_waiters = max(self._max_waiters, call.waiters)
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            # Callers may mutate what they get back (e.g. add enrichment fields)
+            return copy.deepcopy(call.result)
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)  # no new waiters can join after this
+            if call.error is None and call.waiters:
+                # Snapshot before the leader hands its result out (and maybe mutates it)
+                call.result = copy.deepcopy(result)
+            call.event.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'executed': self._executed,
+                'coalesced': self._coalesced,
+                'in_flight': len(self._calls),
+                'max_waiters': self._max_waiters,
+            }
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def get_flight(name: str) -> SingleFlight:
+    """Shared SingleFlight group for name (created on first use)"""
+    with _flights_lock:
+        flight = _flights.get(name)
+        if flight is None:
+            flight = _flights[name] = SingleFlight(name)
+        return flight
+
+
+def flight_stats() -> Dict:
+    """Coalescing counters of every group"""
+    with _flights_lock:
+        flights = list(_flights.values())
+    return {flight.name: flight.stats() for flight in flights}
@@ -0,0 +1,54 @@
+"""
+Spawn context for the worker process pools (face_engine, photo_jobs).
+
+A spawned child normally re-imports the parent's entry script as
+__mp_main__. For app.py that would run its whole module-level start-up
+(database pool and migrations, writer threads, circuit breakers, Flask
+routes) once per worker. Processes started from this context are launched
+without the main-module entries of the preparation data, so a worker keeps
+the spawn bootstrap as its __main__ and imports only the modules of the
+functions it runs. The change is limited to the thread launching one of
+these workers; every other process start (and sys.modules) is untouched.
+"""
+import multiprocessing
+import multiprocessing.spawn as _spawn
+import threading
+from multiprocessing.context import SpawnContext, SpawnProcess
+
+_launching = threading.local()
+_MAIN_KEYS = ('init_main_from_name', 'init_main_from_path')
+
+
+def _worker_preparation_data(name):
+    data = _worker_preparation_data.wrapped(name)
+    if getattr(_launching, 'worker', False):
+        for key in _MAIN_KEYS:
+            data.pop(key, None)
+    return data
+
+
+# popen_spawn_posix / popen_spawn_win32 look the function up on the module at launch
+if not hasattr(_spawn.get_preparation_data, 'wrapped'):
+    _worker_preparation_data.wrapped = _spawn.get_preparation_data
+    _spawn.get_preparation_data = _worker_preparation_data
+
+
+class _WorkerProcess(SpawnProcess):
+    def start(self):
+        _launching.worker = True
+        try:
+            super().start()
+        finally:
+            _launching.worker = False
+
+
+class _WorkerContext(SpawnContext):
+    Process = _WorkerProcess
+
+
+_context = _WorkerContext()
+
+
+def worker_context() -> multiprocessing.context.BaseContext:
+    """mp_context for ProcessPoolExecutor whose workers skip the parent's entry script"""
+    return _context
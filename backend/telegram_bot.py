@@ -27,10 +27,17 @@ except ImportError:
         db = None
         logger.warning("Database tidak tersedia, fitur whitelist tidak akan berfungsi")
 
+# Pooled keep-alive HTTP client (upstream servers and the local Flask API)
+import upstream_http
+
 # Import clearance_face_search untuk login otomatis
 try:
     from clearance_face_search import ensure_token, call_search, parse_people_from_response
     CLEARANCE_AVAILABLE = True
+    if db is not None:
+        # Identity cache purges from the web admin apply to this process too
+        from clearance_face_search import attach_identity_cache_invalidations
+        attach_identity_cache_invalidations(db)
 except ImportError as e:
     logger.warning(f"clearance_face_search tidak tersedia: {e}")
     CLEARANCE_AVAILABLE = False
@@ -877,18 +884,6 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = update.effective_user.id
     
-    # PENTING: Reset server status untuk setiap pencarian baru
-    # Ini memastikan bot mencoba kedua server untuk setiap pencarian, tidak "mengingat" server sebelumnya
-    try:
-        from clearance_face_search import _server_224_status
-        # Reset status agar bot mencoba server 224 dulu, lalu fallback ke 116 jika perlu
-        _server_224_status['available'] = True  # Assume server 224 tersedia
-        _server_224_status['last_check'] = 0  # Force re-check
-        _server_224_status['consecutive_failures'] = 0  # Reset failures
-        print(f"[TELEGRAM_BOT] 🔄 Reset server status for new search - will try server 224 first", file=sys.stderr)
-    except Exception as e:
-        print(f"[TELEGRAM_BOT] ⚠️ Could not reset server status: {e}", file=sys.stderr)
-    
     # Handle both command args and direct text input
     if context.args and len(context.args) >= 2:
         search_type = context.args[0].lower()
@@ -1073,13 +1068,33 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if backend_dir not in sys.path:
                 sys.path.insert(0, backend_dir)
             
-            from app import get_family_data
+            from app import get_family_data, run_enrichment_branches
             print(f"[TELEGRAM_BOT] ✅ Successfully imported get_family_data", file=sys.stderr)
             
             logger.info(f"🔍 Enriching {len(people)} people with family data...")
             print(f"[TELEGRAM_BOT] 🔍 Enriching {len(people)} people with family data...", file=sys.stderr)
             enriched_count = 0
             
+            # Ambil family data semua orang secara paralel di thread pool (event loop tidak terblokir),
+            # masing-masing dengan batas waktu branch 'family'
+            def _family_branch(person):
+                if not isinstance(person, dict):
+                    return None
+                nik = person.get('ktp_number') or person.get('nik')
+                if not nik:
+                    return None
+                nkk = person.get('family_cert_number') or person.get('nkk') or person.get('nomor_kk') or person.get('family_card_number')
+                results, timings = run_enrichment_branches({'family': (get_family_data, (nik, nkk, token, person))})
+                if timings['family'].get('error'):
+                    raise RuntimeError(timings['family']['error'])
+                return results.get('family')
+            
+            loop = asyncio.get_running_loop()
+            family_results = await asyncio.gather(
+                *[loop.run_in_executor(None, _family_branch, person) for person in people],
+                return_exceptions=True
+            )
+            
             for idx, person in enumerate(people, 1):
                 if isinstance(person, dict):
                     nik = person.get('ktp_number') or person.get('nik')
@@ -1091,8 +1106,10 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             logger.info(f"📋 [{idx}/{len(people)}] Getting family data for: {person_name} (NIK: {nik}, NKK: {nkk or 'None'})")
                             print(f"[TELEGRAM_BOT] 📋 [{idx}/{len(people)}] Getting family data for: {person_name} (NIK: {nik}, NKK: {nkk or 'None'})", file=sys.stderr)
                             
-                            # Coba ambil family data
-                            family_data = get_family_data(nik, nkk, token, person)
+                            # Family data sudah diambil paralel di atas
+                            family_data = family_results[idx - 1]
+                            if isinstance(family_data, Exception):
+                                raise family_data
                             if family_data:
                                 # Log struktur family_data untuk debugging
                                 logger.info(f"📊 [{idx}/{len(people)}] Family data structure: {type(family_data)}, keys: {list(family_data.keys()) if isinstance(family_data, dict) else 'not dict'}")
@@ -1206,7 +1223,7 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             if not search_response or (hasattr(search_response, 'status_code') and search_response.status_code != 200):
                                 try:
                                     print(f"[TELEGRAM_BOT] 🔄 Using direct requests for universal search", file=sys.stderr)
-                                    search_response = requests.get(search_url, timeout=15)
+                                    search_response = upstream_http.get(search_url, timeout=15)
                                 except Exception as e:
                                     print(f"[TELEGRAM_BOT] ❌ Direct request also failed: {e}", file=sys.stderr)
                                     continue
@@ -1936,7 +1953,7 @@ async def check_phone_from_database(update: Update, context: ContextTypes.DEFAUL
             print(f"[TELEGRAM_BOT] 📱 Phone number to search: {phone_number}", file=sys.stderr)
             
             # Increase timeout untuk database besar (30 juta record mungkin membutuhkan waktu lebih lama)
-            response = requests.get(
+            response = upstream_http.get(
                 local_api_url,
                 params={'phone': phone_number},
                 timeout=120  # 120 detik untuk query database besar
@@ -3193,7 +3210,7 @@ async def reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
         
         # Get reports
-        reports_response = requests.get(
+        reports_response = upstream_http.get(
             f"{API_BASE_URL}/api/profiling/reports",
             headers={
                 'Authorization': f'Bearer {session_token}',
@@ -3645,7 +3662,7 @@ async def show_profiling_detail(query, profiling_id: str):
         
         # Get profiling data detail
         # Try using profiling-data endpoint
-        response = requests.get(
+        response = upstream_http.get(
             f"{API_BASE_URL}/api/profiling-data",
             headers={
                 'Authorization': f'Bearer {session_token}',
@@ -3712,7 +3729,7 @@ async def show_report_detail(query, report_id: str):
                 return
         
         # Get report detail
-        response = requests.get(
+        response = upstream_http.get(
             f"{API_BASE_URL}/api/profiling/reports/{report_id}",
             headers={
                 'Authorization': f'Bearer {session_token}',
@@ -0,0 +1,123 @@
+"""
+Bounded in-memory LRU cache with per-entry TTL (thread-safe)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """LRU cache whose entries also expire after a time-to-live.
+
+    The least recently used entry is evicted once ``max_size`` is reached,
+    or once the total ``weigher(value)`` of all entries exceeds ``max_weight``
+    (e.g. bytes, when values differ a lot in size). All operations take a
+    single lock, so one instance can be shared by the Flask worker threads.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60, max_weight: int = 0,
+                 weigher: Optional[Callable[[Any], int]] = None):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.max_weight = max(0, max_weight) if weigher else 0
+        self._weigher = weigher if self.max_weight else None
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._weights = {}  # key -> weight (only with max_weight)
+        self._weight = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _pop(self, key: Hashable):
+        """Remove key (lock held)"""
+        del self._data[key]
+        if self._weigher:
+            self._weight -= self._weights.pop(key, 0)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return cached value or default if missing/expired"""
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                self._misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self._pop(key)
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def contains(self, key: Hashable) -> bool:
+        """True if key is cached and not expired (does not touch hit/miss counters)"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store value; ttl overrides the cache default for this entry"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        weight = self._weigher(value) if self._weigher else 0
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            if weight > self.max_weight > 0:
+                return  # larger than the whole cache
+            self._data[key] = (time.monotonic() + ttl, value)
+            if self._weigher:
+                self._weights[key] = weight
+                self._weight += weight
+            while len(self._data) > self.max_size or (self.max_weight and self._weight > self.max_weight):
+                self._pop(next(iter(self._data)))
+                self._evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._pop(key)
+            return True
+
+    def delete_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Delete all entries for which predicate(key, value) is true"""
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for k in keys:
+                self._pop(k)
+            return len(keys)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            self._weights.clear()
+            self._weight = 0
+            return count
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict:
+        """Snapshot of cache metrics"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'weight': self._weight,
+                'max_weight': self.max_weight,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+            }
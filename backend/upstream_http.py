@@ -0,0 +1,238 @@
+"""
+Shared HTTP client for the upstream servers (224, 116, alternative server,
+phone/family API, samsat, ...).
+
+Every origin (scheme://host:port) gets one pooled keep-alive adapter, so
+repeated calls reuse TCP connections instead of opening a new one each time.
+Plain calls go through upstream_http.get/post; code that needs its own cookie
+jar (login sessions) uses new_session(), which mounts the same pooled adapters.
+
+At most UPSTREAM_MAX_CONCURRENCY_PER_HOST requests per host are in flight at
+once across the whole process; further requests wait for a free slot, for at
+most the connect part of their timeout (then HostSlotTimeout is raised).
+"""
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass  # dotenv not available, use system environment variables
+
+POOL_MAXSIZE = int(os.environ.get("UPSTREAM_POOL_MAXSIZE", "20"))
+RETRY_TOTAL = int(os.environ.get("UPSTREAM_RETRY_TOTAL", "2"))
+RETRY_CONNECT = int(os.environ.get("UPSTREAM_RETRY_CONNECT", "1"))
+RETRY_BACKOFF = float(os.environ.get("UPSTREAM_RETRY_BACKOFF", "0.3"))
+RETRY_STATUS = (502, 503, 504)
+MAX_CONCURRENCY_PER_HOST = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY_PER_HOST", str(POOL_MAXSIZE)))
+
+
+def _retry_policy(enabled: bool) -> Retry:
+    if not enabled:
+        return Retry(total=0, connect=0, read=0, status=0, redirect=5, raise_on_status=False)
+    # Reads are not retried: a slow upstream should fail fast, not take 3x as long.
+    # Status retries only for idempotent methods (login POSTs are never repeated).
+    return Retry(
+        total=RETRY_TOTAL,
+        connect=RETRY_CONNECT,
+        read=0,
+        status=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+
+
+class HostSlotTimeout(requests.exceptions.Timeout):
+    """No free per-host slot within the request's connect timeout"""
+
+
+def _connect_timeout(timeout):
+    """Connect part of a requests timeout (number, (connect, read) or urllib3 Timeout); None = no limit"""
+    if isinstance(timeout, tuple):
+        timeout = timeout[0]
+    connect = getattr(timeout, 'connect_timeout', timeout)
+    return connect if isinstance(connect, (int, float)) else None
+
+
+class _HostSlots:
+    """Caps concurrent requests to one host (shared by its retry/no-retry adapters)"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._semaphore = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_total = 0.0
+        self.timeouts = 0
+
+    def acquire(self, timeout=None) -> bool:
+        """Take a slot, waiting at most timeout seconds (None = no limit); False if none freed up"""
+        if self._semaphore.acquire(blocking=False):
+            return True
+        started = time.monotonic()
+        acquired = self._semaphore.acquire(timeout=timeout)
+        with self._lock:
+            self.waits += 1
+            self.wait_total += time.monotonic() - started
+            if not acquired:
+                self.timeouts += 1
+        return acquired
+
+    def release(self):
+        self._semaphore.release()
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that keeps per-origin request metrics"""
+
+    def __init__(self, origin: str, retry: bool, slots: _HostSlots):
+        self.origin = origin
+        self.slots = slots
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.elapsed_total = 0.0
+        super().__init__(pool_connections=1, pool_maxsize=POOL_MAXSIZE,
+                         max_retries=_retry_policy(retry), pool_block=False)
+
+    def send(self, request, **kwargs):
+        if not self.slots.acquire(_connect_timeout(kwargs.get('timeout'))):
+            raise HostSlotTimeout(f"Semua {self.slots.limit} slot ke {self.origin} terpakai", request=request)
+        with self._stats_lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+            history = getattr(getattr(response.raw, 'retries', None), 'history', None)
+            if history:
+                with self._stats_lock:
+                    self.retries += len(history)
+            return response
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+                self.elapsed_total += time.monotonic() - started
+            self.slots.release()
+
+    def stats(self) -> Dict:
+        idle = 0
+        connections = 0
+        for pool in list(self.poolmanager.pools.values()):
+            connections += getattr(pool, 'num_connections', 0)
+            if getattr(pool, 'pool', None) is not None:
+                # Idle slots hold either a kept-alive connection or None
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        with self._stats_lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'connections_opened': connections,
+                'idle_connections': idle,
+                'pool_maxsize': POOL_MAXSIZE,
+                'avg_ms': round(self.elapsed_total / self.requests * 1000, 1) if self.requests else 0.0,
+                'max_concurrency': self.slots.limit,
+                'slot_waits': self.slots.waits,
+                'slot_wait_ms': round(self.slots.wait_total * 1000, 1),
+                'slot_timeouts': self.slots.timeouts,
+            }
+
+
+_lock = threading.Lock()
+_adapters = {}   # (origin, retry) -> _PooledAdapter
+_host_slots = {}  # origin -> _HostSlots
+_sessions = {}   # (origin, retry) -> shared cookie-less Session
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def get_adapter(url: str, retry: bool = True) -> _PooledAdapter:
+    """Pooled adapter for the origin of url (created on first use)"""
+    key = (_origin(url), retry)
+    adapter = _adapters.get(key)
+    if adapter is None:
+        with _lock:
+            adapter = _adapters.get(key)
+            if adapter is None:
+                slots = _host_slots.get(key[0])
+                if slots is None:
+                    slots = _host_slots[key[0]] = _HostSlots(MAX_CONCURRENCY_PER_HOST)
+                adapter = _PooledAdapter(key[0], retry, slots)
+                _adapters[key] = adapter
+    return adapter
+
+
+def _shared_session(url: str, retry: bool) -> requests.Session:
+    key = (_origin(url), retry)
+    session = _sessions.get(key)
+    if session is None:
+        adapter = get_adapter(url, retry)
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                # Shared between requests of different users: never keep cookies
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                session.mount(key[0] + '/', adapter)
+                _sessions[key] = session
+    return session
+
+
+def request(method: str, url: str, retry: bool = True, **kwargs) -> requests.Response:
+    """Like requests.request, but over the pooled keep-alive connection for url's host.
+
+    retry=False disables connect/status retries (health checks, probes).
+    """
+    return _shared_session(url, retry).request(method, url, **kwargs)
+
+
+def get(url: str, retry: bool = True, **kwargs) -> requests.Response:
+    return request('GET', url, retry=retry, **kwargs)
+
+
+def post(url: str, retry: bool = True, **kwargs) -> requests.Response:
+    return request('POST', url, retry=retry, **kwargs)
+
+
+def new_session(*base_urls: str) -> requests.Session:
+    """New Session with its own cookie jar that reuses the pooled adapters of base_urls"""
+    session = requests.Session()
+    for base_url in base_urls:
+        session.mount(_origin(base_url) + '/', get_adapter(base_url))
+    return session
+
+
+def pool_stats() -> Dict:
+    """Per-origin request and connection-pool metrics"""
+    with _lock:
+        adapters = list(_adapters.items())
+    stats = {}
+    for (origin, retry), adapter in adapters:
+        name = origin if retry else f"{origin} (no-retry)"
+        stats[name] = adapter.stats()
+    return stats
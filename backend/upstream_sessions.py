@@ -0,0 +1,180 @@
+"""
+Authenticated session pools for upstream servers that need a form login
+(server 116, alternative server).
+
+- Single-flight: when no valid session exists, concurrent callers wait for one
+  login instead of all scraping the login page and logging in at once.
+- Proactive refresh: sessions close to their TTL are replaced by a background
+  login while callers keep using the still-valid session.
+- Small pool: up to ``size`` sessions are kept and handed out round-robin, so
+  parallel requests are not serialised on one cookie jar.
+"""
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+
+
+class _Flight:
+    """One in-progress login that other callers can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.session = None
+
+
+class SessionPool:
+    """Pool of logged-in requests.Session objects for one upstream"""
+
+    def __init__(self, name: str, login: Callable[[], Optional[requests.Session]],
+                 ttl: float = 1800, refresh_margin: float = 300, size: int = 2,
+                 login_wait: float = 30, retry_after: float = 30):
+        self.name = name
+        self._login = login
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl / 2)
+        self.size = max(1, size)
+        self.login_wait = login_wait
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._entries = []  # [session, logged_in_at], oldest first
+        self._next = 0
+        self._flight = None
+        self._refreshing = False
+        self._refresh_blocked_until = 0.0
+        self._logins = 0
+        self._login_failures = 0
+        self._coalesced = 0
+        self._refreshes = 0
+        self._invalidations = 0
+
+    def _do_login(self) -> Optional[requests.Session]:
+        try:
+            session = self._login()
+        except Exception as e:
+            print(f"ERROR: [SESSION_POOL] Login {self.name} gagal: {e}", file=sys.stderr)
+            session = None
+        with self._lock:
+            self._logins += 1
+            if session is None:
+                self._login_failures += 1
+        return session
+
+    def _prune_locked(self, now: float):
+        self._entries = [e for e in self._entries if now - e[1] < self.ttl]
+
+    def get(self) -> Optional[requests.Session]:
+        """Return a logged-in session, or None if login failed"""
+        now = time.time()
+        with self._lock:
+            self._prune_locked(now)
+            if self._entries:
+                session = self._entries[self._next % len(self._entries)][0]
+                self._next += 1
+                self._maybe_refresh_locked(now)
+                return session
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            flight.event.wait(self.login_wait)
+            return flight.session
+
+        session = None
+        try:
+            session = self._do_login()
+            with self._lock:
+                if session is not None:
+                    self._entries.append([session, time.time()])
+                    # Fill the rest of the pool in the background
+                    self._maybe_refresh_locked(time.time())
+                else:
+                    self._refresh_blocked_until = time.time() + self.retry_after
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.session = session
+            flight.event.set()
+        return session
+
+    def _needs_refresh_locked(self, now: float) -> bool:
+        if len(self._entries) < self.size:
+            return True
+        return any(now - logged_in_at >= self.ttl - self.refresh_margin
+                   for _, logged_in_at in self._entries)
+
+    def _maybe_refresh_locked(self, now: float):
+        if self._refreshing or now < self._refresh_blocked_until or not self._needs_refresh_locked(now):
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh, name=f"session-refresh-{self.name}", daemon=True).start()
+
+    def _refresh(self):
+        """Log in replacement/extra sessions until the pool is full and fresh"""
+        try:
+            for _ in range(self.size + 1):
+                with self._lock:
+                    now = time.time()
+                    self._prune_locked(now)
+                    if not self._needs_refresh_locked(now):
+                        return
+                session = self._do_login()
+                with self._lock:
+                    if session is None:
+                        self._refresh_blocked_until = time.time() + self.retry_after
+                        return
+                    self._refreshes += 1
+                    self._entries.append([session, time.time()])
+                    if len(self._entries) > self.size:
+                        self._entries.pop(0)  # drop the session closest to expiry
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def invalidate(self, session: Optional[requests.Session] = None) -> int:
+        """Drop one session (e.g. server answered with the login page), or all of them"""
+        with self._lock:
+            before = len(self._entries)
+            if session is None:
+                self._entries = []
+            else:
+                self._entries = [e for e in self._entries if e[0] is not session]
+            removed = before - len(self._entries)
+            self._invalidations += removed
+            return removed
+
+    def stats(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            ages = [round(now - logged_in_at) for _, logged_in_at in self._entries]
+            return {
+                'sessions': len(self._entries),
+                'pool_size': self.size,
+                'ttl': self.ttl,
+                'session_ages': ages,
+                'logins': self._logins,
+                'login_failures': self._login_failures,
+                'coalesced_waits': self._coalesced,
+                'background_refreshes': self._refreshes,
+                'invalidations': self._invalidations,
+                'login_in_progress': self._flight is not None,
+            }
+
+
+_pools = {}
+
+
+def register_pool(pool: SessionPool) -> SessionPool:
+    _pools[pool.name] = pool
+    return pool
+
+
+def session_pool_stats() -> Dict:
+    """Stats of every registered session pool"""
+    return {name: pool.stats() for name, pool in list(_pools.items())}